@@ -3,11 +3,34 @@ from time import sleep
 import threading
 import datetime
 import queue
-import io
 import logging
 from pathlib import Path
 import time
 import re
+import shlex
+from output_buffer import OutputBuffer
+from events import publish
+from recorder import get_recorder
+from metrics import READY_WAIT_SECONDS
+from tracing import traced
+from pipe_reader import READ_CHUNK, LineSplitter, get_pipe_reader
+
+# Start-up noise from aider that is kept out of the output
+IGNORED_OUTPUT = [
+    "Can't initialize prompt toolkit",
+    "Newer aider version",
+    "Run this command to update:",
+    "python.exe -m pip install aider",
+    "cmd.exe?",
+    "Aider v",
+    "Model:",
+    "Git repo:",
+    "Repo-map:",
+    "Use /help"
+]
+
+# A line consisting only of aider's input prompt, e.g. "> " or "architect> "
+PROMPT_PATTERN = re.compile(r'^\s*[\w-]*>\s*$')
 
 def normalize_path(path_str):
     if not path_str:
@@ -20,21 +43,37 @@ def normalize_path(path_str):
         return None
 
 class AgentSession:
-    def __init__(self, workspace_path, task, config=None, aider_commands=None):
+    def __init__(self, workspace_path, task, config=None, aider_commands=None, agent_id=None):
+        self.agent_id = agent_id
         self.workspace_path = normalize_path(workspace_path)
         self.task = task
         self.aider_commands = aider_commands
-        self.output_buffer = io.StringIO()
         self.process = None
         self._stop_event = threading.Event()
         self.session_id = str(uuid.uuid4())[:8]
-        self._buffer_lock = threading.Lock()
+        self._last_output_time = None
+        self._prompt_seen = threading.Event()
+        self._first_output = threading.Event()
+        self._busy_since = None  # When the last command was sent, until aider is ready again
+        self._prompt_tail_at = None  # When an unfinished line started looking like the prompt
+        self._ready_signal = threading.Event()  # Wakes wait_until_ready when aider may be ready
+        self._pipe_reader = None  # Shared reader servicing this session's pipes, if any
         self.aider_commands = aider_commands
         default_config = {
             'stability_duration': 10,
-            'output_buffer_max_length': 10000
+            'startup_timeout': 2,
+            # Seconds an unfinished prompt-shaped line must stay unchanged before it counts
+            # as aider's prompt; streamed replies can pause right after a "> " quote
+            'prompt_debounce': 0.5,
+            'output_buffer_max_length': 10000,
+            'transcript_path': None
         }
         self.config = {**default_config, **(config or {})}
+        self.output_buffer = OutputBuffer(
+            self.config['output_buffer_max_length'],
+            self.config['transcript_path'],
+            on_write=self._publish_output if agent_id else None
+        )
 
     def start(self) -> bool:
         try:
@@ -68,8 +107,9 @@ class AgentSession:
             logging.info(f"Starting Aider with model: {aider_model}")
             logging.info(f"Using prompt suffix: {aider_prompt_suffix}")
 
+            # AIDER_EXECUTABLE swaps in another command, e.g. a fake aider for benchmarks
             cmd = [
-                'aider',
+                *shlex.split(os.getenv('AIDER_EXECUTABLE', 'aider'), posix=sys.platform != 'win32'),
                 '--map-tokens', '2024',
                 '--no-show-model-warnings',
                 '--yes',
@@ -92,54 +132,51 @@ class AgentSession:
                 env=env,
                 creationflags=subprocess.CREATE_NO_WINDOW if sys.platform == 'win32' else 0
             )
-            stdout_thread = threading.Thread(
-                target=self._read_output, 
-                args=(self.process.stdout, "stdout"), 
-                daemon=True,
-                name=f"stdout-{self.session_id}"
-            )
-            stderr_thread = threading.Thread(
-                target=self._read_output, 
-                args=(self.process.stderr, "stderr"), 
-                daemon=True,
-                name=f"stderr-{self.session_id}"
-            )
-            stdout_thread.start()
-            stderr_thread.start()
-            time.sleep(2)
+            # All sessions share one selector thread for their pipes; Windows and
+            # pipes that cannot be selected get a reader thread per pipe instead
+            reader = get_pipe_reader()
+            if reader and reader.register(self.process.stdout, self._handle_line, self._handle_tail):
+                reader.register(self.process.stderr, self._handle_line, self._handle_tail)
+                self._pipe_reader = reader
+            else:
+                stdout_thread = threading.Thread(
+                    target=self._read_output, 
+                    args=(self.process.stdout, "stdout"), 
+                    daemon=True,
+                    name=f"stdout-{self.session_id}"
+                )
+                stderr_thread = threading.Thread(
+                    target=self._read_output, 
+                    args=(self.process.stderr, "stderr"), 
+                    daemon=True,
+                    name=f"stderr-{self.session_id}"
+                )
+                stdout_thread.start()
+                stderr_thread.start()
+            recorder = get_recorder()
+            if recorder:
+                recorder.record('start', self.agent_id, task=self.task)
+            # Give aider until its first line of output, at most startup_timeout, to come up
+            self._first_output.wait(self.config['startup_timeout'])
             return True
         except Exception as e:
             return False
 
     def _read_output(self, pipe, pipe_name):
         try:
-            message_buffer = []
+            fd = pipe.fileno()
+        except (AttributeError, OSError, ValueError):
+            fd = None
+        if isinstance(fd, int):
+            self._read_raw_output(fd)
+            return
+        try:
             while not self._stop_event.is_set() and self.process and self.process.poll() is None:
                 line = pipe.readline()
                 if not line:
                     sleep(0.1)
                     continue
-                if any(msg in line for msg in [
-                    "Can't initialize prompt toolkit",
-                    "Newer aider version",
-                    "Run this command to update:",
-                    "python.exe -m pip install aider",
-                    "cmd.exe?",
-                    "Aider v",
-                    "Model:",
-                    "Git repo:",
-                    "Repo-map:",
-                    "Use /help"
-                ]):
-                    continue
-                if line.strip():
-                    message_buffer.append(line.strip())
-                    if '>' in line or '?' in line:
-                        if message_buffer:
-                            message_buffer = []
-                with self._buffer_lock:
-                    self.output_buffer.seek(0, 2)
-                    self.output_buffer.write(line)
+                self._handle_line(line)
                 try:
                     pipe.flush()
                 except ValueError:
@@ -147,44 +184,137 @@ class AgentSession:
         except Exception as e:
             pass
 
+    def _read_raw_output(self, fd: int) -> None:
+        """Read a pipe in chunks, so a prompt without a trailing newline is noticed"""
+        splitter = LineSplitter()
+        try:
+            while not self._stop_event.is_set():
+                data = os.read(fd, READ_CHUNK)
+                for line in splitter.feed(data, final=not data):
+                    self._handle_line(line)
+                if not data:
+                    break
+                if splitter.tail:
+                    self._handle_tail(splitter.tail)
+        except Exception as e:
+            pass
+
+    def _handle_line(self, line: str) -> None:
+        """Take one line of aider output into the buffer, dropping start-up noise"""
+        if self._stop_event.is_set() or any(msg in line for msg in IGNORED_OUTPUT):
+            return
+        self.output_buffer.write(line)
+        self._record_output(line)
+
+    def _handle_tail(self, tail: str) -> None:
+        """Note unfinished output that may be aider's prompt, which input() prints without a newline"""
+        if self._stop_event.is_set():
+            return
+        now = time.monotonic()
+        self._last_output_time = now
+        self._first_output.set()
+        if PROMPT_PATTERN.match(tail):
+            self._prompt_tail_at = now
+            self._ready_signal.set()
+        else:
+            self._prompt_tail_at = None
+
+    def _publish_output(self, text: str, start: int, end: int) -> None:
+        """Push an output chunk to live dashboard listeners"""
+        publish('output', {'agent_id': self.agent_id, 'text': text, 'start': start, 'end': end})
+
+    def _record_output(self, line: str) -> None:
+        """Stamp the time of the latest output and track whether aider is showing its prompt"""
+        self._last_output_time = time.monotonic()
+        self._first_output.set()
+        self._prompt_tail_at = None
+        if PROMPT_PATTERN.match(line):
+            self._prompt_seen.set()
+            self._ready_signal.set()
+        elif line.strip():
+            self._prompt_seen.clear()
+        recorder = get_recorder()
+        if recorder:
+            recorder.record_output(self.agent_id, line)
+
     def get_output(self):
         try:
-            pos = self.output_buffer.tell()
-            self.output_buffer.seek(0)
-            output = self.output_buffer.read()
-            self.output_buffer.seek(pos)
-            return output
+            return self.output_buffer.getvalue()
         except Exception as e:
             pass
 
+    def output_cursor(self) -> int:
+        """Cursor pointing past the latest output, for use with read_output_since"""
+        return self.output_buffer.tell()
+
+    def output_window(self):
+        """Return (output, offset) where offset is the cursor of the first retained character"""
+        return self.output_buffer.read_window()
+
+    def read_output_since(self, cursor: int = 0):
+        """Return (new_output, next_cursor) for output written after cursor"""
+        return self.output_buffer.read_since(cursor)
+
     def _echo_message(self, message: str) -> None:
         try:
             # Create a user message with proper formatting
             formatted_message = f"User: {message}"
             echo_line = self._format_output_line(formatted_message)
             echo_line = echo_line.replace('output-line', 'output-line user-message')
-            with self._buffer_lock:
-                self.output_buffer.seek(0, 2)
-                self.output_buffer.write(echo_line)
+            self.output_buffer.write(echo_line)
         except Exception as e:
             logging.error(f"Error echoing message: {e}")
 
+    def seconds_since_output(self):
+        """Seconds since aider last produced output, or None if it has produced none"""
+        if self._last_output_time is None:
+            return None
+        return time.monotonic() - self._last_output_time
+
+    def _prompt_tail_wait(self):
+        """Seconds until the unfinished prompt-shaped line counts as the prompt, 0 once it does, None without one"""
+        tail_at = self._prompt_tail_at
+        if tail_at is None:
+            return None
+        return max(0.0, tail_at + self.config['prompt_debounce'] - time.monotonic())
+
     def is_ready(self) -> bool:
+        """Check without waiting whether aider is at its prompt or has been quiet for stability_duration"""
         try:
-            stability_duration = self.config['stability_duration']
-            initial_output = self.get_output()
-            if not initial_output or initial_output.isspace():
-                return True
-            start_time = time.time()
-            while time.time() - start_time < stability_duration:
-                time.sleep(1)
-                current_output = self.get_output()
-                if current_output != initial_output:
-                    return False
-            return True
+            if self._prompt_seen.is_set() or self._prompt_tail_wait() == 0:
+                ready = True
+            else:
+                idle_for = self.seconds_since_output()
+                ready = idle_for is None or idle_for >= self.config['stability_duration']
+            busy_since = self._busy_since
+            if ready and busy_since is not None:
+                self._busy_since = None
+                READY_WAIT_SECONDS.observe(time.monotonic() - busy_since)
+            return ready
         except Exception as e:
             return False
 
+    def wait_until_ready(self, timeout: float = None) -> bool:
+        """Block until is_ready() holds or the timeout expires"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            # Cleared before checking, so a prompt arriving in between still wakes the wait
+            self._ready_signal.clear()
+            if self.is_ready():
+                return True
+            idle_for = self.seconds_since_output() or 0
+            wait_for = self.config['stability_duration'] - idle_for
+            tail_wait = self._prompt_tail_wait()
+            if tail_wait is not None:
+                wait_for = min(wait_for, tail_wait)
+            if deadline is not None:
+                wait_for = min(wait_for, deadline - time.monotonic())
+                if wait_for <= 0:
+                    return False
+            # Wakes early when the prompt appears
+            self._ready_signal.wait(max(wait_for, 0.01))
+
+    @traced('send_message')
     def send_message(self, message: str, timeout: int = 10) -> bool:
         try:
             if not self.process or self.process.poll() is not None:
@@ -193,10 +323,16 @@ class AgentSession:
                 else:
                     return False
             sanitized_message = message.replace('"', '\\"')
-            with self._buffer_lock:
-                self.output_buffer.seek(0, 2)
+            # Aider is busy until it prints its prompt again or goes quiet. Reset before
+            # writing, so a prompt printed right after the command is not wiped out
+            self._prompt_seen.clear()
+            self._prompt_tail_at = None
+            self._last_output_time = self._busy_since = time.monotonic()
             self.process.stdin.write(sanitized_message + "\n")
             self.process.stdin.flush()
+            recorder = get_recorder()
+            if recorder:
+                recorder.record_action(self.agent_id, message)
             return True
         except (BrokenPipeError, IOError) as pipe_error:
             return False
@@ -229,6 +365,11 @@ class AgentSession:
     def cleanup(self) -> None:
         try:
             self._stop_event.set()
+            if self.process and self._pipe_reader:
+                # Let go of the pipes before they are closed below
+                self._pipe_reader.unregister(self.process.stdout)
+                self._pipe_reader.unregister(self.process.stderr)
+                self._pipe_reader = None
             if self.process:
                 try:
                     if self.process.stdin:
@@ -247,5 +388,6 @@ class AgentSession:
                         self.process.stderr.close()
                 except Exception as pipe_close_error:
                     pass
+            self.output_buffer.close()
         except Exception as e:
             pass
@@ -1,32 +1,45 @@
 import logging
 import sqlite3
 from pathlib import Path
-from flask import Flask, render_template, request, jsonify, send_from_directory
+from flask import Flask, Response, render_template, request, jsonify, send_from_directory
 from werkzeug.serving import WSGIRequestHandler
 
 # Database configuration
 DATABASE_PATH = Path("tasks.db")
+# Seconds between keepalive comments on idle event streams
+SSE_KEEPALIVE_SECONDS = 15
 
 # Custom log filter to suppress specific log messages
 class TasksJsonLogFilter(logging.Filter):
     def filter(self, record):
         # Suppress log messages for tasks.json requests
-        return not ('/tasks/tasks.json' in record.getMessage())
+        message = record.getMessage()
+        return not ('/tasks/tasks.json' in message or '/events' in message)
 from orchestrator import (
-    initialiseCodingAgent, 
+    provision_agent,
+    DEFAULT_AGENTS_PER_TASK,
     main_loop, 
     load_tasks, 
+    load_tasks_since,
     save_tasks, 
     delete_agent,
     aider_sessions  # Add this import
 )
+from database import get_history, get_state_version, invalidate_model_config, get_usage_summary, USAGE_GROUPS
+from events import event_bus, format_sse
+from provisioning import ProvisioningPool
+from context_builder import DEFAULT_CONTEXT_TOKEN_BUDGET
+from metrics import registry as metrics_registry, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from tracing import tracer, to_chrome, to_otlp
 import os
 import threading
 import json
+import uuid
 from pathlib import Path
 import datetime
 
 app = Flask(__name__)
+provisioning_pool = ProvisioningPool()
 
 # Configure basic logging
 logging.basicConfig(
@@ -45,11 +58,78 @@ for handler in logging.getLogger().handlers:
 def index():
     return render_template('index.html')
 
+def parse_output_offsets(value):
+    """Parse an offsets query parameter of the form id:end,id:end."""
+    offsets = {}
+    for item in (value or '').split(','):
+        agent_id, _, end = item.rpartition(':')
+        if agent_id and end.isdigit():
+            offsets[agent_id] = int(end)
+    return offsets
+
+def apply_output_delta(agent, known_end):
+    """Replace an agent's output with the part past known_end when the client holds the rest."""
+    output = agent.get('aider_output') or ''
+    start = agent.get('output_offset') or 0
+    agent['output_end'] = start + len(output)
+    if known_end is not None and start <= known_end <= agent['output_end']:
+        agent['aider_output_append'] = output[known_end - start:]
+        del agent['aider_output']
+
 @app.route('/tasks/tasks.json')
 def serve_tasks_json():
-    """Serve tasks data in JSON format from database."""
-    tasks_data = load_tasks()
-    return jsonify(tasks_data)
+    """Serve tasks data in JSON format from database.
+
+    The ETag is the state version, so unchanged polls get a 304. With
+    ?since=<version> only agents changed after that version are sent, and
+    ?offsets=<id>:<end>,... sends each agent's output as an append past the
+    end the client already has. ?output=0 leaves agent output out.
+    """
+    version = get_state_version()
+    if request.if_none_match.contains(str(version)):
+        response = app.response_class(status=304)
+        response.set_etag(str(version))
+        return response
+
+    since = request.args.get('since', type=int)
+    if since is not None and 0 <= since <= version:
+        tasks_data = load_tasks_since(since)
+    else:
+        tasks_data = load_tasks()
+    offsets = parse_output_offsets(request.args.get('offsets'))
+    include_output = request.args.get('output', '1') != '0'
+    for agent_id, agent in tasks_data.get('agents', {}).items():
+        if include_output:
+            apply_output_delta(agent, offsets.get(agent_id))
+        else:
+            agent.pop('aider_output', None)
+    tasks_data['version'] = version
+
+    response = jsonify(tasks_data)
+    response.set_etag(str(version))
+    return response
+
+@app.route('/events')
+def events():
+    """Stream agent output chunks and state changes as Server-Sent Events."""
+    subscription = event_bus.subscribe()
+
+    def stream():
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                event = subscription.get(timeout=SSE_KEEPALIVE_SECONDS)
+                if event is None:
+                    yield ': keepalive\n\n'
+                    continue
+                yield format_sse(event)
+        finally:
+            event_bus.unsubscribe(subscription)
+
+    return Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
 
 @app.route('/agents')
 def agent_view():
@@ -76,8 +156,38 @@ def agent_view():
     # Save updated tasks data
     save_tasks(tasks_data)
     
+    # Token and cost totals for each agent's card
+    usage = {row['name']: row for row in get_usage_summary('agent')}
+    
     return render_template('agent_view.html', 
-                           agents=agents)
+                           agents=agents,
+                           usage=usage)
+
+@app.route('/agents/<agent_id>/history/<kind>')
+def agent_history(agent_id, kind):
+    """Serve a page of an agent's progress or thought history."""
+    if kind not in ('progress', 'thought'):
+        return jsonify({'success': False, 'error': f'Unknown history kind: {kind}'}), 400
+    limit = min(request.args.get('limit', 50, type=int), 500)
+    before = request.args.get('before', type=int)
+    entries = get_history(agent_id, kind, limit=limit, before_id=before)
+    return jsonify({
+        'success': True,
+        'entries': entries,
+        'next_before': entries[0]['id'] if len(entries) == limit else None
+    })
+
+def check_and_start_main_loop():
+    """Start the orchestrator main loop thread if it is not already running."""
+    # Check if main loop thread is already running
+    for thread in threading.enumerate():
+        if thread.name == 'OrchestratorMainLoop':
+            return
+    
+    # Start main loop if not running
+    thread = threading.Thread(target=main_loop, name='OrchestratorMainLoop')
+    thread.daemon = True
+    thread.start()
 
 @app.route('/create_agent', methods=['POST'])
 def create_agent():
@@ -108,67 +218,34 @@ def create_agent():
         if isinstance(tasks, str):
             tasks = [tasks]
         
-        # Load existing tasks
-        tasks_data = load_tasks()
-        
-        # Initialize agents for each task
-        created_agents = []
+        # Set environment variable for repo URL
+        os.environ['REPOSITORY_URL'] = repo_url
+
+        # One provisioning spec per agent, run in parallel in the background
+        specs = []
         for task_description in tasks:
-            # Set environment variable for repo URL
-            os.environ['REPOSITORY_URL'] = repo_url
-            
-            app.logger.info(f"Attempting to initialize agent for task: {task_description}")
-            
-            # Initialize agent with specified number of agents per task
-            try:
-                # task_text = f"{task_description['title']}\n\nDetails:\n{task_description['description']}"
-                task_text = task_description['title']
-                if (task_description['description']):
-                    task_text += f"\n\n{task_description['description']}"
-                agent_ids = initialiseCodingAgent(
-                    repository_url=repo_url, 
-                    task_description=task_text,
-                    num_agents=num_agents,
-                    aider_commands=aider_commands # Pass aider commands
-                )
-                
-                if agent_ids:
-                    created_agents.extend(agent_ids)
-                    # Add task to tasks list if not already present
-                    if task_description not in tasks_data['tasks']:
-                        tasks_data['tasks'].append(task_description)
-                else:
-                    app.logger.warning(f"Failed to create agents for task: {task_description}")
-            except Exception as task_error:
-                app.logger.error(f"Error initializing agent for task {task_description}: {task_error}", exc_info=True)
-        
-        # Start main loop in a separate thread if not already running
-        def check_and_start_main_loop():
-            # Check if main loop thread is already running
-            for thread in threading.enumerate():
-                if thread.name == 'OrchestratorMainLoop':
-                    return
-            
-            # Start main loop if not running
-            thread = threading.Thread(target=main_loop, name='OrchestratorMainLoop')
-            thread.daemon = True
-            thread.start()
-        
+            task_text = task_description['title']
+            if (task_description['description']):
+                task_text += f"\n\n{task_description['description']}"
+            for _ in range(num_agents or DEFAULT_AGENTS_PER_TASK):
+                specs.append({
+                    'agent_id': str(uuid.uuid4()),
+                    'repository_url': repo_url,
+                    'task_description': task_text,
+                    'aider_commands': aider_commands
+                })
+        job = provisioning_pool.submit(provision_agent, specs)
+        app.logger.info(f"Queued provisioning job {job['id']} for {len(specs)} agents")
+
         check_and_start_main_loop()
-        
-        if created_agents:
-            app.logger.info(f"Successfully created agents: {created_agents}")
-            return jsonify({
-                'success': True,
-                'agent_ids': created_agents,
-                'message': f'Agents {", ".join(created_agents)} created successfully'
-            })
-        else:
-            app.logger.error("Failed to create any agents")
-            return jsonify({
-                'success': False,
-                'error': 'Failed to create any agents'
-            }), 500
+
+        return jsonify({
+            'success': True,
+            'job_id': job['id'],
+            'agent_ids': [agent['agent_id'] for agent in job['agents']],
+            'agents': job['agents'],
+            'message': f'Provisioning {len(specs)} agents'
+        }), 202
             
     except Exception as e:
         # Log the full exception details
@@ -178,6 +255,50 @@ def create_agent():
             'error': str(e)
         }), 500
 
+@app.route('/jobs/<job_id>')
+def provisioning_job(job_id):
+    """Serve the per-agent status of a provisioning job."""
+    job = provisioning_pool.get(job_id)
+    if not job:
+        return jsonify({'success': False, 'error': f'Job {job_id} not found'}), 404
+    return jsonify({'success': True, 'job': job})
+
+@app.route('/usage')
+def usage_summary():
+    """Serve LLM token, cost and latency totals per agent, task and model.
+
+    ?group_by= limits the response to one grouping and ?agent_id= to one agent.
+    """
+    group_by = request.args.get('group_by')
+    if group_by and group_by not in USAGE_GROUPS:
+        return jsonify({'success': False, 'error': f'Unknown grouping: {group_by}'}), 400
+    agent_id = request.args.get('agent_id')
+    groups = [group_by] if group_by else ['agent', 'task', 'model']
+    return jsonify({
+        'success': True,
+        'usage': {group: get_usage_summary(group, agent_id=agent_id) for group in groups}
+    })
+
+@app.route('/metrics')
+def metrics():
+    """Serve orchestrator metrics in the Prometheus text format."""
+    return Response(metrics_registry.render(), content_type=METRICS_CONTENT_TYPE)
+
+TRACE_FORMATS = {'otlp': to_otlp, 'chrome': to_chrome}
+
+@app.route('/traces')
+def traces():
+    """Serve recent agent step traces as OTLP/JSON or in the Chrome trace format.
+
+    ?format=chrome selects the format, ?agent_id= limits the traces to one agent
+    and ?limit= to the most recent ones.
+    """
+    export = TRACE_FORMATS.get(request.args.get('format', 'otlp'))
+    if export is None:
+        return jsonify({'success': False, 'error': f"Unknown format: {request.args.get('format')}"}), 400
+    limit = request.args.get('limit', type=int)
+    return jsonify(export(tracer.traces(agent_id=request.args.get('agent_id'), limit=limit)))
+
 @app.route('/config/models', methods=['POST'])
 def update_model_config():
     """Update the model configuration for orchestrator, aider and agent."""
@@ -194,6 +315,16 @@ def update_model_config():
         # Get existing config to preserve aider_prompt_suffix if not provided
         existing_config = get_model_config()
         aider_prompt_suffix = data.get('aider_prompt_suffix', existing_config.get('aider_prompt_suffix', ''))
+        context_token_budget = data.get(
+            'context_token_budget',
+            existing_config.get('config', {}).get('context_token_budget', DEFAULT_CONTEXT_TOKEN_BUDGET)
+        )
+        try:
+            context_token_budget = int(context_token_budget)
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'error': 'context_token_budget must be an integer'}), 400
+        if context_token_budget <= 0:
+            return jsonify({'success': False, 'error': 'context_token_budget must be positive'}), 400
         
         # Save to database
         with sqlite3.connect(DATABASE_PATH) as conn:
@@ -205,17 +336,19 @@ def update_model_config():
             cursor.execute("""
                 INSERT INTO model_config (
                     orchestrator_model, aider_model, agent_model, 
-                    aider_prompt_suffix, created_at, updated_at
-                ) VALUES (?, ?, ?, ?, ?, ?)
+                    aider_prompt_suffix, context_token_budget, created_at, updated_at
+                ) VALUES (?, ?, ?, ?, ?, ?, ?)
             """, (
                 data['orchestrator_model'],
                 data['aider_model'],
                 data['agent_model'],
                 aider_prompt_suffix,
+                context_token_budget,
                 datetime.datetime.now().isoformat(),
                 datetime.datetime.now().isoformat()
             ))
             conn.commit()
+        invalidate_model_config()
             
         return jsonify({
             'success': True,
@@ -240,14 +373,16 @@ def get_model_config():
             if config:
                 config_dict = dict(config)
                 # Ensure all required fields are present
-                required_fields = ['orchestrator_model', 'aider_model', 'agent_model', 'aider_prompt_suffix']
+                required_fields = ['orchestrator_model', 'aider_model', 'agent_model', 'aider_prompt_suffix',
+                                   'context_token_budget']
                 for field in required_fields:
                     if field not in config_dict:
                         config_dict[field] = {
                             'orchestrator_model': 'openrouter/google/gemini-flash-1.5',
                             'aider_model': 'openrouter/google/gemini-flash-1.5',
                             'agent_model': 'openrouter/google/gemini-flash-1.5',
-                            'aider_prompt_suffix': ''
+                            'aider_prompt_suffix': '',
+                            'context_token_budget': DEFAULT_CONTEXT_TOKEN_BUDGET
                         }[field]
                 return {
                     'success': True,
@@ -261,7 +396,8 @@ def get_model_config():
                         'orchestrator_model': 'openrouter/google/gemini-flash-1.5',
                         'aider_model': 'openrouter/google/gemini-flash-1.5',
                         'agent_model': 'openrouter/google/gemini-flash-1.5',
-                        'aider_prompt_suffix': ''
+                        'aider_prompt_suffix': '',
+                        'context_token_budget': DEFAULT_CONTEXT_TOKEN_BUDGET
                     }
                 }
     except Exception as e:
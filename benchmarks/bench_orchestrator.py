@@ -0,0 +1,247 @@
+"""End-to-end throughput benchmark for the orchestrator loop, fully offline
+
+Runs main_loop against N fake aider processes and the mock LLM provider and
+reports agent steps per second, step latency, database writes and memory.
+
+    python benchmarks/bench_orchestrator.py --agents 20 --duration 30 --llm-latency lognormal:0.3,0.5
+
+Everything runs in a temporary directory, so the real tasks.db is untouched.
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKE_AIDER = os.path.join(REPO_ROOT, 'benchmarks', 'fake_aider.py')
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--agents', type=int, default=10, help='number of fake aider sessions')
+    parser.add_argument('--duration', type=float, default=20.0, help='seconds to run the loop for')
+    parser.add_argument('--llm-latency', default='0.2', help='mock LLM latency spec, e.g. 0.2 or lognormal:0.3,0.5')
+    parser.add_argument('--aider-delay', type=float, default=0.05, help='seconds the fake aider takes per command')
+    parser.add_argument('--interval', type=float, default=0.5, help='orchestrator CHECK_INTERVAL in seconds')
+    parser.add_argument('--batch-size', type=int, default=1, help='agents decided per LLM request')
+    parser.add_argument('--concurrency', type=int, default=8, help='agent steps running at once')
+    parser.add_argument('--llm-rate', type=float, default=None,
+                        help='LLM requests per second per model (default: the dispatcher default)')
+    parser.add_argument('--seed', type=int, default=0, help='mock LLM seed')
+    parser.add_argument('--log-level', default='warning', help='logging level while the loop runs')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    return parser.parse_args(argv)
+
+class LoopStats:
+    """Step, latency and database write counts gathered while the loop runs"""
+
+    def __init__(self):
+        self.steps = 0
+        self.db_writes = 0
+        self.latencies = []
+        self.lock = threading.Lock()
+
+def prepare(workdir, env, log_level='warning'):
+    """Point the process at workdir and env before the project modules are imported"""
+    os.environ.update(env)
+    # The database lives in the working directory, so move before importing the project
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_ROOT)
+    logging.basicConfig(level=getattr(logging, log_level.upper()), force=True)
+    tracemalloc.start()
+
+def register_agents(sessions):
+    """Add started sessions to the orchestrator and their agents to the database"""
+    import database
+    import orchestrator
+    from prompt_processor import PromptProcessor
+
+    agents = {}
+    now = time.strftime('%Y-%m-%dT%H:%M:%S')
+    for agent_id, session in sessions.items():
+        orchestrator.aider_sessions[agent_id] = session
+        orchestrator.prompt_processors[agent_id] = PromptProcessor()
+        agents[agent_id] = {
+            'workspace': session.workspace_path,
+            'repo_path': session.workspace_path,
+            'task': session.task,
+            'status': 'active',
+            'created_at': now,
+            'last_updated': now,
+            'aider_output': '',
+            'pr_url': None,
+        }
+    database.save_agents(agents)
+
+def instrument():
+    """Wrap orchestrator steps and writes so they are timed and counted
+
+    A step's latency runs from the start of the step, or of its batch, until its
+    decision has been applied. Steps that return at once because aider is still
+    busy make no decision and are not sampled.
+    """
+    import orchestrator
+
+    stats = LoopStats()
+    current = threading.local()
+
+    def step_start(fn):
+        def wrapper(*a, **kw):
+            # A batch's fallback steps are timed from the start of the batch
+            if getattr(current, 'start', None) is not None:
+                return fn(*a, **kw)
+            current.start = time.perf_counter()
+            try:
+                return fn(*a, **kw)
+            finally:
+                current.start = None
+        return wrapper
+
+    def decided(fn):
+        def wrapper(*a, **kw):
+            try:
+                return fn(*a, **kw)
+            finally:
+                start = getattr(current, 'start', None)
+                with stats.lock:
+                    stats.steps += 1
+                    if start is not None:
+                        stats.latencies.append(time.perf_counter() - start)
+        return wrapper
+
+    def counted(fn, field):
+        def wrapper(*a, **kw):
+            with stats.lock:
+                setattr(stats, field, getattr(stats, field) + 1)
+            return fn(*a, **kw)
+        return wrapper
+
+    orchestrator.process_agent_step = step_start(orchestrator.process_agent_step)
+    orchestrator.process_agent_batch = step_start(orchestrator.process_agent_batch)
+    orchestrator.apply_agent_decision = decided(orchestrator.apply_agent_decision)
+    orchestrator.save_agents = counted(orchestrator.save_agents, 'db_writes')
+    return stats
+
+def run_loop(stats, duration, finished=None):
+    """Run main_loop for duration seconds, or until finished() holds; returns the report"""
+    import database
+    import orchestrator
+
+    db_path = str(database.DATABASE_PATH.resolve())
+    db_start = file_size(db_path) + file_size(db_path + '-wal')
+    threading.Thread(target=orchestrator.main_loop, daemon=True, name='bench-main-loop').start()
+    started = time.monotonic()
+    while time.monotonic() - started < duration:
+        if finished and finished():
+            break
+        time.sleep(0.1)
+    elapsed = time.monotonic() - started
+
+    with stats.lock:
+        steps = stats.steps
+        db_writes = stats.db_writes
+        step_latencies = list(stats.latencies)
+    current, peak = tracemalloc.get_traced_memory()
+    for session in orchestrator.aider_sessions.values():
+        session.cleanup()
+
+    # ru_maxrss is kilobytes on Linux and bytes on macOS
+    max_rss = None
+    if resource:
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform != 'darwin':
+            max_rss *= 1024
+    return {
+        'duration_s': round(elapsed, 2),
+        'steps': steps,
+        'steps_per_s': round(steps / elapsed, 3) if elapsed else 0.0,
+        'step_p50_ms': round(percentile(step_latencies, 50) * 1000, 1),
+        'step_p99_ms': round(percentile(step_latencies, 99) * 1000, 1),
+        'db_writes': db_writes,
+        'db_growth_bytes': file_size(db_path) + file_size(db_path + '-wal') - db_start,
+        'py_heap_peak_bytes': peak,
+        'max_rss_bytes': max_rss,
+    }
+
+def configure(args, interval):
+    import database
+    import orchestrator
+
+    database.save_config('max_concurrent_agents', str(args.concurrency))
+    database.save_config('decision_batch_size', str(args.batch_size))
+    if args.llm_rate:
+        database.save_config('llm_rate_per_second', str(args.llm_rate))
+    orchestrator.CHECK_INTERVAL = interval
+
+def print_report(report, as_json=False):
+    if as_json:
+        print(json.dumps(report, indent=2))
+    else:
+        width = max(len(key) for key in report)
+        for key, value in report.items():
+            print(f"{key.ljust(width)}  {value}")
+    sys.stdout.flush()
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix='orchestrator-bench-')
+    prepare(workdir, {
+        'LLM_PROVIDER': 'mock',
+        'MOCK_LLM_LATENCY': args.llm_latency,
+        'MOCK_LLM_SEED': str(args.seed),
+        'AIDER_EXECUTABLE': f'"{sys.executable}" "{FAKE_AIDER}"',
+        'FAKE_AIDER_DELAY': str(args.aider_delay),
+    }, args.log_level)
+    from agent_session import AgentSession
+
+    configure(args, args.interval)
+    sessions = {}
+    for i in range(args.agents):
+        agent_id = f'bench-{i:03d}'
+        workspace = os.path.join(workdir, agent_id)
+        os.makedirs(workspace)
+        session = AgentSession(workspace, f'Benchmark task {i}', config={'stability_duration': 1}, agent_id=agent_id)
+        if not session.start():
+            raise RuntimeError(f"Could not start fake aider for {agent_id}")
+        sessions[agent_id] = session
+    register_agents(sessions)
+    stats = instrument()
+    report = {
+        'agents': args.agents,
+        'llm_latency': args.llm_latency,
+        'batch_size': args.batch_size,
+        **run_loop(stats, args.duration),
+    }
+    shutil.rmtree(workdir, ignore_errors=True)
+    return report
+
+def main(argv=None):
+    args = parse_args(argv)
+    print_report(run(args), args.json)
+    # The orchestrator loop never returns; skip waiting on its threads at exit
+    os._exit(0)
+
+if __name__ == '__main__':
+    main()
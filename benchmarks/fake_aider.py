@@ -0,0 +1,34 @@
+"""Stand-in for the aider CLI: answers each line on stdin with some output and a prompt
+
+Set AIDER_EXECUTABLE="python benchmarks/fake_aider.py" to use it. Aider's own
+flags are accepted and ignored. FAKE_AIDER_DELAY (seconds, default 0.05) is
+how long each command "works" and FAKE_AIDER_LINES how many lines it prints.
+"""
+import os
+import sys
+import time
+
+def prompt():
+    # Like aider's input("> ") when stdin is not a terminal: no newline after the prompt
+    sys.stdout.write("> ")
+    sys.stdout.flush()
+
+def main():
+    delay = float(os.getenv('FAKE_AIDER_DELAY', '0.05'))
+    lines = int(os.getenv('FAKE_AIDER_LINES', '5'))
+    print("Fake aider ready", flush=True)
+    prompt()
+    step = 0
+    for command in sys.stdin:
+        command = command.strip()
+        if not command:
+            continue
+        step += 1
+        time.sleep(delay)
+        for i in range(lines):
+            print(f"[{step}.{i}] working on: {command[:60]}", flush=True)
+        print(f"Applied edit to file_{step % 7}.py", flush=True)
+        prompt()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,276 @@
+"""Replay a recorded production session through the orchestrator, offline and sped up
+
+Record with ORCHESTRATOR_RECORD=/path/to/session.jsonl, then:
+
+    python benchmarks/replay.py /path/to/session.jsonl --speed 20
+
+Each recorded agent gets an AgentSession whose "aider" plays back the recorded
+output, one segment per action it receives, and LLM calls are answered with the
+recorded responses and latencies of the same agent and kind of request.
+main_loop, PromptProcessor and the database run for real, so two orchestrator
+versions can be profiled on the same trace.
+"""
+import argparse
+import hashlib
+import os
+import queue
+import shutil
+import sys
+import tempfile
+import threading
+from collections import deque
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_orchestrator import configure, instrument, prepare, print_report, register_agents, run_loop
+from agent_session import AgentSession
+from mock_llm import MockLLMProvider, message_text
+from pipe_reader import get_pipe_reader
+from prompts import prompt_registry
+from recorder import read_recording
+
+def request_kind(system_message):
+    """What an LLM request is for: the registered prompt its system message starts with, else a hash of it"""
+    return prompt_registry.name_of(system_message) or hashlib.sha1(system_message.encode('utf-8')).hexdigest()[:12]
+
+class AgentTrace:
+    """One agent's recorded output, split into segments by the actions sent to it"""
+
+    def __init__(self, agent_id):
+        self.agent_id = agent_id
+        self.task = f"Replay of {agent_id}"
+        self.segments = [[]]  # Lists of (delay_s, text)
+        self.actions = []
+        self.last_t = None
+
+def load_traces(path):
+    """Per-agent traces, and recorded LLM responses, (content, latency_s), keyed by (agent ID, request kind)"""
+    traces = {}
+    responses = {}
+    for event in read_recording(path):
+        agent_id = event['agent']
+        if event['kind'] == 'llm':
+            key = (agent_id, request_kind(event['system']))
+            responses.setdefault(key, deque()).append((event['response'], event['latency_ms'] / 1000))
+            continue
+        if agent_id is None:
+            continue
+        trace = traces.setdefault(agent_id, AgentTrace(agent_id))
+        delay = 0.0 if trace.last_t is None else max(0.0, event['t'] - trace.last_t)
+        trace.last_t = event['t']
+        if event['kind'] == 'start':
+            trace.task = event['task']
+        elif event['kind'] == 'output':
+            trace.segments[-1].append((delay, event['text']))
+        elif event['kind'] == 'action':
+            trace.actions.append(event['command'])
+            trace.segments.append([])
+    return traces, responses
+
+class _ReplayStdin:
+    def __init__(self, commands):
+        self._commands = commands
+        self.closed = False
+
+    def write(self, text):
+        for line in text.splitlines():
+            if line.strip():
+                self._commands.put(line)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+class ReplayProcess:
+    """Popen stand-in that writes an agent's recorded output, waiting for a command between segments"""
+
+    def __init__(self, segments, speed):
+        self._segments = segments
+        self._speed = speed
+        self._commands = queue.Queue()
+        self._stop = threading.Event()
+        read_fd, write_fd = os.pipe()
+        self.stdout = os.fdopen(read_fd, 'r', encoding='utf-8')
+        self._out = os.fdopen(write_fd, 'w', encoding='utf-8')
+        self.stderr = None
+        self.stdin = _ReplayStdin(self._commands)
+        self.returncode = None
+        self.exhausted = False
+        threading.Thread(target=self._play, daemon=True, name='replay-aider').start()
+
+    def _play(self):
+        try:
+            for index, segment in enumerate(self._segments):
+                while index and not self._stop.is_set():
+                    try:
+                        self._commands.get(timeout=0.1)
+                        break
+                    except queue.Empty:
+                        continue
+                for delay, text in segment:
+                    if self._stop.wait(delay / self._speed):
+                        return
+                    self._out.write(text)
+                    self._out.flush()
+        except (OSError, ValueError):
+            pass
+        finally:
+            self.exhausted = True
+
+    def poll(self):
+        return self.returncode
+
+    def terminate(self):
+        self._stop.set()
+        self.returncode = 0
+        try:
+            self._out.close()
+        except OSError:
+            pass
+
+    kill = terminate
+
+    def wait(self, timeout=None):
+        return self.returncode
+
+class ReplayAgentSession(AgentSession):
+    """AgentSession driven by a recorded trace instead of an aider process"""
+
+    def __init__(self, workspace_path, trace, speed, config=None):
+        super().__init__(workspace_path, trace.task, config=config, agent_id=trace.agent_id)
+        self.trace = trace
+        self.speed = speed
+        self.sent = []
+
+    def start(self) -> bool:
+        self.process = ReplayProcess(self.trace.segments, self.speed)
+        reader = get_pipe_reader()
+        if reader and reader.register(self.process.stdout, self._handle_line, self._handle_tail):
+            self._pipe_reader = reader
+        else:
+            threading.Thread(
+                target=self._read_output,
+                args=(self.process.stdout, "stdout"),
+                daemon=True,
+                name=f"stdout-{self.session_id}"
+            ).start()
+        self._first_output.wait(self.config['startup_timeout'])
+        return True
+
+    def send_message(self, message: str, timeout: int = 10) -> bool:
+        sent = super().send_message(message, timeout)
+        if sent:
+            self.sent.append(message)
+        return sent
+
+class ReplayLLMProvider(MockLLMProvider):
+    """Answers each agent's LLM calls with its recorded responses in order
+
+    Summaries, decisions and PR descriptions are queued separately, so an
+    orchestrator that summarizes more or less often than the recorded one still
+    gets decisions answered with decisions. Calls beyond the recording of their
+    kind fall back to the mock provider's generated responses.
+    """
+
+    def __init__(self, responses, speed, **kwargs):
+        super().__init__(**kwargs)
+        self._responses = responses
+        self._speed = speed
+        self.replayed = 0
+        self.generated = 0
+
+    def _next(self, messages, metadata=None):
+        agent_id = (metadata or {}).get('agent_id')
+        agent_id = None if agent_id is None else str(agent_id)
+        system = message_text(messages[0]['content']) if messages else ''
+        with self._lock:
+            recorded = self._responses.get((agent_id, request_kind(system)))
+            entry = recorded.popleft() if recorded else None
+            if entry is not None:
+                self.replayed += 1
+            else:
+                self.generated += 1
+        if entry is None:
+            return super()._next(messages, metadata)
+        content, latency = entry
+        return content, latency / self._speed
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('recording', help='JSONL file written with ORCHESTRATOR_RECORD')
+    parser.add_argument('--speed', type=float, default=10.0, help='how many times faster than recorded to replay')
+    parser.add_argument('--duration', type=float, default=None,
+                        help='stop after this many seconds (default: recorded span divided by speed, plus 10s)')
+    parser.add_argument('--interval', type=float, default=None, help='CHECK_INTERVAL (default: 5s divided by speed)')
+    parser.add_argument('--stability', type=float, default=None,
+                        help='stability_duration of sessions (default: 10s divided by speed)')
+    parser.add_argument('--batch-size', type=int, default=1, help='agents decided per LLM request')
+    parser.add_argument('--concurrency', type=int, default=8, help='agent steps running at once')
+    parser.add_argument('--llm-rate', type=float, default=None,
+                        help='LLM requests per second per model (default: the dispatcher default)')
+    parser.add_argument('--log-level', default='warning', help='logging level while the loop runs')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    return parser.parse_args(argv)
+
+def run(args):
+    recording = os.path.abspath(args.recording)
+    traces, responses = load_traces(recording)
+    if not traces:
+        raise SystemExit(f"No agent sessions in {recording}")
+    times = [event['t'] for event in read_recording(recording)]
+    span = max(times) - min(times)
+    duration = args.duration if args.duration is not None else span / args.speed + 10
+    interval = args.interval if args.interval is not None else 5 / args.speed
+    stability = args.stability if args.stability is not None else 10 / args.speed
+
+    workdir = tempfile.mkdtemp(prefix='orchestrator-replay-')
+    prepare(workdir, {}, args.log_level)
+    import litellm_client
+
+    configure(args, interval)
+    provider = ReplayLLMProvider(responses, args.speed)
+    # Every client the orchestrator creates, including the PR manager's, answers from the recording
+    litellm_client.provider_from_env = lambda: provider
+    sessions = {}
+    for agent_id, trace in traces.items():
+        workspace = os.path.join(workdir, agent_id)
+        os.makedirs(workspace)
+        session = ReplayAgentSession(workspace, trace, args.speed, config={'stability_duration': stability})
+        session.start()
+        sessions[agent_id] = session
+    register_agents(sessions)
+    stats = instrument()
+
+    def finished():
+        return all(s.process.exhausted and len(s.sent) >= len(s.trace.actions) for s in sessions.values())
+
+    loop_report = run_loop(stats, duration, finished)
+    recorded_actions = sum(len(s.trace.actions) for s in sessions.values())
+    matching = sum(
+        sum(1 for sent, recorded in zip(s.sent, s.trace.actions) if sent == recorded)
+        for s in sessions.values()
+    )
+    report = {
+        'agents': len(sessions),
+        'recorded_span_s': round(span, 2),
+        'speed': args.speed,
+        **loop_report,
+        'recorded_actions': recorded_actions,
+        'replayed_actions': sum(len(s.sent) for s in sessions.values()),
+        'matching_actions': matching,
+        'llm_replayed': provider.replayed,
+        'llm_generated': provider.generated,
+    }
+    shutil.rmtree(workdir, ignore_errors=True)
+    return report
+
+def main(argv=None):
+    args = parse_args(argv)
+    print_report(run(args), args.json)
+    # The orchestrator loop never returns; skip waiting on its threads at exit
+    os._exit(0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+import logging
+import math
+from typing import Callable, Optional
+
+CHARS_PER_TOKEN = 4  # Rough average for English text and code
+DEFAULT_CONTEXT_TOKEN_BUDGET = 8000
+SUMMARY_SHARE = 0.25  # Part of the budget reserved for the summary of older output
+MIN_SUMMARY_CHUNK_TOKENS = 500  # Older output is folded into the summary in chunks at least this big
+
+def estimate_tokens(text: Optional[str]) -> int:
+    """Cheap token estimate from character count"""
+    return math.ceil(len(text or '') / CHARS_PER_TOKEN)
+
+class ContextBuilder:
+    """Builds a token-budgeted view of one agent's output for its next decision
+
+    The most recent output is sent verbatim. Output that scrolls out of the
+    recent window is folded into a rolling summary by summarize(previous_summary,
+    new_output), a chunk at a time, so each piece of output is summarized once.
+    Until output outgrows the budget the view is the output itself.
+    """
+
+    def __init__(self, summarize: Callable[[str, str], Optional[str]]):
+        self.summarize = summarize
+        self.summary = ''
+        self.summarized_to = 0  # Output offset up to which the summary is complete
+
+    def build(self, output: str, start: int = 0, budget_tokens: int = DEFAULT_CONTEXT_TOKEN_BUDGET) -> str:
+        """Context for output whose first character is at offset start"""
+        output = output or ''
+        end = start + len(output)
+        summary_budget = int(budget_tokens * SUMMARY_SHARE)
+        if not self.summary and estimate_tokens(output) <= budget_tokens:
+            return output
+
+        recent_chars = (budget_tokens - summary_budget) * CHARS_PER_TOKEN
+        recent_start = max(start, end - recent_chars, self.summarized_to)
+        # Start the window on a line boundary when one is close by
+        newline = output.find('\n', recent_start - start, recent_start - start + 200)
+        if recent_start > start and newline != -1:
+            recent_start = start + newline + 1
+
+        pending_from = max(self.summarized_to, start)
+        pending = output[pending_from - start:recent_start - start]
+        spare_tokens = summary_budget - estimate_tokens(self.summary)
+        if pending and estimate_tokens(pending) > spare_tokens:
+            min_chunk = min(MIN_SUMMARY_CHUNK_TOKENS, budget_tokens - summary_budget)
+            if estimate_tokens(pending) >= min_chunk or spare_tokens <= 0:
+                self._fold(pending, summary_budget, gap=pending_from > self.summarized_to)
+                self.summarized_to = recent_start
+                pending = ''
+            else:
+                # Too small to be worth a summary call yet; keep only what fits
+                pending = pending[-max(0, spare_tokens) * CHARS_PER_TOKEN:] if spare_tokens > 0 else ''
+
+        recent = pending + output[recent_start - start:]
+        if not self.summary:
+            return recent
+        return f"[Summary of earlier output]\n{self.summary}\n\n[Recent output]\n{recent}"
+
+    def _fold(self, text: str, summary_budget: int, gap: bool) -> None:
+        if gap:
+            text = "[some earlier output was not kept]\n" + text
+        try:
+            summary = self.summarize(self.summary, text)
+        except Exception as e:
+            logging.error(f"Error summarizing agent output: {e}")
+            summary = None
+        if not summary:
+            # Fall back to keeping the newest part of what would have been summarized
+            summary = (self.summary + '\n' + text).strip()
+        max_chars = summary_budget * CHARS_PER_TOKEN
+        self.summary = summary[-max_chars:] if len(summary) > max_chars else summary
@@ -1,10 +1,84 @@
 import sqlite3
+import threading
+import time
 from pathlib import Path
 import json
 from datetime import datetime
 from typing import Dict, List, Optional
+from metrics import DB_QUERY_SECONDS
+from tracing import traced
 
 DATABASE_PATH = Path("tasks.db")
+BUSY_TIMEOUT_MS = 5000
+STATEMENT_CACHE_SIZE = 256
+
+# Per-thread persistent connections, keyed by database path
+_local = threading.local()
+
+# Model configuration, keyed by database path; invalidated when the config is saved
+_model_config_cache = {}
+_model_config_version = 0
+_model_config_lock = threading.Lock()
+
+def get_connection() -> sqlite3.Connection:
+    """Get this thread's persistent connection to DATABASE_PATH.
+
+    Connections stay open for the life of the thread so SQLite's prepared
+    statement cache is reused across calls. WAL journaling lets the dashboard
+    read while the orchestrator writes.
+    """
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+    path = str(DATABASE_PATH)
+    conn = connections.get(path)
+    if conn is None:
+        conn = sqlite3.connect(
+            path,
+            timeout=BUSY_TIMEOUT_MS / 1000,
+            cached_statements=STATEMENT_CACHE_SIZE
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+        conn.execute("PRAGMA foreign_keys = ON")
+        connections[path] = conn
+    return conn
+
+def _bump_version(cursor: sqlite3.Cursor) -> int:
+    """Allocate the next state version inside the caller's transaction.
+
+    The counter is incremented under SQLite's write lock, so versions are
+    committed in increasing order across threads and processes.
+    """
+    cursor.execute("""
+        INSERT INTO config (key, value) VALUES ('state_version', '1')
+        ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1
+    """)
+    cursor.execute("SELECT value FROM config WHERE key = 'state_version'")
+    return int(cursor.fetchone()[0])
+
+@DB_QUERY_SECONDS.timed('function')
+def get_state_version() -> int:
+    """Get the version of the latest agent, task or config change."""
+    try:
+        with get_connection() as conn:
+            row = conn.execute("SELECT value FROM config WHERE key = 'state_version'").fetchone()
+            return int(row[0]) if row else 0
+    except Exception as e:
+        print(f"Error getting state version: {e}")
+        return 0
+
+def close_connections() -> None:
+    """Close all of this thread's database connections."""
+    connections = getattr(_local, 'connections', None) or {}
+    for conn in connections.values():
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+    connections.clear()
 
 def init_db():
     """Initialize the SQLite database with required tables."""
@@ -20,6 +94,8 @@ def init_db():
             
             # Enable foreign key support
             cursor.execute("PRAGMA foreign_keys = ON")
+            # WAL is persistent, so every later connection inherits it
+            cursor.execute("PRAGMA journal_mode = WAL")
             
             # Log database status
             if db_exists:
@@ -36,9 +112,14 @@ def init_db():
                     agent_model TEXT NOT NULL DEFAULT 'openrouter/google/gemini-flash-1.5',
                     aider_prompt_suffix TEXT DEFAULT '',
                     created_at TEXT NOT NULL,
-                    updated_at TEXT NOT NULL
+                    updated_at TEXT NOT NULL,
+                    context_token_budget INTEGER DEFAULT 8000
                 )
             """)
+            # Add the context budget column to model_config tables created before it existed
+            cursor.execute("PRAGMA table_info(model_config)")
+            if 'context_token_budget' not in {row[1] for row in cursor.fetchall()}:
+                cursor.execute("ALTER TABLE model_config ADD COLUMN context_token_budget INTEGER DEFAULT 8000")
             
             # Create agents table
             cursor.execute("""
@@ -61,10 +142,19 @@ def init_db():
                     pr_url TEXT,
                     error TEXT,
                     completed BOOLEAN DEFAULT 0,
-                    agent_type TEXT DEFAULT 'default'
+                    agent_type TEXT DEFAULT 'default',
+                    version INTEGER DEFAULT 0,
+                    output_offset INTEGER DEFAULT 0
                 )
             """)
             
+            # Add columns introduced after the agents table was first created
+            cursor.execute("PRAGMA table_info(agents)")
+            agent_columns = {row[1] for row in cursor.fetchall()}
+            for column, definition in (('version', 'INTEGER DEFAULT 0'), ('output_offset', 'INTEGER DEFAULT 0')):
+                if column not in agent_columns:
+                    cursor.execute(f"ALTER TABLE agents ADD COLUMN {column} {definition}")
+            
             # Create tasks table
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS tasks (
@@ -83,6 +173,57 @@ def init_db():
                 )
             """)
             
+            # Create append-only agent history table
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS agent_history (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    agent_id TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    timestamp TEXT,
+                    content TEXT
+                )
+            """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_agent_history_agent_kind
+                ON agent_history (agent_id, kind, id)
+            """)
+            _migrate_json_history(cursor)
+            
+            # Create LLM response cache table
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS llm_cache (
+                    key TEXT PRIMARY KEY,
+                    response TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_llm_cache_created_at
+                ON llm_cache (created_at)
+            """)
+            
+            # Create LLM usage table, one row per completed request
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS llm_usage (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    agent_id TEXT,
+                    task TEXT,
+                    model TEXT NOT NULL,
+                    model_type TEXT,
+                    prompt_tokens INTEGER DEFAULT 0,
+                    completion_tokens INTEGER DEFAULT 0,
+                    cost REAL DEFAULT 0,
+                    latency_ms INTEGER DEFAULT 0,
+                    created_at TEXT NOT NULL
+                )
+            """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_llm_usage_agent
+                ON llm_usage (agent_id)
+            """)
+            # Requests for no agent used to be stored under the agent ID "None"
+            cursor.execute("UPDATE llm_usage SET agent_id = NULL WHERE agent_id = 'None'")
+            
             # Verify tables exist
             cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
             tables = [row[0] for row in cursor.fetchall()]
@@ -113,105 +254,318 @@ def init_db():
         print("Database schema may be corrupted. Try deleting tasks.db and restarting.")
         raise
 
+AGENT_COLUMNS = (
+    'workspace', 'repo_path', 'task', 'status', 'created_at', 'last_updated',
+    'aider_output', 'last_critique', 'progress', 'thought', 'future',
+    'last_action', 'pr_url', 'error', 'completed', 'agent_type', 'output_offset'
+)
+# History lists on an agent dict and the agent_history kind they are stored as
+HISTORY_FIELDS = {'progress_history': 'progress', 'thought_history': 'thought'}
+
+class AgentRecord(dict):
+    """Agent row that remembers the column values it was loaded or last saved with"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.mark_clean()
+
+    def mark_clean(self) -> None:
+        """Treat the current values as persisted"""
+        self._baseline = {column: self[column] for column in AGENT_COLUMNS if column in self}
+        self._history_lengths = {field: len(self.get(field) or []) for field in HISTORY_FIELDS}
+
+    def dirty_fields(self) -> Dict:
+        """Columns whose value changed since load or the last save"""
+        return {
+            column: self[column]
+            for column in AGENT_COLUMNS
+            if column in self and (column not in self._baseline or self[column] != self._baseline[column])
+        }
+
+    def new_history_entries(self) -> Dict[str, List]:
+        """History entries appended since load or the last save"""
+        return {
+            field: self[field][self._history_lengths[field]:]
+            for field in HISTORY_FIELDS
+            if len(self.get(field) or []) > self._history_lengths[field]
+        }
+
+def _history_params(agent_id: str, field: str, entries: List) -> List[tuple]:
+    params = []
+    for entry in entries:
+        if isinstance(entry, dict):
+            params.append((agent_id, HISTORY_FIELDS[field], entry.get('timestamp'), entry.get('content')))
+        else:
+            # Bare entries from legacy JSON histories have no timestamp
+            content = entry if isinstance(entry, str) else json.dumps(entry)
+            params.append((agent_id, HISTORY_FIELDS[field], None, content))
+    return params
+
+def _insert_history(cursor: sqlite3.Cursor, agent_id: str, field: str, entries: List) -> None:
+    cursor.executemany(
+        "INSERT INTO agent_history (agent_id, kind, timestamp, content) VALUES (?, ?, ?, ?)",
+        _history_params(agent_id, field, entries)
+    )
+
+def _load_history(cursor: sqlite3.Cursor, agent_id: str, field: str) -> List:
+    cursor.execute(
+        "SELECT timestamp, content FROM agent_history WHERE agent_id = ? AND kind = ? ORDER BY id",
+        (agent_id, HISTORY_FIELDS[field])
+    )
+    return [
+        content if timestamp is None else {'timestamp': timestamp, 'content': content}
+        for timestamp, content in cursor.fetchall()
+    ]
+
+def _migrate_json_history(cursor: sqlite3.Cursor) -> None:
+    """Move histories stored as JSON arrays on agents rows into agent_history."""
+    cursor.execute("""
+        SELECT id, progress_history, thought_history FROM agents
+        WHERE progress_history NOT IN ('', '[]') OR thought_history NOT IN ('', '[]')
+    """)
+    rows = cursor.fetchall()
+    for agent_id, progress_history, thought_history in rows:
+        for field, raw in (('progress_history', progress_history), ('thought_history', thought_history)):
+            try:
+                entries = json.loads(raw) if raw else []
+            except json.JSONDecodeError:
+                print(f"Skipping unreadable {field} for agent {agent_id}")
+                entries = []
+            _insert_history(cursor, agent_id, field, entries)
+        cursor.execute(
+            "UPDATE agents SET progress_history = '[]', thought_history = '[]' WHERE id = ?",
+            (agent_id,)
+        )
+    if rows:
+        print(f"Migrated history for {len(rows)} agents")
+
+def _upsert_agent(cursor: sqlite3.Cursor, agent_id: str, agent_data: Dict) -> None:
+    """Write every column of an agent row, replacing any history lists it carries."""
+    version = _bump_version(cursor)
+    cursor.execute("""
+        INSERT OR REPLACE INTO agents (
+            id, workspace, repo_path, task, status, created_at,
+            last_updated, aider_output, last_critique, progress,
+            thought, progress_history, thought_history, future,
+            last_action, pr_url, error, completed, agent_type,
+            version, output_offset
+        ) VALUES (
+            :id, :workspace, :repo_path, :task, :status, :created_at, 
+            :last_updated, :aider_output, :last_critique, :progress, 
+            :thought, '[]', '[]', :future, 
+            :last_action, :pr_url, :error, :completed, :agent_type,
+            :version, :output_offset
+        )
+    """, {
+        'id': agent_id,
+        'workspace': agent_data.get('workspace'),
+        'repo_path': agent_data.get('repo_path'),
+        'task': agent_data.get('task'),
+        'status': agent_data.get('status', 'pending'),
+        'created_at': agent_data.get('created_at', datetime.now().isoformat()),
+        'last_updated': agent_data.get('last_updated', datetime.now().isoformat()),
+        'aider_output': agent_data.get('aider_output', ''),
+        'last_critique': agent_data.get('last_critique', ''),
+        'progress': agent_data.get('progress', ''),
+        'thought': agent_data.get('thought', ''),
+        'future': agent_data.get('future', ''),
+        'last_action': agent_data.get('last_action', ''),
+        'pr_url': agent_data.get('pr_url', ''),
+        'error': agent_data.get('error', ''),
+        'completed': agent_data.get('completed', 0),
+        'agent_type': agent_data.get('agent_type', 'default'),
+        'version': version,
+        'output_offset': agent_data.get('output_offset', 0)
+    })
+    if isinstance(agent_data, AgentRecord):
+        agent_data['version'] = version
+    for field, kind in HISTORY_FIELDS.items():
+        if field in agent_data:
+            cursor.execute("DELETE FROM agent_history WHERE agent_id = ? AND kind = ?", (agent_id, kind))
+            _insert_history(cursor, agent_id, field, agent_data[field] or [])
+
+@traced()
+@DB_QUERY_SECONDS.timed('function')
 def save_agent(agent_id: str, agent_data: Dict) -> bool:
     """Save or update an agent in the database."""
     try:
-        with sqlite3.connect(DATABASE_PATH) as conn:
-            cursor = conn.cursor()
-            
-            # Convert lists to JSON strings
-            progress_history = json.dumps(agent_data.get('progress_history', []))
-            thought_history = json.dumps(agent_data.get('thought_history', []))
-            
-            cursor.execute("""
-                INSERT OR REPLACE INTO agents VALUES (
-                    :id, :workspace, :repo_path, :task, :status, :created_at, 
-                    :last_updated, :aider_output, :last_critique, :progress, 
-                    :thought, :progress_history, :thought_history, :future, 
-                    :last_action, :pr_url, :error, :completed, :agent_type
-                )
-            """, {
-                'id': agent_id,
-                'workspace': agent_data.get('workspace'),
-                'repo_path': agent_data.get('repo_path'),
-                'task': agent_data.get('task'),
-                'status': agent_data.get('status', 'pending'),
-                'created_at': agent_data.get('created_at', datetime.now().isoformat()),
-                'last_updated': agent_data.get('last_updated', datetime.now().isoformat()),
-                'aider_output': agent_data.get('aider_output', ''),
-                'last_critique': agent_data.get('last_critique', ''),
-                'progress': agent_data.get('progress', ''),
-                'thought': agent_data.get('thought', ''),
-                'progress_history': progress_history,
-                'thought_history': thought_history,
-                'future': agent_data.get('future', ''),
-                'last_action': agent_data.get('last_action', ''),
-                'pr_url': agent_data.get('pr_url', ''),
-                'error': agent_data.get('error', ''),
-                'completed': agent_data.get('completed', 0),
-                'agent_type': agent_data.get('agent_type', 'default')
-            })
-            conn.commit()
-            return True
+        with get_connection() as conn:
+            _upsert_agent(conn.cursor(), agent_id, agent_data)
+        if isinstance(agent_data, AgentRecord):
+            agent_data.mark_clean()
+        return True
     except Exception as e:
         print(f"Error saving agent: {e}")
         return False
 
+@traced()
+@DB_QUERY_SECONDS.timed('function')
+def save_agents(agents: Dict[str, Dict]) -> bool:
+    """Persist changes to many agents in one transaction.
+
+    Records loaded from the database only write the columns that changed and
+    append new history entries, so concurrent writers touching different
+    columns of the same agent do not overwrite each other. Plain dicts are new
+    agents and get a full insert.
+    """
+    try:
+        saved = []
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            for agent_id, agent_data in agents.items():
+                if not isinstance(agent_data, AgentRecord):
+                    _upsert_agent(cursor, agent_id, agent_data)
+                    continue
+                changes = agent_data.dirty_fields()
+                new_entries = agent_data.new_history_entries()
+                if not changes and not new_entries:
+                    continue
+                if changes:
+                    changes['version'] = agent_data['version'] = _bump_version(cursor)
+                    assignments = ", ".join(f"{column} = ?" for column in changes)
+                    cursor.execute(
+                        f"UPDATE agents SET {assignments} WHERE id = ?",
+                        list(changes.values()) + [agent_id]
+                    )
+                for field, entries in new_entries.items():
+                    _insert_history(cursor, agent_id, field, entries)
+                saved.append(agent_data)
+        for agent_data in saved:
+            agent_data.mark_clean()
+        return True
+    except Exception as e:
+        print(f"Error saving agents: {e}")
+        return False
+
+@DB_QUERY_SECONDS.timed('function')
 def get_agent(agent_id: str) -> Optional[Dict]:
     """Get an agent by ID."""
     try:
-        with sqlite3.connect(DATABASE_PATH) as conn:
-            conn.row_factory = sqlite3.Row
+        with get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("SELECT * FROM agents WHERE id = ?", (agent_id,))
             row = cursor.fetchone()
             if row:
                 agent_data = dict(row)
-                # Convert JSON strings back to lists
-                agent_data['progress_history'] = json.loads(agent_data['progress_history'])
-                agent_data['thought_history'] = json.loads(agent_data['thought_history'])
-                return agent_data
+                for field in HISTORY_FIELDS:
+                    agent_data[field] = _load_history(cursor, agent_id, field)
+                return AgentRecord(agent_data)
             return None
     except Exception as e:
         print(f"Error getting agent: {e}")
         return None
 
-def get_all_agents() -> Dict[str, Dict]:
-    """Get all agents."""
+@DB_QUERY_SECONDS.timed('function')
+def get_all_agents(include_history: bool = False) -> Dict[str, Dict]:
+    """Get all agents.
+
+    History lists are left out unless requested; use get_history to page
+    through them. Entries appended to a missing list are still saved.
+    """
     try:
-        with sqlite3.connect(DATABASE_PATH) as conn:
-            conn.row_factory = sqlite3.Row
+        with get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("SELECT * FROM agents")
             rows = cursor.fetchall()
             agents = {}
             for row in rows:
                 agent_data = dict(row)
-                # Convert JSON strings back to lists
-                agent_data['progress_history'] = json.loads(agent_data['progress_history'])
-                agent_data['thought_history'] = json.loads(agent_data['thought_history'])
-                agents[agent_data['id']] = agent_data
+                for field in HISTORY_FIELDS:
+                    del agent_data[field]
+                    if include_history:
+                        agent_data[field] = _load_history(cursor, agent_data['id'], field)
+                agents[agent_data['id']] = AgentRecord(agent_data)
             return agents
     except Exception as e:
         print(f"Error getting all agents: {e}")
         return {}
 
+@DB_QUERY_SECONDS.timed('function')
+def get_agents_since(version: int) -> Dict[str, Dict]:
+    """Get agents changed after the given state version, without history."""
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM agents WHERE version > ?", (version,))
+            agents = {}
+            for row in cursor.fetchall():
+                agent_data = dict(row)
+                for field in HISTORY_FIELDS:
+                    del agent_data[field]
+                agents[agent_data['id']] = AgentRecord(agent_data)
+            return agents
+    except Exception as e:
+        print(f"Error getting changed agents: {e}")
+        return {}
+
+@DB_QUERY_SECONDS.timed('function')
+def get_agent_ids() -> List[str]:
+    """Get the IDs of all agents."""
+    try:
+        with get_connection() as conn:
+            return [row[0] for row in conn.execute("SELECT id FROM agents")]
+    except Exception as e:
+        print(f"Error getting agent IDs: {e}")
+        return []
+
+@DB_QUERY_SECONDS.timed('function')
+def append_history(agent_id: str, kind: str, content: str, timestamp: Optional[str] = None) -> bool:
+    """Append one progress or thought entry to an agent's history."""
+    try:
+        with get_connection() as conn:
+            conn.execute(
+                "INSERT INTO agent_history (agent_id, kind, timestamp, content) VALUES (?, ?, ?, ?)",
+                (agent_id, kind, timestamp or datetime.now().isoformat(), content)
+            )
+            return True
+    except Exception as e:
+        print(f"Error appending history: {e}")
+        return False
+
+@DB_QUERY_SECONDS.timed('function')
+def get_history(agent_id: str, kind: str, limit: int = 50, before_id: Optional[int] = None) -> List[Dict]:
+    """Get a page of an agent's history, oldest first.
+
+    Returns the newest `limit` entries older than `before_id`; pass the
+    smallest id of a page as `before_id` to fetch the page before it.
+    """
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            query = "SELECT id, timestamp, content FROM agent_history WHERE agent_id = ? AND kind = ?"
+            params = [agent_id, kind]
+            if before_id is not None:
+                query += " AND id < ?"
+                params.append(before_id)
+            query += " ORDER BY id DESC LIMIT ?"
+            params.append(limit)
+            cursor.execute(query, params)
+            return [dict(row) for row in reversed(cursor.fetchall())]
+    except Exception as e:
+        print(f"Error getting history: {e}")
+        return []
+
+@DB_QUERY_SECONDS.timed('function')
 def delete_agent(agent_id: str) -> bool:
     """Delete an agent from the database."""
     try:
-        with sqlite3.connect(DATABASE_PATH) as conn:
+        with get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("DELETE FROM agents WHERE id = ?", (agent_id,))
-            conn.commit()
-            return cursor.rowcount > 0
+            deleted = cursor.rowcount > 0
+            cursor.execute("DELETE FROM agent_history WHERE agent_id = ?", (agent_id,))
+            if deleted:
+                _bump_version(cursor)
+            return deleted
     except Exception as e:
         print(f"Error deleting agent: {e}")
         return False
 
+@DB_QUERY_SECONDS.timed('function')
 def save_task(task_data: Dict) -> int:
     """Save a task to the database."""
     try:
-        with sqlite3.connect(DATABASE_PATH) as conn:
+        with get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("""
                 INSERT INTO tasks (title, description, created_at)
@@ -221,17 +575,18 @@ def save_task(task_data: Dict) -> int:
                 'description': task_data.get('description'),
                 'created_at': datetime.now().isoformat()
             })
-            conn.commit()
-            return cursor.lastrowid
+            task_id = cursor.lastrowid
+            _bump_version(cursor)
+            return task_id
     except Exception as e:
         print(f"Error saving task: {e}")
         return -1
 
+@DB_QUERY_SECONDS.timed('function')
 def get_all_tasks() -> List[Dict]:
     """Get all tasks."""
     try:
-        with sqlite3.connect(DATABASE_PATH) as conn:
-            conn.row_factory = sqlite3.Row
+        with get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("SELECT * FROM tasks")
             return [dict(row) for row in cursor.fetchall()]
@@ -239,10 +594,11 @@ def get_all_tasks() -> List[Dict]:
         print(f"Error getting tasks: {e}")
         return []
 
+@DB_QUERY_SECONDS.timed('function')
 def get_config(key: str) -> Optional[str]:
     """Get a config value."""
     try:
-        with sqlite3.connect(DATABASE_PATH) as conn:
+        with get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("SELECT value FROM config WHERE key = ?", (key,))
             row = cursor.fetchone()
@@ -251,33 +607,148 @@ def get_config(key: str) -> Optional[str]:
         print(f"Error getting config: {e}")
         return None
 
+@DB_QUERY_SECONDS.timed('function')
 def save_config(key: str, value: str) -> bool:
     """Save a config value."""
     try:
-        with sqlite3.connect(DATABASE_PATH) as conn:
+        with get_connection() as conn:
             cursor = conn.cursor()
+            cursor.execute("SELECT value FROM config WHERE key = ?", (key,))
+            row = cursor.fetchone()
+            if row and row[0] == value:
+                return True
             cursor.execute("""
                 INSERT OR REPLACE INTO config (key, value)
                 VALUES (:key, :value)
             """, {'key': key, 'value': value})
-            conn.commit()
+            _bump_version(cursor)
             return True
     except Exception as e:
         print(f"Error saving config: {e}")
         return False
 
+@DB_QUERY_SECONDS.timed('function')
+def get_cached_response(key: str, max_age: float) -> Optional[str]:
+    """Get a cached LLM response stored less than max_age seconds ago."""
+    try:
+        with get_connection() as conn:
+            row = conn.execute(
+                "SELECT response FROM llm_cache WHERE key = ? AND created_at >= ?",
+                (key, time.time() - max_age)
+            ).fetchone()
+            return row[0] if row else None
+    except Exception as e:
+        print(f"Error getting cached response: {e}")
+        return None
+
+@DB_QUERY_SECONDS.timed('function')
+def save_cached_response(key: str, response: str, max_age: float) -> bool:
+    """Cache an LLM response and drop entries older than max_age seconds."""
+    try:
+        now = time.time()
+        with get_connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, response, created_at) VALUES (?, ?, ?)",
+                (key, response, now)
+            )
+            conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - max_age,))
+            return True
+    except Exception as e:
+        print(f"Error saving cached response: {e}")
+        return False
+
+USAGE_GROUPS = {'agent': 'agent_id', 'task': 'task', 'model': 'model', 'model_type': 'model_type'}
+UNATTRIBUTED_USAGE = 'unattributed'  # Name reported for requests made for no agent
+
+@DB_QUERY_SECONDS.timed('function')
+def record_usage(agent_id: Optional[str], model: str, model_type: str, prompt_tokens: int,
+                 completion_tokens: int, cost: float, latency_ms: int) -> bool:
+    """Record the tokens, cost and latency of one LLM request.
+
+    The agent's task is copied in at record time so totals per task
+    survive the agent being deleted.
+    """
+    try:
+        with get_connection() as conn:
+            conn.execute("""
+                INSERT INTO llm_usage (
+                    agent_id, task, model, model_type, prompt_tokens,
+                    completion_tokens, cost, latency_ms, created_at
+                ) VALUES (?, (SELECT task FROM agents WHERE id = ?), ?, ?, ?, ?, ?, ?, ?)
+            """, (
+                agent_id, agent_id, model, model_type, int(prompt_tokens or 0),
+                int(completion_tokens or 0), float(cost or 0), int(latency_ms or 0),
+                datetime.now().isoformat()
+            ))
+            return True
+    except Exception as e:
+        print(f"Error recording usage: {e}")
+        return False
+
+@DB_QUERY_SECONDS.timed('function')
+def get_usage_summary(group_by: str, agent_id: Optional[str] = None) -> List[Dict]:
+    """Usage totals grouped by agent, task, model or model_type, most expensive first."""
+    column = USAGE_GROUPS.get(group_by)
+    if not column:
+        raise ValueError(f"Unknown usage grouping: {group_by}")
+    name = f"COALESCE(agent_id, '{UNATTRIBUTED_USAGE}')" if column == 'agent_id' else column
+    try:
+        with get_connection() as conn:
+            query = f"""
+                SELECT {name} AS name, COUNT(*) AS requests,
+                       SUM(prompt_tokens) AS prompt_tokens,
+                       SUM(completion_tokens) AS completion_tokens,
+                       SUM(prompt_tokens + completion_tokens) AS total_tokens,
+                       SUM(cost) AS cost,
+                       AVG(latency_ms) AS avg_latency_ms
+                FROM llm_usage
+            """
+            params = ()
+            if agent_id is not None:
+                query += " WHERE agent_id = ?"
+                params = (agent_id,)
+            query += f" GROUP BY {name} ORDER BY cost DESC, total_tokens DESC"
+            return [dict(row) for row in conn.execute(query, params).fetchall()]
+    except Exception as e:
+        print(f"Error getting usage summary: {e}")
+        return []
+
+def invalidate_model_config() -> int:
+    """Drop the cached model configuration after it has been changed.
+
+    Returns the new cache version. Reads that started before the
+    invalidation do not repopulate the cache with what they loaded.
+    """
+    global _model_config_version
+    with _model_config_lock:
+        _model_config_version += 1
+        _model_config_cache.clear()
+        return _model_config_version
+
+@DB_QUERY_SECONDS.timed('function')
 def get_model_config() -> Optional[Dict]:
-    """Get the current model configuration."""
+    """Get the current model configuration, cached until invalidate_model_config()."""
+    path = str(DATABASE_PATH)
+    with _model_config_lock:
+        cached = _model_config_cache.get(path)
+        version = _model_config_version
+    if cached is not None:
+        return dict(cached)
     try:
-        with sqlite3.connect(DATABASE_PATH) as conn:
-            conn.row_factory = sqlite3.Row
+        with get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("SELECT * FROM model_config ORDER BY id DESC LIMIT 1")
             config = cursor.fetchone()
-            return dict(config) if config else None
+            config = dict(config) if config else None
     except Exception as e:
         print(f"Error getting model config: {e}")
         return None
+    if config is not None:
+        with _model_config_lock:
+            if version == _model_config_version:
+                _model_config_cache[path] = config
+        return dict(config)
+    return None
 
 # Initialize the database when this module is imported
 init_db()
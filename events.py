@@ -0,0 +1,90 @@
+import itertools
+import json
+import logging
+import queue
+import threading
+from typing import Dict, Optional
+
+class Subscription:
+    """Bounded queue of events for one listener"""
+
+    def __init__(self, max_queue: int):
+        self._queue = queue.Queue(maxsize=max_queue)
+
+    def put(self, event: Dict) -> bool:
+        """Queue an event without blocking; returns False if the queue is full"""
+        try:
+            self._queue.put_nowait(event)
+            return True
+        except queue.Full:
+            return False
+
+    def get(self, timeout: Optional[float] = None) -> Optional[Dict]:
+        """Next event, or None if nothing arrived within timeout"""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def reset(self, event: Dict) -> None:
+        """Drop everything queued and replace it with a single event"""
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+        self.put(event)
+
+class EventBus:
+    """Fans published events out to every subscriber
+
+    Publishing never blocks. A subscriber that falls max_queue events behind has
+    its backlog replaced with a single 'resync' event, telling the client to
+    reload state instead of replaying what it missed.
+    """
+
+    def __init__(self, max_queue: int = 1000):
+        self.max_queue = max_queue
+        self._subscribers = set()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def subscribe(self) -> Subscription:
+        """Start receiving events published from now on"""
+        subscription = Subscription(self.max_queue)
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        """Stop delivering events to a subscription"""
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def subscriber_count(self) -> int:
+        """Number of active subscriptions"""
+        with self._lock:
+            return len(self._subscribers)
+
+    def publish(self, event_type: str, data: Dict) -> None:
+        """Send an event to all current subscribers"""
+        with self._lock:
+            if not self._subscribers:
+                return
+            event = {'id': next(self._ids), 'type': event_type, 'data': data}
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            if not subscription.put(event):
+                logging.warning("Event subscriber fell behind, asking it to resync")
+                subscription.reset({'id': event['id'], 'type': 'resync', 'data': {}})
+
+def format_sse(event: Dict) -> str:
+    """Encode an event in the text/event-stream wire format"""
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event['data'])}\n\n"
+
+# Shared bus for agent output and state changes
+event_bus = EventBus()
+
+def publish(event_type: str, data: Dict) -> None:
+    """Publish an event on the shared bus"""
+    event_bus.publish(event_type, data)
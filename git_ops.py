@@ -0,0 +1,51 @@
+import logging
+import subprocess
+from pathlib import Path
+from typing import List, Optional, Union
+
+PathLike = Union[str, Path]
+
+class GitError(subprocess.CalledProcessError):
+    """A git command exited with a non-zero status"""
+
+    def __str__(self):
+        # The command line is left out because push URLs can carry a token
+        return f"git exited with status {self.returncode}: {(self.stderr or '').strip()}"
+
+def run_git(args: List[str], cwd: Optional[PathLike] = None, check: bool = True,
+            timeout: Optional[float] = None) -> subprocess.CompletedProcess:
+    """Run git with an argument list against an explicit directory
+
+    The process working directory is never changed, so callers on different
+    threads can run git in different repositories at the same time.
+    """
+    cmd = ['git', '-C', str(cwd), *args] if cwd else ['git', *args]
+    result = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+    if check and result.returncode != 0:
+        raise GitError(result.returncode, cmd, result.stdout, result.stderr)
+    return result
+
+def clone(url: str, destination: PathLike, cwd: Optional[PathLike] = None) -> None:
+    """Clone url into destination, relative to cwd when given"""
+    run_git(['clone', '--quiet', url, str(destination)], cwd=cwd)
+
+def create_branch(repo_path: PathLike, branch_name: str) -> None:
+    """Create and check out a new branch"""
+    run_git(['checkout', '-b', branch_name], cwd=repo_path)
+
+def commit_all(repo_path: PathLike, message: str, author_name: str, author_email: str) -> bool:
+    """Stage every change and commit it; returns False if there was nothing to commit"""
+    run_git(['add', '--all'], cwd=repo_path)
+    result = run_git([
+        '-c', f'user.name={author_name}',
+        '-c', f'user.email={author_email}',
+        'commit', '--quiet', '-m', message
+    ], cwd=repo_path, check=False)
+    if result.returncode != 0:
+        logging.info(f"Nothing committed in {repo_path}: {result.stdout.strip() or result.stderr.strip()}")
+        return False
+    return True
+
+def push_branch(repo_path: PathLike, remote: str, branch_name: str) -> None:
+    """Push a local branch to the same name on remote, which may be a URL"""
+    run_git(['push', remote, f'{branch_name}:refs/heads/{branch_name}'], cwd=repo_path)
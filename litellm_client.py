@@ -1,74 +1,415 @@
 import os
 import json
+import asyncio
 import logging
+import threading
+import time
+import httpx
 import litellm
 from pathlib import Path
+from types import SimpleNamespace
 from dotenv import load_dotenv
-from litellm import completion
+from litellm import completion, acompletion
+from llm_cache import ResponseCache
+from llm_dispatch import DEFAULT_BURST, DEFAULT_RATE_PER_SECOND, LLMDispatcher
+from prompts import prompt_registry
+from stream_parser import JSONFieldStream
+from context_builder import estimate_tokens
+from events import publish
+from mock_llm import provider_from_env
+from recorder import get_recorder
+from metrics import LLM_ERRORS, LLM_REQUEST_SECONDS
+from tracing import span
+
+DEFAULT_REQUEST_TIMEOUT = 60  # Seconds before an LLM request is abandoned
+DEFAULT_MAX_CONCURRENCY_PER_MODEL = 8  # Requests in flight to one model at once
+HTTP_POOL_LIMITS = httpx.Limits(max_connections=64, max_keepalive_connections=32)
+# Models that only cache a prompt prefix when it is marked with cache_control;
+# OpenAI, Gemini and DeepSeek models cache repeated prefixes automatically
+CACHE_CONTROL_MODEL_MARKERS = ('anthropic/', 'claude')
+
+# Default models - all use Gemini Flash
+DEFAULT_MODELS = {
+    "orchestrator": "openrouter/google/gemini-flash-1.5",  # Default model for orchestrator
+    "aider": "openrouter/google/gemini-flash-1.5",        # Default model for aider
+    "agent": "openrouter/google/gemini-flash-1.5"         # Default model for agent
+}
+
+_session_lock = threading.Lock()
+_loop = None
+
+def _rate_limit_setting(key: str, default: float) -> float:
+    """A positive rate limit setting from config, then the environment, else default"""
+    from database import get_config
+    value = get_config(key) or os.getenv(key.upper())
+    if not value:
+        return default
+    try:
+        number = float(value)
+    except ValueError:
+        number = 0
+    if number <= 0:
+        logging.warning(f"Invalid {key} setting: {value}")
+        return default
+    return number
+
+def get_llm_rate_limit():
+    """Per-model (requests per second, burst) for the LLM dispatcher"""
+    return (_rate_limit_setting('llm_rate_per_second', DEFAULT_RATE_PER_SECOND),
+            _rate_limit_setting('llm_burst', DEFAULT_BURST))
+
+def _ensure_sync_session():
+    """Share one pooled HTTP client between all synchronous LiteLLM calls"""
+    with _session_lock:
+        if litellm.client_session is None:
+            litellm.client_session = httpx.Client(limits=HTTP_POOL_LIMITS)
+
+async def _open_async_session():
+    # Created on the background loop so pooled connections never cross event loops
+    litellm.aclient_session = httpx.AsyncClient(limits=HTTP_POOL_LIMITS)
+
+def get_event_loop():
+    """The background event loop every async LLM request runs on, started on first use"""
+    global _loop
+    with _session_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="llm-client-loop", daemon=True).start()
+            asyncio.run_coroutine_threadsafe(_open_async_session(), loop).result()
+            _loop = loop
+        return _loop
+
+async def _acquire(semaphore):
+    """Take a slot of a threading semaphore from the event loop without blocking it
+
+    Polled with growing sleeps, so a cancelled request never ends up holding a slot.
+    """
+    delay = 0.005
+    while not semaphore.acquire(blocking=False):
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 0.1)
+
+_unpriced_models = set()
+
+def _count(value):
+    return value if isinstance(value, (int, float)) else 0
+
+def response_usage(response, model, system_message, user_message, content):
+    """(prompt_tokens, completion_tokens, cost) of a response, estimating what the provider did not report"""
+    usage = getattr(response, 'usage', None)
+    prompt_tokens = _count(getattr(usage, 'prompt_tokens', None)) or (
+        estimate_tokens(system_message) + estimate_tokens(user_message)
+    )
+    completion_tokens = _count(getattr(usage, 'completion_tokens', None)) or estimate_tokens(content)
+    hidden_params = getattr(response, '_hidden_params', None)
+    cost = hidden_params.get('response_cost') if isinstance(hidden_params, dict) else None
+    if not isinstance(cost, (int, float)):
+        cost = 0.0
+        if model not in _unpriced_models:
+            try:
+                cost = sum(litellm.cost_per_token(
+                    model=model, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens
+                ))
+            except Exception:
+                # No price known for this model; don't look it up again
+                _unpriced_models.add(model)
+    return int(prompt_tokens), int(completion_tokens), float(cost)
+
+def strip_code_fences(content):
+    """Strip a markdown code block wrapped around a JSON response"""
+    if content.startswith('```json') and content.endswith('```'):
+        return content[7:-3].strip()  # Remove ```json and trailing ```
+    if content.startswith('```') and content.endswith('```'):
+        return content[3:-3].strip()  # Remove ``` and trailing ```
+    return content
+
+class StreamInterrupted(Exception):
+    """A streamed response failed after some of its fields had been delivered"""
 
 class LiteLLMClient:
     """Client for interacting with LLMs to get summaries with JSON mode"""
     
-    def __init__(self):
+    def __init__(self, response_cache: ResponseCache = None, request_timeout: float = DEFAULT_REQUEST_TIMEOUT,
+                 max_concurrency_per_model: int = DEFAULT_MAX_CONCURRENCY_PER_MODEL,
+                 dispatcher: LLMDispatcher = None, provider=None):
         # Load environment variables from ~/.env
         env_path = Path.home() / '.env'
         if not load_dotenv(env_path):
             logging.warning(f"Could not load {env_path}")
             
         self.api_key = os.getenv('OPENROUTER_API_KEY')
+        # Offline stand-in for LiteLLM, selected with LLM_PROVIDER=mock
+        self.provider = provider or provider_from_env()
         
-        if not self.api_key:
+        if not self.api_key and self.provider is None:
             raise ValueError(f"OPENROUTER_API_KEY not found in {env_path}")
 
         litellm.success_callback=["helicone"]
-        
-    def chat_completion(self, system_message: str = "", user_message: str = "", model_type="orchestrator", agent_id=0):
-        # Get the appropriate model based on type
+
+        # Identical requests are answered from the cache; persisting it is opt-in via config
+        if response_cache is None:
+            from database import get_config
+            response_cache = ResponseCache(persist=get_config('llm_cache_persist') == '1')
+        self.response_cache = response_cache
+
+        self.request_timeout = request_timeout
+        self.max_concurrency_per_model = max(1, int(max_concurrency_per_model))
+        # model -> threading.BoundedSemaphore, shared by threads and the background loop
+        self._semaphores = {}
+        self._semaphore_lock = threading.Lock()
+        # Rate limits, retries and circuit breaking per model
+        if dispatcher is None:
+            rate_per_second, burst = get_llm_rate_limit()
+            dispatcher = LLMDispatcher(rate_per_second=rate_per_second, burst=burst)
+        self.dispatcher = dispatcher
+        _ensure_sync_session()
+
+    def _resolve_model(self, model_type):
+        """Get the configured model for a model type, falling back to the default."""
         from database import get_model_config
         config = get_model_config()
-        
-        # Default models - all use Gemini Flash
-        DEFAULT_MODELS = {
-            "orchestrator": "openrouter/google/gemini-flash-1.5",  # Default model for orchestrator
-            "aider": "openrouter/google/gemini-flash-1.5",        # Default model for aider
-            "agent": "openrouter/google/gemini-flash-1.5"         # Default model for agent
+        return config.get(f"{model_type}_model", DEFAULT_MODELS[model_type]) if config else DEFAULT_MODELS[model_type]
+
+    def _system_content(self, model, system_message):
+        """System message content, with its static prefix marked cacheable where the model needs that."""
+        if not any(marker in model.lower() for marker in CACHE_CONTROL_MODEL_MARKERS):
+            return system_message
+        static, dynamic = prompt_registry.split(system_message)
+        if not static:
+            return system_message
+        content = [{"type": "text", "text": static, "cache_control": {"type": "ephemeral"}}]
+        if dynamic:
+            content.append({"type": "text", "text": dynamic})
+        return content
+
+    def _request(self, model, system_message, user_message, agent_id):
+        """Keyword arguments shared by sync and async completion calls."""
+        return {
+            'model': model,
+            'messages': [
+                {"role": "system", "content": self._system_content(model, system_message)},
+                {"role": "user", "content": user_message}
+            ],
+            'api_key': self.api_key,
+            'metadata': {
+                "agent_id": agent_id
+            },
+            'response_format': {"type": "json_object"},
+            'timeout': self.request_timeout
         }
-        
-        # Get model from config or use default
-        model = config.get(f"{model_type}_model", DEFAULT_MODELS[model_type]) if config else DEFAULT_MODELS[model_type]
+
+    def _error_response(self, e, model, model_type, system_message, user_message):
+        LLM_ERRORS.labels(model=model, error=type(e).__name__).inc()
+        logging.error(f"Error in chat_completion:", exc_info=True)
+        logging.error(f"Model type: {model_type}")
+        logging.error(f"Model: {model}")
+        logging.error(f"System message length: {len(system_message)}")
+        logging.error(f"User message length: {len(user_message)}")
+        return json.dumps({
+            "error": str(e) or type(e).__name__,
+            "model": model,
+            "model_type": model_type
+        })
+
+    def _record_usage(self, response, model, model_type, agent_id, system_message, user_message, content, started,
+                      usage_agent_ids=None):
+        """Store a response's token counts, cost and latency, announce them to the dashboard
+        and add the exchange to the session recording if one is active.
+
+        A request made for several agents has its tokens and cost split evenly across
+        usage_agent_ids; each of them is charged the full latency.
+        """
+        try:
+            prompt_tokens, completion_tokens, cost = response_usage(
+                response, model, system_message, user_message, content
+            )
+            elapsed = time.monotonic() - started
+            LLM_REQUEST_SECONDS.labels(model=model, model_type=model_type).observe(elapsed)
+            latency_ms = int(elapsed * 1000)
+            from database import record_usage
+            # Requests made for no agent are stored with a NULL agent_id
+            usage_agents = [str(a) for a in usage_agent_ids] if usage_agent_ids else [
+                None if agent_id is None else str(agent_id)
+            ]
+            count = len(usage_agents)
+            for index, usage_agent in enumerate(usage_agents):
+                # Integer shares that add up to the totals, the remainder going to the first agents
+                share_prompt = prompt_tokens // count + (index < prompt_tokens % count)
+                share_completion = completion_tokens // count + (index < completion_tokens % count)
+                record_usage(usage_agent, model, model_type, share_prompt, share_completion, cost / count, latency_ms)
+                publish('usage', {
+                    'agent_id': usage_agent,
+                    'model': model,
+                    'prompt_tokens': share_prompt,
+                    'completion_tokens': share_completion,
+                    'cost': cost / count,
+                    'latency_ms': latency_ms
+                })
+            recorder = get_recorder()
+            if recorder:
+                recorder.record_llm(agent_id, model_type, model, system_message, user_message, content, latency_ms)
+        except Exception as e:
+            logging.error(f"Error recording LLM usage: {e}")
+
+    def _complete(self, **request):
+        if self.provider is not None:
+            return self.provider.completion(**request)
+        return completion(**request)
+
+    async def _acomplete(self, **request):
+        if self.provider is not None:
+            return await self.provider.acompletion(**request)
+        return await acompletion(**request)
+
+    def _semaphore(self, model):
+        with self._semaphore_lock:
+            if model not in self._semaphores:
+                self._semaphores[model] = threading.BoundedSemaphore(self.max_concurrency_per_model)
+            return self._semaphores[model]
+
+    def chat_completion(self, system_message: str = "", user_message: str = "", model_type="orchestrator", agent_id=0,
+                        usage_agent_ids=None):
+        # Get the appropriate model based on type
+        model = self._resolve_model(model_type)
         
         logging.info(f"Using {model_type} model: {model}")
+        cache_key = self.response_cache.make_key(model, system_message, user_message, scope=str(agent_id))
+        cached = self.response_cache.get(cache_key)
+        if cached is not None:
+            logging.info(f"Cache hit for {model_type} request from agent {agent_id}")
+            return cached
+        request = self._request(model, system_message, user_message, agent_id)
+        semaphore = self._semaphore(model)
+
+        def send():
+            with semaphore:
+                return self._complete(**request)
+
         try:
-            response = completion(
-                model=model,
-                messages=[
-                    {"role": "system", "content": system_message},
-                    {"role": "user", "content": user_message}
-                ],
-                api_key=self.api_key,
-                metadata={
-                    "agent_id": agent_id
-                },
-                response_format={"type": "json_object"}
-            )
+            started = time.monotonic()
+            with span('chat_completion', model=model, model_type=model_type):
+                response = self.dispatcher.call(model, send)
             
             # Strip markdown code blocks if present
-            content = response.choices[0].message.content
-            if content.startswith('```json') and content.endswith('```'):
-                content = content[7:-3].strip()  # Remove ```json and trailing ```
-            elif content.startswith('```') and content.endswith('```'):
-                content = content[3:-3].strip()  # Remove ``` and trailing ```
+            content = strip_code_fences(response.choices[0].message.content)
+            self._record_usage(response, model, model_type, agent_id, system_message, user_message, content, started,
+                               usage_agent_ids)
             
+            self.response_cache.put(cache_key, content)
             return content
             
         except Exception as e:
-            logging.error(f"Error in chat_completion:", exc_info=True)
-            logging.error(f"Model type: {model_type}")
-            logging.error(f"Model: {model}")
-            logging.error(f"System message length: {len(system_message)}")
-            logging.error(f"User message length: {len(user_message)}")
-            return json.dumps({
-                "error": str(e),
-                "model": model,
-                "model_type": model_type
-            })
+            return self._error_response(e, model, model_type, system_message, user_message)
+
+    def stream_chat_completion(self, system_message: str = "", user_message: str = "", model_type="orchestrator",
+                               agent_id=0, on_field=None):
+        """chat_completion that streams the response and calls on_field(name, value) for
+        each top-level string field as soon as it is complete.
+
+        Returns the full response content like chat_completion. A cached response
+        reports all its fields at once.
+        """
+        model = self._resolve_model(model_type)
+        logging.info(f"Using {model_type} model: {model} (streaming)")
+        cache_key = self.response_cache.make_key(model, system_message, user_message, scope=str(agent_id))
+        cached = self.response_cache.get(cache_key)
+        if cached is not None:
+            logging.info(f"Cache hit for {model_type} request from agent {agent_id}")
+            if on_field:
+                parser = JSONFieldStream()
+                for name, value in parser.feed(cached).items():
+                    on_field(name, value)
+            return cached
+        request = self._request(model, system_message, user_message, agent_id)
+        semaphore = self._semaphore(model)
+        emitted = []
+
+        def send():
+            parser = JSONFieldStream()
+            parts = []
+            usage = None
+            with semaphore:
+                try:
+                    for chunk in self._complete(**request, stream=True, stream_options={"include_usage": True}):
+                        usage = getattr(chunk, 'usage', None) or usage
+                        delta = chunk.choices[0].delta.content if chunk.choices else None
+                        if not delta:
+                            continue
+                        parts.append(delta)
+                        for name, value in parser.feed(delta).items():
+                            emitted.append(name)
+                            if on_field:
+                                on_field(name, value)
+                except Exception as e:
+                    if emitted:
+                        # Fields were already acted on, so the request must not be retried
+                        raise StreamInterrupted(str(e)) from e
+                    raise
+            return ''.join(parts), usage
+
+        try:
+            started = time.monotonic()
+            with span('chat_completion', model=model, model_type=model_type, stream=True):
+                text, usage = self.dispatcher.call(model, send)
+            content = strip_code_fences(text.strip())
+            self._record_usage(SimpleNamespace(usage=usage), model, model_type, agent_id,
+                               system_message, user_message, content, started)
+            self.response_cache.put(cache_key, content)
+            return content
+        except Exception as e:
+            return self._error_response(e, model, model_type, system_message, user_message)
+
+    async def achat_completion(self, system_message: str = "", user_message: str = "",
+                               model_type="orchestrator", agent_id=0):
+        """Async chat_completion; cancelling the awaiting task cancels the request."""
+        loop = get_event_loop()
+        if asyncio.get_running_loop() is loop:
+            return await self._achat_completion(system_message, user_message, model_type, agent_id)
+        future = asyncio.run_coroutine_threadsafe(
+            self._achat_completion(system_message, user_message, model_type, agent_id), loop
+        )
+        return await asyncio.wrap_future(future)
+
+    def submit_chat_completion(self, system_message: str = "", user_message: str = "",
+                               model_type="orchestrator", agent_id=0):
+        """Start a request from any thread and return a concurrent.futures.Future for its content."""
+        return asyncio.run_coroutine_threadsafe(
+            self._achat_completion(system_message, user_message, model_type, agent_id), get_event_loop()
+        )
+
+    async def _achat_completion(self, system_message, user_message, model_type, agent_id):
+        # Config, cache and usage go through SQLite, so they run off the event loop
+        loop = asyncio.get_running_loop()
+        model = await loop.run_in_executor(None, self._resolve_model, model_type)
+        logging.info(f"Using {model_type} model: {model}")
+        cache_key = self.response_cache.make_key(model, system_message, user_message, scope=str(agent_id))
+        cached = await loop.run_in_executor(None, self.response_cache.get, cache_key)
+        if cached is not None:
+            logging.info(f"Cache hit for {model_type} request from agent {agent_id}")
+            return cached
+        semaphore = self._semaphore(model)
+        request = self._request(model, system_message, user_message, agent_id)
+
+        async def send():
+            await _acquire(semaphore)
+            try:
+                return await asyncio.wait_for(self._acomplete(**request), self.request_timeout)
+            finally:
+                semaphore.release()
+
+        try:
+            started = time.monotonic()
+            response = await self.dispatcher.acall(model, send)
+            content = strip_code_fences(response.choices[0].message.content)
+            await loop.run_in_executor(None, self._record_usage, response, model, model_type, agent_id,
+                                       system_message, user_message, content, started)
+            await loop.run_in_executor(None, self.response_cache.put, cache_key, content)
+            return content
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            return self._error_response(e, model, model_type, system_message, user_message)
+
+    def cache_stats(self):
+        """Hit and miss counts for the response cache."""
+        return self.response_cache.stats()
@@ -0,0 +1,91 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+DEFAULT_MAX_ENTRIES = 256
+DEFAULT_TTL_SECONDS = 300
+
+class ResponseCache:
+    """Content-addressed LRU cache of LLM responses with a TTL
+
+    Entries are keyed by a digest of the model, scope, system prompt and user
+    message. With persist=True entries are also written to the llm_cache table
+    so they survive restarts.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, ttl_seconds: float = DEFAULT_TTL_SECONDS,
+                 persist: bool = False):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl_seconds = ttl_seconds
+        self.persist = persist
+        self._entries = OrderedDict()  # key -> (stored_at, response), least recently used first
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(model: str, system_message: str, user_message: str, scope: str = '') -> str:
+        """Digest identifying one request; scope keeps agents' decisions apart"""
+        digest = hashlib.sha256()
+        for part in (model, scope, system_message, user_message):
+            data = (part or '').encode('utf-8')
+            digest.update(len(data).to_bytes(8, 'big'))
+            digest.update(data)
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Cached response for key, or None if missing or expired"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and now - entry[0] < self.ttl_seconds:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry:
+                del self._entries[key]
+        response = None
+        if self.persist:
+            from database import get_cached_response
+            response = get_cached_response(key, self.ttl_seconds)
+        with self._lock:
+            if response is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._store(key, response, now)
+        return response
+
+    def put(self, key: str, response: str) -> None:
+        """Cache a response"""
+        with self._lock:
+            self._store(key, response, time.monotonic())
+        if self.persist:
+            from database import save_cached_response
+            save_cached_response(key, response, self.ttl_seconds)
+
+    def _store(self, key: str, response: str, stored_at: float) -> None:
+        self._entries[key] = (stored_at, response)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """Drop every in-memory entry and reset the counters"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict:
+        """Hit and miss counts and current size"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
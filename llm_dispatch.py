@@ -0,0 +1,240 @@
+import asyncio
+import email.utils
+import logging
+import random
+import threading
+import time
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+T = TypeVar('T')
+
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BASE_DELAY = 1.0  # Seconds before the first retry, doubled for each one after
+DEFAULT_MAX_DELAY = 30.0
+MAX_RETRY_AFTER = 60.0  # Longest server-requested wait that is honoured
+# Requests per second per model, and how many may go out at once after a quiet
+# spell. Conservative for shared API keys; raise them with the llm_rate_per_second
+# and llm_burst config keys (or LLM_RATE_PER_SECOND/LLM_BURST) when the provider
+# allows more, since every agent step makes at least one request
+DEFAULT_RATE_PER_SECOND = 5.0
+DEFAULT_BURST = 10
+DEFAULT_FAILURE_THRESHOLD = 5  # Consecutive failures that open a model's circuit
+DEFAULT_RESET_TIMEOUT = 30.0  # Seconds an open circuit rejects calls before a trial request
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+class CircuitOpenError(Exception):
+    """Calls to a model are being rejected after repeated failures"""
+
+    def __init__(self, key: str, retry_in: float):
+        super().__init__(f"Circuit open for {key}; retry in {retry_in:.1f}s")
+        self.key = key
+        self.retry_in = retry_in
+
+def is_retryable(error: BaseException) -> bool:
+    """Whether an error is transient: throttling, timeouts, connection and server errors"""
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    status = getattr(error, 'status_code', None)
+    if status is None:
+        status = getattr(getattr(error, 'response', None), 'status_code', None)
+    if status in RETRYABLE_STATUS_CODES:
+        return True
+    try:
+        import httpx
+        return isinstance(error, httpx.TransportError)
+    except ImportError:
+        return False
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Seconds to wait from a Retry-After header on the error's response, if any"""
+    headers = getattr(error, 'litellm_response_headers', None) or getattr(getattr(error, 'response', None), 'headers', None)
+    if not headers:
+        return None
+    value = headers.get('retry-after') or headers.get('Retry-After')
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+        return max(0.0, when.timestamp() - time.time())
+    except (TypeError, ValueError, IndexError):
+        return None
+
+class TokenBucket:
+    """Token-bucket rate limiter that reserves tokens ahead and reports how long to wait"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Take one token and return the seconds to wait before using it"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def penalize(self, seconds: float) -> None:
+        """Hold back new requests for a while, e.g. after the server asked us to slow down"""
+        with self._lock:
+            self._tokens = min(self._tokens, -seconds * self.rate)
+
+class CircuitBreaker:
+    """Closed -> open after repeated failures -> half-open trial after a cooldown"""
+
+    def __init__(self, failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+                 reset_timeout: float = DEFAULT_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state(time.monotonic())
+
+    def _state(self, now: float) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        return 'open' if now - self.opened_at < self.reset_timeout else 'half_open'
+
+    def before_call(self, key: str) -> None:
+        """Raise CircuitOpenError unless a call may go ahead"""
+        with self._lock:
+            now = time.monotonic()
+            state = self._state(now)
+            if state == 'open':
+                raise CircuitOpenError(key, self.reset_timeout - (now - self.opened_at))
+            if state == 'half_open':
+                if self._trial_in_flight:
+                    raise CircuitOpenError(key, 0.0)
+                self._trial_in_flight = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self._trial_in_flight or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+    def release(self) -> None:
+        """End a half-open trial that finished without saying anything about the provider"""
+        with self._lock:
+            self._trial_in_flight = False
+
+class LLMDispatcher:
+    """Runs LLM calls per model behind a rate limiter, a circuit breaker and retries
+
+    Transient errors are retried with exponential backoff and full jitter, waiting
+    at least as long as a Retry-After header asks. Other errors are raised at once.
+    """
+
+    def __init__(self, max_retries: int = DEFAULT_MAX_RETRIES, base_delay: float = DEFAULT_BASE_DELAY,
+                 max_delay: float = DEFAULT_MAX_DELAY, rate_per_second: float = DEFAULT_RATE_PER_SECOND,
+                 burst: float = DEFAULT_BURST, failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+                 reset_timeout: float = DEFAULT_RESET_TIMEOUT):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.rate_per_second = rate_per_second
+        self.burst = burst
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, key: str) -> TokenBucket:
+        with self._lock:
+            if key not in self._buckets:
+                self._buckets[key] = TokenBucket(self.rate_per_second, self.burst)
+            return self._buckets[key]
+
+    def breaker(self, key: str) -> CircuitBreaker:
+        with self._lock:
+            if key not in self._breakers:
+                self._breakers[key] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+            return self._breakers[key]
+
+    def backoff(self, attempt: int, error: BaseException) -> float:
+        """Delay before retry number attempt (0-based)"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        requested = retry_after(error)
+        if requested is not None:
+            delay = max(delay, min(requested, MAX_RETRY_AFTER))
+        return delay
+
+    def _after_failure(self, key: str, attempt: int, error: BaseException) -> Optional[float]:
+        """Record a failed attempt; returns the delay before retrying or None to give up"""
+        breaker = self.breaker(key)
+        if not is_retryable(error):
+            breaker.release()
+            return None
+        breaker.record_failure()
+        if attempt >= self.max_retries:
+            return None
+        delay = self.backoff(attempt, error)
+        if retry_after(error) is not None:
+            self.bucket(key).penalize(delay)
+        logging.warning(f"LLM call to {key} failed ({error}); retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+        return delay
+
+    def call(self, key: str, fn: Callable[[], T]) -> T:
+        """Call fn for model key from a thread, sleeping between retries"""
+        attempt = 0
+        while True:
+            self.breaker(key).before_call(key)
+            wait = self.bucket(key).reserve()
+            if wait:
+                time.sleep(wait)
+            try:
+                result = fn()
+            except Exception as e:
+                delay = self._after_failure(key, attempt, e)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self.breaker(key).record_success()
+            return result
+
+    async def acall(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        """Await fn() for model key, sleeping asynchronously between retries"""
+        attempt = 0
+        while True:
+            self.breaker(key).before_call(key)
+            wait = self.bucket(key).reserve()
+            if wait:
+                await asyncio.sleep(wait)
+            try:
+                result = await fn()
+            except asyncio.CancelledError:
+                self.breaker(key).release()
+                raise
+            except Exception as e:
+                delay = self._after_failure(key, attempt, e)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            self.breaker(key).record_success()
+            return result
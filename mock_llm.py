@@ -0,0 +1,153 @@
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import os
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from context_builder import estimate_tokens
+
+MOCK_ACTIONS = ['/ls', '/map', '/instruct add a unit test for the parser', '/run python -m pytest -q',
+                '/add main.py', '/instruct refactor the helper into its own module']
+SESSION_HEADER = re.compile(r'^### Session (\S+)', re.MULTILINE)
+
+def parse_latency(spec: Optional[str]) -> Callable[[random.Random], float]:
+    """Latency sampler from a spec: "0.2", "uniform:0.1,0.5" or "lognormal:median,sigma" (seconds)"""
+    spec = (spec or '0').strip()
+    kind, _, params = spec.partition(':')
+    if not params:
+        value = float(kind)
+        return lambda rng: value
+    values = [float(v) for v in params.split(',')]
+    if kind == 'uniform':
+        low, high = values
+        return lambda rng: rng.uniform(low, high)
+    if kind == 'lognormal':
+        median, sigma = values
+        mu = math.log(median)
+        return lambda rng: rng.lognormvariate(mu, sigma)
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+class MockLLMProvider:
+    """Offline stand-in for LiteLLM's completion calls
+
+    Responses come from a script (a JSONL file of response objects, used in
+    order and then cycled) or are generated deterministically from the request,
+    matching the schema the prompt asks for. Latency is sampled from a
+    configurable distribution.
+    """
+
+    def __init__(self, latency: str = '0', script: Optional[List] = None, seed: int = 0, chunk_size: int = 16):
+        self._sample_latency = parse_latency(latency)
+        self._script = list(script or [])
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.chunk_size = chunk_size
+        self.calls = 0
+
+    @classmethod
+    def from_env(cls) -> 'MockLLMProvider':
+        """Configure from MOCK_LLM_LATENCY, MOCK_LLM_SCRIPT and MOCK_LLM_SEED"""
+        script = None
+        script_path = os.getenv('MOCK_LLM_SCRIPT')
+        if script_path:
+            with open(script_path, encoding='utf-8') as f:
+                script = [json.loads(line) for line in f if line.strip()]
+        return cls(
+            latency=os.getenv('MOCK_LLM_LATENCY', '0'),
+            script=script,
+            seed=int(os.getenv('MOCK_LLM_SEED', '0'))
+        )
+
+    def _next(self, messages: List[Dict], metadata: Optional[Dict] = None) -> Tuple[str, float]:
+        """Response content and latency for the next call; metadata carries the caller's agent_id"""
+        with self._lock:
+            index = self.calls
+            self.calls += 1
+            latency = max(0.0, self._sample_latency(self._rng))
+        if self._script:
+            entry = self._script[index % len(self._script)]
+            return entry if isinstance(entry, str) else json.dumps(entry), latency
+        return self.respond(messages, index), latency
+
+    def respond(self, messages: List[Dict], index: int = 0) -> str:
+        """Deterministic response in the shape the system prompt asks for"""
+        system = message_text(messages[0]['content']) if messages else ''
+        user = message_text(messages[-1]['content']) if messages else ''
+        if '"summary"' in system:
+            return json.dumps({'summary': f"Earlier output: {len(user)} characters, {user.count(chr(10))} lines."})
+        if '"decisions"' in system:
+            return json.dumps({'decisions': {
+                agent_id: self._decision(agent_id + user, index) for agent_id in SESSION_HEADER.findall(user)
+            }})
+        if '"reviewers"' in system:
+            return json.dumps({'title': 'Mock change', 'description': 'Generated offline.', 'labels': [], 'reviewers': []})
+        return json.dumps(self._decision(system + user, index))
+
+    @staticmethod
+    def _decision(seed_text: str, index: int) -> Dict:
+        digest = int(hashlib.sha256(f"{index}:{seed_text}".encode('utf-8')).hexdigest(), 16)
+        return {
+            'progress': f"Step {index} done",
+            'thought': 'Continue with the next small change',
+            'action': MOCK_ACTIONS[digest % len(MOCK_ACTIONS)],
+            'future': 'Check the result'
+        }
+
+    @staticmethod
+    def _usage(messages: List[Dict], content: str) -> SimpleNamespace:
+        return SimpleNamespace(
+            prompt_tokens=sum(estimate_tokens(message_text(m['content'])) for m in messages),
+            completion_tokens=estimate_tokens(content)
+        )
+
+    def completion(self, messages: List[Dict], stream: bool = False, metadata: Optional[Dict] = None, **kwargs):
+        content, latency = self._next(messages, metadata)
+        usage = self._usage(messages, content)
+        if stream:
+            return self._stream(content, latency, usage)
+        time.sleep(latency)
+        response = SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+            usage=usage
+        )
+        response._hidden_params = {'response_cost': 0.0}
+        return response
+
+    def _stream(self, content: str, latency: float, usage) -> Iterator:
+        time.sleep(latency)
+        for i in range(0, len(content), self.chunk_size):
+            yield SimpleNamespace(
+                choices=[SimpleNamespace(delta=SimpleNamespace(content=content[i:i + self.chunk_size]))],
+                usage=None
+            )
+        yield SimpleNamespace(choices=[], usage=usage)
+
+    async def acompletion(self, messages: List[Dict], metadata: Optional[Dict] = None, **kwargs):
+        content, latency = self._next(messages, metadata)
+        usage = self._usage(messages, content)
+        await asyncio.sleep(latency)
+        response = SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+            usage=usage
+        )
+        response._hidden_params = {'response_cost': 0.0}
+        return response
+
+def message_text(content) -> str:
+    """Text of a message's content; system messages may be split into cacheable blocks"""
+    if isinstance(content, list):
+        return ''.join(block.get('text', '') for block in content)
+    return content or ''
+
+def provider_from_env() -> Optional[MockLLMProvider]:
+    """The mock provider when LLM_PROVIDER=mock, otherwise None for real LiteLLM calls"""
+    if os.getenv('LLM_PROVIDER', '').lower() != 'mock':
+        return None
+    logging.info("Using the offline mock LLM provider")
+    return MockLLMProvider.from_env()
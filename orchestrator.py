@@ -1,11 +1,19 @@
 import os, json, traceback, subprocess, sys, uuid
 from pull_request import PullRequestManager
-from prompts import PROMPT_AIDER
+from prompts import PROMPT_AIDER, PROMPT_AIDER_BATCH, PROMPT_SUMMARY
 from litellm_client import LiteLLMClient
-from prompt_processor import PromptProcessor
+from prompt_processor import PromptProcessor, parse_action
+from scheduler import AgentScheduler
+from repo_cache import clone_from_mirror
+from git_ops import GitError, create_branch, run_git
+from context_builder import ContextBuilder, DEFAULT_CONTEXT_TOKEN_BUDGET
+from events import publish
+from metrics import Gauge, PR_CREATE_SECONDS, SWEEP_SECONDS, registry as metrics_registry
+from tracing import tracer, traced
 from pathlib import Path
 import shutil
 import tempfile
+import time
 from time import sleep
 import datetime
 import logging
@@ -16,8 +24,9 @@ from dotenv import load_dotenv
 from agent_session import AgentSession, normalize_path
 
 from database import (
-    save_agent, get_agent, get_all_agents, delete_agent as db_delete_agent,
-    save_task, get_all_tasks, save_config, get_config
+    save_agents, get_agent, get_all_agents, get_agents_since, get_agent_ids,
+    delete_agent as db_delete_agent, save_task, get_all_tasks, save_config, get_config,
+    get_model_config
 )
 
 # Configuration
@@ -25,10 +34,35 @@ DEFAULT_AGENTS_PER_TASK = 2
 tools, available_functions = [], {}
 MAX_TOOL_OUTPUT_LENGTH = 5000  # Adjust as needed
 CHECK_INTERVAL = 5  # Reduced to 30 seconds for more frequent updates
+MAX_CONCURRENT_AGENTS = 8  # Agent steps running at once, overridable via config
+DECISION_BATCH_SIZE = 1  # Agents decided per LLM request; 1 disables batching, overridable via config
+STATE_EVENT_FIELDS = ('status', 'progress', 'thought', 'future', 'last_action', 'last_updated')
 
 # Global dictionaries to store sessions and processors
 aider_sessions = {}
 prompt_processors = {}
+# Output cursor of each session as of the last time its output was saved
+output_cursors = {}
+# Rolling output summary of each agent, used to keep decision prompts within budget
+context_builders = {}
+
+def _output_buffer_sizes():
+    for agent_id, session in list(aider_sessions.items()):
+        buffer = session.output_buffer
+        yield {'agent_id': agent_id}, buffer.tell() - buffer.start
+
+def _active_processes():
+    yield {}, sum(1 for session in list(aider_sessions.values())
+                  if session.process and session.process.poll() is None)
+
+# Read from the live sessions only when scraped. Run as a script, this module is
+# imported a second time as "orchestrator" (by pull_request); the first
+# registration is kept, as it sees the sessions main_loop actually runs
+if metrics_registry.get('agent_output_buffer_chars') is None:
+    Gauge('agent_output_buffer_chars', 'Output retained in memory per agent session', ('agent_id',),
+          collect=_output_buffer_sizes)
+if metrics_registry.get('aider_processes_active') is None:
+    Gauge('aider_processes_active', 'Running aider subprocesses', collect=_active_processes)
 
 def load_tasks():
     """Load tasks and agents from database."""
@@ -38,6 +72,15 @@ def load_tasks():
         'repository_url': get_config('repository_url') or ''
     }
 
+def load_tasks_since(version):
+    """Load agents changed after a state version, plus the current agent IDs."""
+    return {
+        'tasks': get_all_tasks(),
+        'agents': get_agents_since(version),
+        'agent_ids': get_agent_ids(),
+        'repository_url': get_config('repository_url') or ''
+    }
+
 def save_tasks(tasks_data):
     """Save tasks and agents to database."""
     try:
@@ -45,9 +88,8 @@ def save_tasks(tasks_data):
         if 'repository_url' in tasks_data:
             save_config('repository_url', tasks_data['repository_url'])
         
-        # Save agents
-        for agent_id, agent_data in tasks_data.get('agents', {}).items():
-            save_agent(agent_id, agent_data)
+        # Save changed agents in a single transaction
+        save_agents(tasks_data.get('agents', {}))
     except Exception as e:
         logging.error(f"Error saving tasks: {e}", exc_info=True)
 
@@ -61,6 +103,8 @@ def delete_agent(agent_id):
             try:
                 aider_sessions[agent_id].cleanup()
                 del aider_sessions[agent_id]
+                output_cursors.pop(agent_id, None)
+                context_builders.pop(agent_id, None)
                 logging.info(f"Cleaned up session for agent {agent_id}")
             except Exception as e:
                 logging.error(f"Error cleaning up session: {e}", exc_info=True)
@@ -70,6 +114,7 @@ def delete_agent(agent_id):
         if not success:
             logging.error(f"Failed to delete agent {agent_id} from database")
             return False
+        publish('deleted', {'agent_id': agent_id})
             
         # Clean up workspace
         tasks_data = load_tasks()
@@ -104,68 +149,73 @@ def initialiseCodingAgent(repository_url: str = None, task_description: str = No
         return None
     created_agent_ids = []
     try:
-        tasks_data = load_tasks()
-        agent_config = tasks_data.get('config', {}).get('agent_session', {})
         for i in range(num_agents):
-            agent_id = str(uuid.uuid4())
-            logging.debug(f"Creating new agent with ID: {agent_id}")
-            agent_workspace = Path(tempfile.mkdtemp(prefix=f"agent_{agent_id}_")).resolve()
-            workspace_dirs = {
-                "src": agent_workspace / "src",
-                "tests": agent_workspace / "tests", 
-                "docs": agent_workspace / "docs", 
-                "config": agent_workspace / "config", 
-                "repo": agent_workspace / "repo"
-            }
-            for dir_path in workspace_dirs.values():
-                dir_path.mkdir(parents=True, exist_ok=True)
-            task_file = agent_workspace / "current_task.txt"
-            task_file.write_text(task_description)
-            original_dir = Path.cwd()
-            repo_dir = None
-            full_repo_path = None
-            try:
-                os.chdir(workspace_dirs["repo"])
-                if not repository_url:
-                    logging.error("No repository URL provided")
-                    shutil.rmtree(agent_workspace)
-                    continue
-                repo_name = repository_url.rstrip('/').split('/')[-1]
-                if repo_name.endswith('.git'):
-                    repo_name = repo_name[:-4]
-                if not cloneRepository(repository_url):
-                    logging.error("Failed to clone repository")
-                    shutil.rmtree(agent_workspace)
-                    continue
-                if not os.path.exists(repo_name) or not os.path.isdir(os.path.join(repo_name, '.git')):
-                    logging.error(f"Repo dir {repo_name} not found or not a git repository")
-                    shutil.rmtree(agent_workspace)
-                    continue
-                repo_dir = repo_name
-                full_repo_path = workspace_dirs["repo"] / repo_dir
-                full_repo_path = full_repo_path.resolve()
-                os.chdir(full_repo_path)
-                branch_name = f"agent-{agent_id[:8]}"
-                try:
-                    subprocess.check_call(f"git checkout -b {branch_name}", shell=True)
-                except subprocess.CalledProcessError:
-                    logging.error("Failed to create new branch", exc_info=True)
-                    shutil.rmtree(agent_workspace)
-                    continue
-                aider_session = AgentSession(str(full_repo_path), task_description, agent_config, aider_commands=aider_commands)
-                prompt_processor = PromptProcessor()
-                if not aider_session.start():
-                    logging.error("Failed to start aider session")
-                    shutil.rmtree(agent_workspace)
-                    continue
-                aider_sessions[agent_id] = aider_session
-                prompt_processors[agent_id] = prompt_processor
-            finally:
-                os.chdir(original_dir)
-            logging.debug(f"Storing agent {agent_id} in tasks data")
-            tasks_data['agents'][agent_id] = {
+            agent_id = provision_agent(str(uuid.uuid4()), repository_url, task_description, aider_commands)
+            if agent_id:
+                created_agent_ids.append(agent_id)
+        return created_agent_ids
+    except Exception as e:
+        logging.error(f"Error initializing coding agents: {e}", exc_info=True)
+        return None
+
+def provision_agent(agent_id: str, repository_url: str, task_description: str, aider_commands: str = None, agent_config: dict = None):
+    """Clone, branch and start aider for one agent; returns the agent ID or None on failure.
+
+    Nothing here changes the process working directory, so agents can be
+    provisioned from several threads at once.
+    """
+    logging.debug(f"Creating new agent with ID: {agent_id}")
+    agent_workspace = Path(tempfile.mkdtemp(prefix=f"agent_{agent_id}_")).resolve()
+    workspace_dirs = {
+        "src": agent_workspace / "src",
+        "tests": agent_workspace / "tests", 
+        "docs": agent_workspace / "docs", 
+        "config": agent_workspace / "config", 
+        "repo": agent_workspace / "repo"
+    }
+    for dir_path in workspace_dirs.values():
+        dir_path.mkdir(parents=True, exist_ok=True)
+    task_file = agent_workspace / "current_task.txt"
+    task_file.write_text(task_description)
+    if not repository_url:
+        logging.error("No repository URL provided")
+        shutil.rmtree(agent_workspace)
+        return None
+    repo_name = repository_url.rstrip('/').split('/')[-1]
+    if repo_name.endswith('.git'):
+        repo_name = repo_name[:-4]
+    if not cloneRepository(repository_url, cwd=str(workspace_dirs["repo"])):
+        logging.error("Failed to clone repository")
+        shutil.rmtree(agent_workspace)
+        return None
+    full_repo_path = (workspace_dirs["repo"] / repo_name).resolve()
+    if not os.path.exists(full_repo_path) or not os.path.isdir(full_repo_path / '.git'):
+        logging.error(f"Repo dir {repo_name} not found or not a git repository")
+        shutil.rmtree(agent_workspace)
+        return None
+    branch_name = f"agent-{agent_id[:8]}"
+    try:
+        create_branch(full_repo_path, branch_name)
+    except GitError as e:
+        logging.error(f"Failed to create new branch: {e}")
+        shutil.rmtree(agent_workspace)
+        return None
+    session_config = {**(agent_config or {}), 'transcript_path': str(agent_workspace / "transcript.log")}
+    aider_session = AgentSession(str(full_repo_path), task_description, session_config, aider_commands=aider_commands, agent_id=agent_id)
+    prompt_processor = PromptProcessor()
+    if not aider_session.start():
+        logging.error("Failed to start aider session")
+        shutil.rmtree(agent_workspace)
+        return None
+    aider_sessions[agent_id] = aider_session
+    prompt_processors[agent_id] = prompt_processor
+    logging.debug(f"Storing agent {agent_id} in tasks data")
+    save_tasks({
+        'repository_url': repository_url,
+        'agents': {
+            agent_id: {
                 'workspace': normalize_path(agent_workspace),
-                'repo_path': normalize_path(full_repo_path) if full_repo_path else None,
+                'repo_path': normalize_path(full_repo_path),
                 'task': task_description,
                 'status': 'pending',
                 'created_at': datetime.datetime.now().isoformat(),
@@ -178,13 +228,9 @@ def initialiseCodingAgent(repository_url: str = None, task_description: str = No
                 'future': '',
                 'last_action': ''
             }
-            tasks_data['repository_url'] = repository_url
-            save_tasks(tasks_data)
-            created_agent_ids.append(agent_id)
-        return created_agent_ids
-    except Exception as e:
-        logging.error(f"Error initializing coding agents: {e}", exc_info=True)
-        return None
+        }
+    })
+    return agent_id
 
 def get_github_token():
     """Retrieve GitHub token from environment variables."""
@@ -201,19 +247,20 @@ def get_github_token():
         logging.error(f"Invalid GitHub token: {e}")
         return None
 
-def cloneRepository(repository_url: str) -> bool:
-    """Clone git repository using subprocess."""
+def cloneRepository(repository_url: str, cwd: str = None) -> bool:
+    """Clone git repository into cwd (default the current directory), via the local mirror when possible."""
     try:
         if not repository_url:
             logging.error("No repository URL provided")
             return False
         logging.info(f"Cloning {repository_url}")
-        result = subprocess.run(
-            f"git clone --quiet {repository_url}",
-            shell=True,
-            capture_output=True,
-            text=True
-        )
+        repo_name = repository_url.rstrip('/').split('/')[-1]
+        if repo_name.endswith('.git'):
+            repo_name = repo_name[:-4]
+        if clone_from_mirror(repository_url, repo_name, cwd=cwd):
+            return True
+        logging.warning(f"Mirror clone of {repository_url} failed, cloning directly")
+        result = run_git(['clone', '--quiet', repository_url], cwd=cwd, check=False)
         if result.returncode != 0:
             logging.error(f"Git clone failed: {result.stderr}")
             return False
@@ -234,118 +281,318 @@ def update_agent_output(agent_id):
             logging.error(f"No agent found with ID {agent_id}")
             return False
         if agent_id in aider_sessions:
-            output = aider_sessions[agent_id].get_output()
+            output, offset = aider_sessions[agent_id].output_window()
             agent_data['aider_output'] = output
+            agent_data['output_offset'] = offset
             agent_data['last_updated'] = datetime.datetime.now().isoformat()
-            save_tasks(tasks_data)
+            save_agents({agent_id: agent_data})
             return True
         return False
     except Exception as e:
         logging.error(f"Error updating agent output: {e}", exc_info=True)
         return False
 
+def get_max_concurrent_agents() -> int:
+    """Get the agent step concurrency limit from config."""
+    value = get_config('max_concurrent_agents')
+    if not value:
+        return MAX_CONCURRENT_AGENTS
+    try:
+        return max(1, int(value))
+    except ValueError:
+        logging.warning(f"Invalid max_concurrent_agents config: {value}")
+        return MAX_CONCURRENT_AGENTS
+
+def get_decision_batch_size() -> int:
+    """Get how many ready agents share one decision request from config."""
+    value = get_config('decision_batch_size')
+    if not value:
+        return DECISION_BATCH_SIZE
+    try:
+        return max(1, int(value))
+    except ValueError:
+        logging.warning(f"Invalid decision_batch_size config: {value}")
+        return DECISION_BATCH_SIZE
+
+def get_context_token_budget():
+    """Get the token budget for an agent's decision context from the model config."""
+    config = get_model_config() or {}
+    try:
+        return max(1, int(config.get('context_token_budget') or DEFAULT_CONTEXT_TOKEN_BUDGET))
+    except (TypeError, ValueError):
+        return DEFAULT_CONTEXT_TOKEN_BUDGET
+
+def summarize_output(litellm_client, agent_id, previous_summary, new_output):
+    """Fold new agent output into its running summary using the orchestrator model."""
+    response = litellm_client.chat_completion(
+        PROMPT_SUMMARY(),
+        f"Previous summary:\n{previous_summary or '(none)'}\n\nNew output:\n{new_output}",
+        model_type="orchestrator",
+        agent_id=agent_id
+    )
+    return json.loads(response).get('summary')
+
+@traced('build_context')
+def build_agent_context(agent_id, agent_session, litellm_client):
+    """Recent output verbatim plus a summary of older output, within the token budget."""
+    builder = context_builders.get(agent_id)
+    if builder is None:
+        builder = context_builders[agent_id] = ContextBuilder(
+            lambda previous, new_output: summarize_output(litellm_client, agent_id, previous, new_output)
+        )
+    output, start = agent_session.output_window()
+    return builder.build(output, start, get_context_token_budget())
+
+def publish_agent_state(agent_id, agent_data):
+    """Push an agent's status and latest decision to live dashboard listeners."""
+    publish('state', {
+        'agent_id': agent_id,
+        **{field: agent_data.get(field) for field in STATE_EVENT_FIELDS}
+    })
+
+def record_sent_action(agent_id, agent_data, action, reason):
+    """Save an action aider already received when the response it came from then failed."""
+    current_time = datetime.datetime.now().isoformat()
+    agent_data.setdefault('thought_history', []).append({
+        'timestamp': current_time,
+        'content': f"Sent {action} before the response failed: {reason}"
+    })
+    agent_data.update({'last_action': action, 'last_updated': current_time})
+    save_agents({agent_id: agent_data})
+    publish_agent_state(agent_id, agent_data)
+    if agent_id in prompt_processors:
+        prompt_processors[agent_id].record_action(agent_id, action)
+    if agent_id in aider_sessions:
+        aider_sessions[agent_id].output_buffer.write(f'\n\n [AGENT ACTION]: {action} \n\n')
+
+def apply_agent_decision(agent_id, agent_data, agent_session, follow_up_message, pr_manager, sent_action=None):
+    """Record an agent's decision and carry out its action; sent_action was already sent to aider."""
+    logging.info(f"Agent {agent_id} response: {follow_up_message}")
+    try:
+        follow_up_data = json.loads(follow_up_message)
+        if sent_action and (not isinstance(follow_up_data, dict) or 'error' in follow_up_data):
+            # The command already ran, so keep it on record instead of the error
+            reason = follow_up_data.get('error') if isinstance(follow_up_data, dict) else 'unexpected response'
+            record_sent_action(agent_id, agent_data, sent_action, reason)
+            return
+        current_time = datetime.datetime.now().isoformat()
+        agent_data.setdefault('progress_history', [])
+        agent_data.setdefault('thought_history', [])
+        if follow_up_data.get('progress'):
+            agent_data['progress'] = follow_up_data['progress']
+            agent_data['progress_history'].append({
+                'timestamp': current_time,
+                'content': follow_up_data['progress']
+            })
+        if follow_up_data.get('thought'):
+            agent_data['thought'] = follow_up_data['thought']
+            agent_data['thought_history'].append({
+                'timestamp': current_time,
+                'content': follow_up_data['thought']
+            })
+        agent_data.update({
+            'future': follow_up_data.get('future', ''),
+            'last_action': follow_up_data.get('action', ''),
+            'last_updated': current_time
+        })
+        save_agents({agent_id: agent_data})
+        publish_agent_state(agent_id, agent_data)
+    except json.JSONDecodeError:
+        logging.error(f"Invalid JSON in follow_up_message: {follow_up_message}")
+        if sent_action:
+            record_sent_action(agent_id, agent_data, sent_action, "invalid JSON")
+            return
+    if agent_id not in prompt_processors:
+        logging.error(f"No prompt processor found for agent {agent_id}")
+        return
+    processor = prompt_processors[agent_id]
+    action = processor.process_response(agent_id, follow_up_message)
+    if action is None and sent_action:
+        # An incomplete decision still has to show the command that ran
+        processor.record_action(agent_id, sent_action)
+        action = sent_action
+    if agent_id in aider_sessions:
+        action_message = f'\n\n [AGENT ACTION]: {action} \n\n'
+        aider_sessions[agent_id].output_buffer.write(action_message)
+    if action == "/finish":
+        pr_info = processor.get_agent_state(agent_id).get('pr_info')
+        if pr_info:
+            try:
+                branch_name = f"agent-{agent_id[:8]}"
+                with PR_CREATE_SECONDS.time():
+                    pr = pr_manager.create_pull_request(
+                            agent_id,
+                            branch_name,
+                            pr_info
+                        )
+                if pr:
+                    logging.info(f"Created PR: {pr.html_url}")
+                    agent_data['pr_url'] = pr.html_url
+                    agent_data['status'] = 'completed'
+                    agent_data['completed_at'] = datetime.datetime.now().isoformat()
+                    # Clean up the session
+                    if agent_id in aider_sessions:
+                        aider_sessions[agent_id].cleanup()
+                        del aider_sessions[agent_id]
+                    save_agents({agent_id: agent_data})
+                    publish('pr', {'agent_id': agent_id, 'pr_url': pr.html_url, 'status': 'completed'})
+                else:
+                    logging.error("Failed to create PR")
+            except Exception as e:
+                logging.error(f"Error creating PR: {e}")
+        else:
+            logging.error("No PR info found in agent state")
+    elif action:
+        if action == sent_action:
+            logging.debug(f"Action for {agent_id} was already sent while the response streamed")
+        elif agent_session.send_message(action, "instruct"):
+            logging.info(f"Sending action: {action} to {agent_id}")
+        else:
+            logging.error(f"Failed to send action to agent {agent_id}")
+    else:
+        logging.error(f"Failed to process response from OpenRouter")
+
+def process_agent_step(agent_id, agent_data, litellm_client, pr_manager, session_logs=None):
+    """Run one readiness check, LLM decision and action dispatch for an agent.
+
+    session_logs, when given, is context already built by a batch that found the agent ready.
+    """
+    agent_session = aider_sessions.get(agent_id)
+    ready_start = time.time_ns()
+    if not agent_session or (session_logs is None and not agent_session.is_ready()):
+        return
+    with tracer.trace('agent_step', start_ns=ready_start, agent_id=agent_id):
+        if session_logs is None:
+            tracer.record_span('is_ready', ready_start, time.time_ns())
+            session_logs = build_agent_context(agent_id, agent_session, litellm_client)
+        try:
+            #if session_logs is empty or only newlines. replace it with "*aider started*"
+            if not session_logs or session_logs.isspace():
+                session_logs = "*aider started*"
+            early_action = {}
+
+            def dispatch_early(name, value):
+                # Send the command as soon as the action field is complete, while the rest streams in
+                if name != 'action' or early_action:
+                    return
+                command = parse_action(value)
+                if command and command != '/finish' and agent_session.send_message(command, "instruct"):
+                    early_action['command'] = command
+                    logging.info(f"Sending action: {command} to {agent_id} before the response finished")
+
+            follow_up_message = litellm_client.stream_chat_completion(
+                PROMPT_AIDER(agent_session.task),
+                session_logs,
+                model_type="agent",
+                agent_id=agent_id,
+                on_field=dispatch_early
+            )
+            apply_agent_decision(agent_id, agent_data, agent_session, follow_up_message, pr_manager,
+                                 sent_action=early_action.get('command'))
+        except Exception as e:
+            logging.error(f"Error processing session summary for agent {agent_id}:", exc_info=True)
+            logging.error(f"Session logs length: {len(session_logs) if session_logs else 0}")
+            logging.error(f"Task description: {agent_session.task[:200]}...")
+
+def process_agent_batch(agents, litellm_client, pr_manager):
+    """Decide the next step for several agents with one request and apply each decision.
+
+    Agents missing from the batched response fall back to a request of their own.
+    """
+    batch_start = time.time_ns()
+    ready = []
+    for agent_id, agent_data in agents:
+        agent_session = aider_sessions.get(agent_id)
+        if not agent_session or not agent_session.is_ready():
+            continue
+        session_logs = build_agent_context(agent_id, agent_session, litellm_client)
+        if not session_logs or session_logs.isspace():
+            session_logs = "*aider started*"
+        ready.append((agent_id, agent_data, agent_session, session_logs))
+    if len(ready) == 1:
+        agent_id, agent_data, _, session_logs = ready[0]
+        process_agent_step(agent_id, agent_data, litellm_client, pr_manager, session_logs=session_logs)
+        return
+    if not ready:
+        return
+    agent_ids = [agent_id for agent_id, _, _, _ in ready]
+    with tracer.trace('agent_batch', start_ns=batch_start, agent_ids=agent_ids):
+        tracer.record_span('prepare', batch_start, time.time_ns())
+        user_message = "\n\n".join(
+            f"### Session {agent_id}\nGoal: {agent_session.task}\nLatest output:\n{session_logs}"
+            for agent_id, _, agent_session, session_logs in ready
+        )
+        response = litellm_client.chat_completion(
+            PROMPT_AIDER_BATCH(),
+            user_message,
+            model_type="agent",
+            agent_id="batch",
+            usage_agent_ids=agent_ids
+        )
+        try:
+            decisions = json.loads(response).get('decisions') or {}
+        except (json.JSONDecodeError, AttributeError):
+            logging.error(f"Invalid JSON in batched response: {response}")
+            decisions = {}
+        for agent_id, agent_data, agent_session, session_logs in ready:
+            decision = decisions.get(agent_id) if isinstance(decisions, dict) else None
+            if not isinstance(decision, dict):
+                # Decide on the output the batch saw rather than checking and summarizing again
+                logging.warning(f"No decision for agent {agent_id} in batched response, deciding separately")
+                process_agent_step(agent_id, agent_data, litellm_client, pr_manager, session_logs=session_logs)
+                continue
+            try:
+                with tracer.span('apply_decision', agent_id=agent_id):
+                    apply_agent_decision(agent_id, agent_data, agent_session, json.dumps(decision), pr_manager)
+            except Exception as e:
+                logging.error(f"Error applying batched decision for agent {agent_id}: {e}", exc_info=True)
+
+def run_sweep(scheduler, litellm_client, pr_manager, batch_size=DECISION_BATCH_SIZE):
+    """Refresh idle agents' output and schedule a step for each of them.
+
+    With batch_size above 1, idle agents are decided in groups of up to that many per request.
+    """
+    tasks_data = load_tasks()
+    refreshed = {}
+    idle_agents = []
+    for agent_id, agent_data in tasks_data['agents'].items():
+        # Skip processing if agent has completed PR
+        if agent_data.get('pr_url'):
+            continue
+        # Agents with a step in flight own their row until the step finishes
+        if agent_id not in aider_sessions or scheduler.is_busy(agent_id):
+            continue
+        agent_session = aider_sessions[agent_id]
+        cursor = agent_session.output_cursor()
+        if cursor != output_cursors.get(agent_id):
+            agent_data['aider_output'], agent_data['output_offset'] = agent_session.output_window()
+            agent_data['last_updated'] = datetime.datetime.now().isoformat()
+            refreshed[agent_id] = agent_data
+            output_cursors[agent_id] = cursor
+        idle_agents.append(agent_id)
+    # One transaction per sweep for all output refreshes
+    if refreshed:
+        save_agents(refreshed)
+    if batch_size > 1 and len(idle_agents) > 1:
+        for i in range(0, len(idle_agents), batch_size):
+            group = idle_agents[i:i + batch_size]
+            agents = [(agent_id, tasks_data['agents'][agent_id]) for agent_id in group]
+            scheduler.submit_group(group, process_agent_batch, agents, litellm_client, pr_manager)
+        return
+    for agent_id in idle_agents:
+        scheduler.submit(agent_id, process_agent_step, agent_id, tasks_data['agents'][agent_id], litellm_client, pr_manager)
+
 def main_loop():
-    pr_manager = PullRequestManager()
     """Main orchestration loop to manage agents."""
     logging.info("Starting main loop")
+    pr_manager = PullRequestManager()
     litellm_client = LiteLLMClient()  # Create LiteLLM client instance
+    scheduler = AgentScheduler(get_max_concurrent_agents())
     while True:
         try:
-            tasks_data = load_tasks()
-            for agent_id in list(tasks_data['agents'].keys()):
-                # Skip processing if agent has completed PR
-                if tasks_data['agents'][agent_id].get('pr_url'):
-                    continue
-                    
-                update_agent_output(agent_id)
-                if agent_id in aider_sessions:
-                    agent_session: AgentSession = aider_sessions[agent_id]
-                    if agent_session.is_ready():
-                        session_logs = agent_session.get_output()
-                        try:
-                            #if session_logs is empty or only newlines. replace it with "*aider started*"
-                            if not session_logs or session_logs.isspace():
-                                session_logs = "*aider started*"
-                            follow_up_message = litellm_client.chat_completion(
-                                PROMPT_AIDER(agent_session.task),
-                                session_logs,
-                                model_type="agent",
-                                agent_id=agent_id
-                            )
-                            logging.info(f"Agent {agent_id} response: {follow_up_message}")
-                            if agent_id in tasks_data['agents']:
-                                try:
-                                    follow_up_data = json.loads(follow_up_message)
-                                    current_time = datetime.datetime.now().isoformat()
-                                    if 'progress_history' not in tasks_data['agents'][agent_id]:
-                                        tasks_data['agents'][agent_id]['progress_history'] = []
-                                    if 'thought_history' not in tasks_data['agents'][agent_id]:
-                                        tasks_data['agents'][agent_id]['thought_history'] = []
-                                    if follow_up_data.get('progress'):
-                                        tasks_data['agents'][agent_id]['progress'] = follow_up_data['progress']
-                                        tasks_data['agents'][agent_id]['progress_history'].append({
-                                            'timestamp': current_time,
-                                            'content': follow_up_data['progress']
-                                        })
-                                    if follow_up_data.get('thought'):
-                                        tasks_data['agents'][agent_id]['thought'] = follow_up_data['thought']
-                                        tasks_data['agents'][agent_id]['thought_history'].append({
-                                            'timestamp': current_time,
-                                            'content': follow_up_data['thought']
-                                        })
-                                    tasks_data['agents'][agent_id].update({
-                                        'future': follow_up_data.get('future', ''),
-                                        'last_action': follow_up_data.get('action', ''),
-                                        'last_updated': current_time
-                                    })
-                                    save_tasks(tasks_data)
-                                except json.JSONDecodeError:
-                                    logging.error(f"Invalid JSON in follow_up_message: {follow_up_message}")
-                            if agent_id in prompt_processors:
-                                processor = prompt_processors[agent_id]
-                                action = processor.process_response(agent_id, follow_up_message)
-                                if agent_id in aider_sessions:
-                                    action_message = f'\n\n [AGENT ACTION]: {action} \n\n'
-                                    aider_sessions[agent_id].output_buffer.write(action_message)
-                                if action == "/finish":
-                                    pr_info = processor.get_agent_state(agent_id).get('pr_info')
-                                    if pr_info:
-                                        try:
-                                            branch_name = f"agent-{agent_id[:8]}"
-                                            pr = pr_manager.create_pull_request(
-                                                    agent_id,
-                                                    branch_name,
-                                                    pr_info
-                                                )
-                                            if pr:
-                                                logging.info(f"Created PR: {pr.html_url}")
-                                                tasks_data['agents'][agent_id]['pr_url'] = pr.html_url
-                                                tasks_data['agents'][agent_id]['status'] = 'completed'
-                                                tasks_data['agents'][agent_id]['completed_at'] = datetime.datetime.now().isoformat()
-                                                # Clean up the session
-                                                if agent_id in aider_sessions:
-                                                    aider_sessions[agent_id].cleanup()
-                                                    del aider_sessions[agent_id]
-                                                save_tasks(tasks_data)
-                                            else:
-                                                logging.error("Failed to create PR")
-                                        except Exception as e:
-                                            logging.error(f"Error creating PR: {e}")
-                                    else:
-                                        logging.error("No PR info found in agent state")
-                                elif action:
-                                    if agent_session.send_message(action, "instruct"):
-                                        logging.info(f"Sending action: {action} to {agent_id}")
-                                    else:
-                                        logging.error(f"Failed to send action to agent {agent_id}")
-                                else:
-                                    logging.error(f"Failed to process response from OpenRouter")
-                            else:
-                                logging.error(f"No prompt processor found for agent {agent_id}")
-                        except Exception as e:
-                            logging.error(f"Error processing session summary for agent {agent_id}:", exc_info=True)
-                            logging.error(f"Session logs length: {len(session_logs) if session_logs else 0}")
-                            logging.error(f"Task description: {agent_session.task[:200]}...")
+            scheduler.resize(get_max_concurrent_agents())
+            with SWEEP_SECONDS.time():
+                run_sweep(scheduler, litellm_client, pr_manager, batch_size=get_decision_batch_size())
             sleep(CHECK_INTERVAL)
         except Exception as e:
             logging.error(f"Error in main loop: {e}", exc_info=True)
@@ -0,0 +1,125 @@
+import logging
+import threading
+from collections import deque
+from pathlib import Path
+from typing import Callable, Optional, Tuple
+
+class OutputBuffer:
+    """Bounded line-indexed ring buffer for agent output with an optional on-disk transcript
+
+    Every character written gets an absolute offset. A cursor is such an offset, so
+    readers can call read_since(cursor) to fetch only what was written after their
+    last read. Once more than max_length characters are held the oldest lines are
+    dropped from memory; the transcript file keeps the full history.
+
+    If on_write is given it is called as on_write(text, start, end) after each
+    write, in offset order, while the buffer lock is held; it must not block.
+    """
+
+    def __init__(self, max_length: int = 10000, transcript_path: Optional[str] = None,
+                 on_write: Optional[Callable[[str, int, int], None]] = None):
+        self.max_length = max(1, int(max_length))
+        self.transcript_path = Path(transcript_path) if transcript_path else None
+        self._lines = deque()  # (offset, text) pairs, oldest first
+        self._length = 0
+        self._end = 0
+        self._transcript = None
+        self._on_write = on_write
+        self._lock = threading.Lock()
+
+    @property
+    def start(self) -> int:
+        """Offset of the oldest character still held in memory"""
+        with self._lock:
+            return self._end - self._length
+
+    def tell(self) -> int:
+        """Cursor pointing past the last character written"""
+        with self._lock:
+            return self._end
+
+    def write(self, text: str) -> int:
+        """Append text and return the number of characters written"""
+        if not text:
+            return 0
+        with self._lock:
+            start = self._end
+            for line in text.splitlines(keepends=True):
+                self._lines.append((self._end, line))
+                self._end += len(line)
+                self._length += len(line)
+            self._trim()
+            self._spill(text)
+            if self._on_write:
+                try:
+                    self._on_write(text, start, self._end)
+                except Exception as e:
+                    logging.error(f"Error in output listener: {e}")
+        return len(text)
+
+    def _trim(self) -> None:
+        while self._length > self.max_length:
+            offset, line = self._lines[0]
+            excess = self._length - self.max_length
+            if len(line) > excess:
+                # Keep the tail of a line that straddles the limit
+                self._lines[0] = (offset + excess, line[excess:])
+                self._length -= excess
+            else:
+                self._lines.popleft()
+                self._length -= len(line)
+
+    def _spill(self, text: str) -> None:
+        if not self.transcript_path:
+            return
+        try:
+            if self._transcript is None:
+                self.transcript_path.parent.mkdir(parents=True, exist_ok=True)
+                self._transcript = open(self.transcript_path, 'a', encoding='utf-8')
+            self._transcript.write(text)
+            self._transcript.flush()
+        except OSError as e:
+            logging.error(f"Error writing transcript {self.transcript_path}: {e}")
+            self.transcript_path = None
+
+    def read_since(self, cursor: int = 0) -> Tuple[str, int]:
+        """Return text written after cursor and the cursor to use next time
+
+        If the cursor points before the oldest retained line, reading starts at the
+        oldest retained character.
+        """
+        with self._lock:
+            if cursor >= self._end:
+                return '', self._end
+            parts = []
+            for offset, line in reversed(self._lines):
+                if offset + len(line) <= cursor:
+                    break
+                parts.append(line[max(0, cursor - offset):])
+            parts.reverse()
+            return ''.join(parts), self._end
+
+    def read_window(self) -> Tuple[str, int]:
+        """Everything held in memory together with the offset of its first character"""
+        with self._lock:
+            return ''.join(line for _, line in self._lines), self._end - self._length
+
+    def getvalue(self) -> str:
+        """Everything currently held in memory"""
+        return self.read_since(0)[0]
+
+    def read_transcript(self) -> str:
+        """Full output history from the transcript, or the in-memory window without one"""
+        if not self.transcript_path or not self.transcript_path.exists():
+            return self.getvalue()
+        with self._lock:
+            if self._transcript:
+                self._transcript.flush()
+        return self.transcript_path.read_text(encoding='utf-8')
+
+    def close(self) -> None:
+        """Close the transcript file"""
+        with self._lock:
+            if self._transcript:
+                self._transcript.close()
+                self._transcript = None
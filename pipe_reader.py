@@ -0,0 +1,190 @@
+import codecs
+import logging
+import os
+import selectors
+import sys
+import threading
+from typing import Callable, Dict, List, Optional
+
+READ_CHUNK = 65536  # Most bytes taken from one pipe per pass, so a chatty session cannot starve the rest
+MAX_LINE_LENGTH = 65536  # Longer unterminated output is handed on without waiting for the newline
+UNREGISTER_TIMEOUT = 5.0
+
+class LineSplitter:
+    """Decodes raw pipe output and splits it into lines with universal newlines
+
+    Text after the last newline is kept as the tail until its line completes.
+    Prompts such as aider's input("> ") never get a newline, so callers can
+    inspect the tail to notice them.
+    """
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self._pending = ''
+        self._held = ''
+
+    @property
+    def tail(self) -> str:
+        """Output of the current, unfinished line"""
+        return self._pending
+
+    def feed(self, data: bytes, final: bool = False) -> List[str]:
+        """Complete lines in data plus earlier output; with final, the tail is flushed as a line"""
+        text = self._pending + self._held + self._decoder.decode(data, final=final)
+        self._held = ''
+        # A trailing \r may be the first half of a \r\n split across reads
+        if text.endswith('\r') and not final:
+            text, self._held = text[:-1], '\r'
+        parts = text.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+        rest = parts.pop()
+        lines = [part + '\n' for part in parts]
+        if rest and (final or len(rest) >= MAX_LINE_LENGTH):
+            lines.append(rest)
+            rest = ''
+        self._pending = rest
+        return lines
+
+class _PipeEntry:
+    def __init__(self, pipe, on_line: Callable[[str], None], on_tail: Optional[Callable[[str], None]]):
+        self.pipe = pipe
+        self.fd = pipe.fileno()
+        self.on_line = on_line
+        self.on_tail = on_tail
+        self.splitter = LineSplitter()
+
+class PipeReader:
+    """One thread that reads every registered subprocess pipe through a selector
+
+    Output is decoded, split into lines with universal newlines, and passed to
+    each pipe's on_line callback on the reader thread; on_tail, if given, sees
+    the unfinished last line after every read. Each readable pipe gets
+    one read of at most READ_CHUNK bytes per pass. A session producing output
+    faster than it is handled leaves the rest in its own OS pipe, which blocks
+    that aider process without delaying the others.
+    """
+
+    def __init__(self):
+        self._selector = selectors.DefaultSelector()
+        self._entries: Dict[int, _PipeEntry] = {}
+        self._changes = []
+        self._lock = threading.Lock()
+        self._wake_read, self._wake_write = os.pipe()
+        os.set_blocking(self._wake_read, False)
+        os.set_blocking(self._wake_write, False)
+        self._selector.register(self._wake_read, selectors.EVENT_READ)
+        self._thread = threading.Thread(target=self._run, daemon=True, name='aider-pipe-reader')
+        self._thread.start()
+
+    @staticmethod
+    def supported() -> bool:
+        """Whether pipes can be selected on this platform; Windows only selects sockets"""
+        return sys.platform != 'win32'
+
+    def register(self, pipe, on_line: Callable[[str], None],
+                 on_tail: Optional[Callable[[str], None]] = None) -> bool:
+        """Start delivering the pipe's lines to on_line; False if the pipe cannot be selected"""
+        try:
+            entry = _PipeEntry(pipe, on_line, on_tail)
+            if not isinstance(entry.fd, int):
+                return False
+            os.set_blocking(entry.fd, False)
+        except (AttributeError, OSError, ValueError, TypeError):
+            return False
+        self._change(('register', entry, None))
+        return True
+
+    def unregister(self, pipe) -> None:
+        """Stop reading the pipe, waiting until the reader thread has let go of it"""
+        try:
+            fd = pipe.fileno()
+        except (AttributeError, OSError, ValueError):
+            return
+        done = threading.Event()
+        self._change(('unregister', fd, done))
+        if threading.current_thread() is not self._thread:
+            done.wait(UNREGISTER_TIMEOUT)
+
+    def pipe_count(self) -> int:
+        return len(self._entries)
+
+    def _change(self, change) -> None:
+        with self._lock:
+            self._changes.append(change)
+        try:
+            os.write(self._wake_write, b'\0')
+        except BlockingIOError:
+            pass  # A wakeup is already pending
+
+    def _apply_changes(self) -> None:
+        with self._lock:
+            changes, self._changes = self._changes, []
+        for action, target, done in changes:
+            if action == 'register':
+                # The descriptor may have been reused after a pipe was closed without unregistering
+                self._remove(target.fd)
+                self._entries[target.fd] = target
+                self._selector.register(target.fd, selectors.EVENT_READ, target)
+            else:
+                self._remove(target)
+                done.set()
+
+    def _remove(self, fd: int) -> None:
+        entry = self._entries.pop(fd, None)
+        if entry is not None:
+            try:
+                self._selector.unregister(fd)
+            except (KeyError, ValueError):
+                pass
+
+    def _run(self) -> None:
+        while True:
+            try:
+                for key, _ in self._selector.select():
+                    if key.fileobj == self._wake_read:
+                        try:
+                            while os.read(self._wake_read, 4096):
+                                pass
+                        except BlockingIOError:
+                            pass
+                        continue
+                    self._read(key.data)
+                self._apply_changes()
+            except Exception as e:
+                logging.error(f"Error in pipe reader: {e}", exc_info=True)
+
+    def _read(self, entry: _PipeEntry) -> None:
+        # The descriptor may already belong to a newer pipe
+        if self._entries.get(entry.fd) is not entry:
+            return
+        try:
+            data = os.read(entry.fd, READ_CHUNK)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+        # Empty data is end of file: hand on whatever is left and stop watching the pipe
+        for line in entry.splitter.feed(data, final=not data):
+            try:
+                entry.on_line(line)
+            except Exception as e:
+                logging.error(f"Error handling output line: {e}", exc_info=True)
+        if not data:
+            self._remove(entry.fd)
+        elif entry.on_tail and entry.splitter.tail:
+            try:
+                entry.on_tail(entry.splitter.tail)
+            except Exception as e:
+                logging.error(f"Error handling partial output: {e}", exc_info=True)
+
+_pipe_reader: Optional[PipeReader] = None
+_pipe_reader_lock = threading.Lock()
+
+def get_pipe_reader() -> Optional[PipeReader]:
+    """The process-wide pipe reader, started on first use; None where pipes cannot be selected"""
+    global _pipe_reader
+    if not PipeReader.supported():
+        return None
+    with _pipe_reader_lock:
+        if _pipe_reader is None:
+            _pipe_reader = PipeReader()
+        return _pipe_reader
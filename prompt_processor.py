@@ -3,10 +3,23 @@ import logging
 from typing import Dict, List, Optional
 from dataclasses import dataclass, field
 from datetime import datetime
+from tracing import traced
 
 # Configure logger for this module
 logger = logging.getLogger(__name__)
 
+ALLOWED_COMMANDS = ['/instruct', '/ls', '/git', '/add', '/finish', '/run', '/map', '/test']
+
+def parse_action(action: str) -> Optional[str]:
+    """Validate an action and return the command to send to aider, or None if it is not allowed"""
+    action = (action or '').strip()
+    if not any(action.startswith(cmd) for cmd in ALLOWED_COMMANDS):
+        return None
+    if action.startswith('/instruct '):
+        # Return just the instruction without the command
+        return action[10:].strip()
+    return action
+
 @dataclass
 class AgentResponse:
     """Store individual agent responses"""
@@ -23,6 +36,7 @@ class PromptProcessor:
         self.agent_states: Dict[str, Dict] = {}
         self.response_history: Dict[str, List[AgentResponse]] = {}
         
+    @traced('process_response')
     def process_response(self, agent_id: str, response: str) -> Optional[str]:
         """Process a JSON response and return the action to execute"""
         try:
@@ -37,8 +51,7 @@ class PromptProcessor:
             
             # Validate action is an allowed command
             action = data['action'].strip()
-            allowed_commands = ['/instruct', '/ls', '/git', '/add', '/finish', '/run', '/map', '/test']
-            if not any(action.startswith(cmd) for cmd in allowed_commands):
+            if parse_action(action) is None:
                 logger.error(f"Invalid command in action: {action}")
                 return None
             
@@ -86,12 +99,8 @@ class PromptProcessor:
                     self.agent_states[agent_id]['pr_info'] = pr_data
                     self.agent_states[agent_id]['status'] = 'creating_pr'
                 return action
-                
-            elif action.startswith('/instruct '):
-                # Return just the instruction without the command
-                return action[10:].strip()
             else:
-                return action
+                return parse_action(action)
                 
         except json.JSONDecodeError:
             logger.error(f"Invalid JSON response: {response}")
@@ -100,6 +109,20 @@ class PromptProcessor:
             logger.error(f"Error processing response: {e}")
             return None
             
+    def record_action(self, agent_id: str, action: str) -> None:
+        """Note an action that was sent without a complete response to go with it"""
+        state = self.agent_states.setdefault(agent_id, self.get_agent_state(agent_id))
+        state['last_action'] = action
+        history = self.response_history.setdefault(agent_id, [])
+        history.append(AgentResponse(
+            progress=state['progress'],
+            thought=state['thought'],
+            action=action,
+            future=state['future']
+        ))
+        if len(history) > 100:
+            history.pop(0)
+
     def get_agent_state(self, agent_id: str) -> Dict:
         """Get the current state for an agent"""
         return self.agent_states.get(agent_id, {
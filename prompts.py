@@ -1,17 +1,11 @@
-#TODO: do not hardcode powershell, the LLM should be able to determine which Terminal is being used
-def PROMPT_AIDER(task_description: str) -> str:
-    from database import get_model_config
-    config = get_model_config()
-    suffix = config.get('aider_prompt_suffix', '') if config else ''
-    
-    # Ensure suffix has proper formatting
-    suffix = suffix.strip() if suffix else ''
-    if suffix and not suffix.startswith('\n'):
-        suffix = '\n' + suffix
-    if suffix and not suffix.endswith('\n'):
-        suffix += '\n'
-    
-    return f"""You are an expert software developer manager.
+import threading
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
+from context_builder import estimate_tokens
+
+# Everything before the goal is identical for every agent and task, so providers
+# that cache prompt prefixes can reuse it across calls
+AIDER_STATIC_PROMPT = """You are an expert software developer manager.
 You are talking to Aider, an AI programming assistant.
 Do not write code. 
 Only give instructions and commands.
@@ -22,17 +16,60 @@ For your own context run /map first to get a sense of the project.
 It is recommended to do some analysis with /ls , /map and /run other commands first before starting to instruct code changes.
 Commits are done automatically by aider so you DO NOT need to run git commit commands. 
 The response should be in this JSON schema:
-{{
+{
     "progress": "one sentence update on progress so far",
     "thought": "one sentence rationale",
     "action":  "/instruct <message>" | "/ls" | "/git <git command>" | "/add <file>" | "/finish" | "/run <shell_command>" | "/map",
     "future": "one sentence prediction",
-}}
-The overall goal is: {task_description}
+}
+"""
+
+def _format_suffix(suffix: Optional[str]) -> str:
+    # Ensure suffix has proper formatting
+    suffix = suffix.strip() if suffix else ''
+    if suffix and not suffix.startswith('\n'):
+        suffix = '\n' + suffix
+    if suffix and not suffix.endswith('\n'):
+        suffix += '\n'
+    return suffix
+
+@lru_cache(maxsize=256)
+def _compile_aider_prompt(task_description: str, suffix: str) -> str:
+    return f"""{AIDER_STATIC_PROMPT}The overall goal is: {task_description}
+
+{_format_suffix(suffix)}
+"""
+
+#TODO: do not hardcode powershell, the LLM should be able to determine which Terminal is being used
+def PROMPT_AIDER(task_description: str) -> str:
+    from database import get_model_config
+    config = get_model_config()
+    suffix = config.get('aider_prompt_suffix', '') if config else ''
+    return _compile_aider_prompt(task_description, suffix or '')
+
+AIDER_BATCH_INSTRUCTIONS = """You are managing several Aider sessions at once, each working on its own goal.
+Each session is given below with its id, goal and latest output.
+Decide the next step for every session independently, using the schema above for each decision.
+The response should be in this JSON schema:
+{
+    "decisions": {
+        "<session id>": {"progress": "...", "thought": "...", "action": "...", "future": "..."}
+    }
+}
+"""
 
-{suffix}
+@lru_cache(maxsize=16)
+def _compile_aider_batch_prompt(suffix: str) -> str:
+    return f"""{AIDER_STATIC_PROMPT}{AIDER_BATCH_INSTRUCTIONS}
+{_format_suffix(suffix)}
 """
 
+def PROMPT_AIDER_BATCH() -> str:
+    from database import get_model_config
+    config = get_model_config()
+    suffix = config.get('aider_prompt_suffix', '') if config else ''
+    return _compile_aider_batch_prompt(suffix or '')
+
 def PROMPT_PR() -> str:
     return """Generate a pull request description based on the changes made.
 The response should be in this JSON schema:
@@ -43,3 +80,63 @@ The response should be in this JSON schema:
     "reviewers": ["list", "of", "suggested", "reviewers"]
 }
 """
+
+def PROMPT_SUMMARY() -> str:
+    return """You maintain a running summary of a terminal session between a manager and Aider, an AI programming assistant.
+You are given the previous summary and the output that followed it.
+Update the summary so it covers both: commands run, files touched, decisions made, errors seen and what is still unresolved.
+Keep it under 300 words and drop details that no longer matter.
+The response should be in this JSON schema:
+{
+    "summary": "the updated summary"
+}
+"""
+
+class PromptRegistry:
+    """Static system prompt prefixes and their token counts
+
+    A prompt whose static prefix is registered can be split so the prefix is
+    sent as its own cacheable block (see PromptRegistry.split).
+    """
+
+    def __init__(self):
+        self._static = {}  # name -> static prefix
+        self._lock = threading.Lock()
+
+    def register(self, name: str, static_prefix: str) -> None:
+        with self._lock:
+            self._static[name] = static_prefix
+
+    def name_of(self, prompt: str) -> Optional[str]:
+        """Name of the longest registered static prefix the prompt starts with, if any"""
+        with self._lock:
+            matches = [(len(prefix), name) for name, prefix in self._static.items()
+                       if prefix and prompt.startswith(prefix)]
+        return max(matches)[1] if matches else None
+
+    def split(self, prompt: str) -> Tuple[str, str]:
+        """(static prefix, dynamic rest) of a prompt; the prefix is empty if none matches"""
+        with self._lock:
+            prefixes = list(self._static.values())
+        matches = [prefix for prefix in prefixes if prefix and prompt.startswith(prefix)]
+        if not matches:
+            return '', prompt
+        prefix = max(matches, key=len)
+        return prefix, prompt[len(prefix):]
+
+    def token_counts(self) -> Dict[str, int]:
+        """Estimated tokens of each registered static prefix"""
+        with self._lock:
+            return {name: estimate_tokens(prefix) for name, prefix in self._static.items()}
+
+    @staticmethod
+    def cache_info() -> Dict[str, int]:
+        """Hit and miss counts of the compiled aider prompt cache"""
+        info = _compile_aider_prompt.cache_info()
+        return {'hits': info.hits, 'misses': info.misses, 'entries': info.currsize}
+
+prompt_registry = PromptRegistry()
+prompt_registry.register('aider', AIDER_STATIC_PROMPT)
+prompt_registry.register('aider_batch', AIDER_STATIC_PROMPT + AIDER_BATCH_INSTRUCTIONS)
+prompt_registry.register('pr', PROMPT_PR())
+prompt_registry.register('summary', PROMPT_SUMMARY())
@@ -0,0 +1,97 @@
+import copy
+import logging
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+from events import publish
+
+MAX_PROVISIONING_WORKERS = 4  # Agents cloned and started at once
+MAX_TRACKED_JOBS = 100  # Finished jobs kept for status queries
+
+class ProvisioningPool:
+    """Provisions agents in the background with bounded concurrency and per-agent status
+
+    A job is one create request. Each of its agents moves through
+    pending -> provisioning -> ready | failed, and the job is done once none are
+    pending or provisioning.
+    """
+
+    def __init__(self, max_workers: int = MAX_PROVISIONING_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="agent-provision")
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+
+    def submit(self, provision_fn: Callable[..., Optional[str]], agents: List[Dict]) -> Dict:
+        """Queue provision_fn(**spec) for each agent spec and return the new job
+
+        Each spec must carry the agent_id and task_description to provision;
+        provision_fn returns the agent ID on success and None on failure.
+        """
+        job_id = str(uuid.uuid4())
+        job = {
+            'id': job_id,
+            'agents': [
+                {'agent_id': spec['agent_id'], 'task': spec['task_description'], 'status': 'pending', 'error': None}
+                for spec in agents
+            ]
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+            while len(self._jobs) > MAX_TRACKED_JOBS:
+                self._jobs.popitem(last=False)
+            snapshot = self._snapshot(job)
+        for index, spec in enumerate(agents):
+            self._executor.submit(self._provision, job_id, index, provision_fn, spec)
+        return snapshot
+
+    def _provision(self, job_id: str, index: int, provision_fn: Callable, spec: Dict) -> None:
+        self._update(job_id, index, 'provisioning')
+        try:
+            if provision_fn(**spec):
+                self._update(job_id, index, 'ready')
+            else:
+                self._update(job_id, index, 'failed', 'Provisioning failed')
+        except Exception as e:
+            logging.error(f"Error provisioning agent {spec['agent_id']}: {e}", exc_info=True)
+            self._update(job_id, index, 'failed', str(e))
+
+    def _update(self, job_id: str, index: int, status: str, error: Optional[str] = None) -> None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if not job:
+                return
+            agent = job['agents'][index]
+            agent['status'] = status
+            agent['error'] = error
+            event = {'job_id': job_id, **agent}
+            self._changed.notify_all()
+        publish('provisioning', event)
+
+    def _snapshot(self, job: Dict) -> Dict:
+        snapshot = copy.deepcopy(job)
+        statuses = [agent['status'] for agent in snapshot['agents']]
+        snapshot['done'] = all(status in ('ready', 'failed') for status in statuses)
+        snapshot['ready'] = statuses.count('ready')
+        snapshot['failed'] = statuses.count('failed')
+        return snapshot
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """Current status of a job, or None if it is unknown"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return self._snapshot(job) if job else None
+
+    def wait(self, job_id: str, timeout: Optional[float] = None) -> bool:
+        """Block until a job is done; returns False on timeout"""
+        def done():
+            job = self._jobs.get(job_id)
+            return job is None or self._snapshot(job)['done']
+        with self._changed:
+            return self._changed.wait_for(done, timeout)
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stop accepting jobs and release the worker threads"""
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,100 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, Iterator, Optional
+
+RECORD_ENV = 'ORCHESTRATOR_RECORD'  # Path of the recording file; recording is off when unset
+
+class SessionRecorder:
+    """Appends agent sessions to a JSONL file for later replay
+
+    Each line is one event with a wall-clock timestamp: aider output, an LLM
+    request with its response and latency, or an action sent to aider. System
+    prompts are written once and then referred to by hash, which keeps the file
+    small since every decision request shares one.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'a', encoding='utf-8')
+        self._prompts = set()
+        self._lock = threading.Lock()
+
+    def _write(self, event: Dict) -> None:
+        line = json.dumps(event, separators=(',', ':'), ensure_ascii=False)
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(line + '\n')
+            self._file.flush()
+
+    def record(self, kind: str, agent_id, **fields) -> None:
+        """Append an event of the given kind for an agent"""
+        try:
+            agent = None if agent_id is None else str(agent_id)
+            self._write({'t': round(time.time(), 3), 'kind': kind, 'agent': agent, **fields})
+        except Exception as e:
+            logging.error(f"Error writing recording to {self.path}: {e}")
+
+    def record_output(self, agent_id, text: str) -> None:
+        self.record('output', agent_id, text=text)
+
+    def record_action(self, agent_id, command: str) -> None:
+        self.record('action', agent_id, command=command)
+
+    def record_llm(self, agent_id, model_type: str, model: str, system_message: str, user_message: str,
+                   response: str, latency_ms: int) -> None:
+        prompt_id = hashlib.sha1(system_message.encode('utf-8')).hexdigest()[:12]
+        with self._lock:
+            new_prompt = prompt_id not in self._prompts
+            self._prompts.add(prompt_id)
+        if new_prompt:
+            self.record('prompt', agent_id, id=prompt_id, text=system_message)
+        self.record('llm', agent_id, model_type=model_type, model=model, system=prompt_id,
+                    user=user_message, response=response, latency_ms=latency_ms)
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+_recorder: Optional[SessionRecorder] = None
+_recorder_lock = threading.Lock()
+
+def get_recorder() -> Optional[SessionRecorder]:
+    """The process-wide recorder when ORCHESTRATOR_RECORD is set, otherwise None"""
+    global _recorder
+    path = os.getenv(RECORD_ENV)
+    if not path:
+        return None
+    with _recorder_lock:
+        if _recorder is None or _recorder.path != path:
+            try:
+                _recorder = SessionRecorder(path)
+                logging.info(f"Recording agent sessions to {path}")
+            except OSError as e:
+                logging.error(f"Could not open recording {path}: {e}")
+                return None
+        return _recorder
+
+def read_recording(path: str) -> Iterator[Dict]:
+    """Events from a recording in file order, with system prompts resolved to their text"""
+    prompts = {}
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                event = json.loads(line)
+            except json.JSONDecodeError:
+                # A crash can leave the last line half written
+                logging.warning(f"Skipping malformed line in {path}")
+                continue
+            if event.get('kind') == 'prompt':
+                prompts[event['id']] = event['text']
+                continue
+            if event.get('kind') == 'llm':
+                event['system'] = prompts.get(event['system'], '')
+            yield event
@@ -0,0 +1,78 @@
+import hashlib
+import logging
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+from git_ops import GitError, clone, run_git
+
+MIRROR_ROOT = Path(tempfile.gettempdir()) / "agent_repo_mirrors"
+MIRROR_FRESH_SECONDS = 60  # Skip re-fetching a mirror fetched this recently
+
+_locks = {}
+_locks_lock = threading.Lock()
+_last_fetch = {}
+
+def _lock_for(repository_url: str) -> threading.Lock:
+    with _locks_lock:
+        return _locks.setdefault(repository_url, threading.Lock())
+
+def mirror_path(repository_url: str) -> Path:
+    """Location of the bare mirror cached for a repository URL"""
+    name = repository_url.rstrip('/').split('/')[-1]
+    if name.endswith('.git'):
+        name = name[:-4]
+    digest = hashlib.sha1(repository_url.encode('utf-8')).hexdigest()[:12]
+    return MIRROR_ROOT / f"{name}-{digest}.git"
+
+def ensure_mirror(repository_url: str) -> Optional[Path]:
+    """Create or incrementally update the bare mirror for a repository
+
+    Returns the mirror path, or None if it could not be created or updated.
+    """
+    path = mirror_path(repository_url)
+    with _lock_for(repository_url):
+        try:
+            if (path / 'HEAD').exists():
+                if time.monotonic() - _last_fetch.get(repository_url, float('-inf')) < MIRROR_FRESH_SECONDS:
+                    return path
+                result = run_git(['--git-dir', str(path), 'fetch', '--prune', '--quiet', 'origin'], check=False)
+                if result.returncode != 0:
+                    logging.error(f"Mirror fetch failed for {repository_url}: {result.stderr}")
+                    return None
+            else:
+                MIRROR_ROOT.mkdir(parents=True, exist_ok=True)
+                staging = Path(tempfile.mkdtemp(prefix=path.name, dir=MIRROR_ROOT))
+                result = run_git(['clone', '--mirror', '--quiet', repository_url, str(staging)], check=False)
+                if result.returncode != 0:
+                    logging.error(f"Mirror clone failed for {repository_url}: {result.stderr}")
+                    shutil.rmtree(staging, ignore_errors=True)
+                    return None
+                shutil.rmtree(path, ignore_errors=True)
+                staging.rename(path)
+            _last_fetch[repository_url] = time.monotonic()
+            return path
+        except Exception as e:
+            logging.error(f"Error updating mirror for {repository_url}: {e}", exc_info=True)
+            return None
+
+def clone_from_mirror(repository_url: str, destination: str, cwd=None) -> bool:
+    """Clone a repository into destination from its local mirror
+
+    A local clone hardlinks or copies the mirror's objects instead of borrowing
+    them through alternates, so workspaces keep working if the mirror under the
+    temp directory is cleaned up. The clone's origin points at repository_url,
+    so pushes go to the real remote.
+    """
+    mirror = ensure_mirror(repository_url)
+    if not mirror:
+        return False
+    try:
+        clone(str(mirror), destination, cwd=cwd)
+        run_git(['remote', 'set-url', 'origin', repository_url], cwd=Path(cwd or '.') / destination)
+        return True
+    except GitError as e:
+        logging.error(f"Clone from mirror failed: {e}")
+        return False
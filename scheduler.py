@@ -0,0 +1,78 @@
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional
+
+class AgentScheduler:
+    """Runs agent steps on a bounded worker pool with at most one step in flight per agent"""
+
+    def __init__(self, max_workers: int = 8):
+        self.max_workers = max(1, int(max_workers))
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="agent-step")
+        self._in_flight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, agent_id: str, fn: Callable, *args, **kwargs) -> bool:
+        """Schedule fn for an agent; returns False if that agent already has a step running"""
+        with self._lock:
+            if agent_id in self._in_flight:
+                return False
+            future = self._executor.submit(fn, *args, **kwargs)
+            self._in_flight[agent_id] = future
+        future.add_done_callback(lambda f, agent_id=agent_id: self._finish(agent_id, f))
+        return True
+
+    def submit_group(self, agent_ids: List[str], fn: Callable, *args, **kwargs) -> bool:
+        """Schedule one fn call covering several agents, all of which stay busy until it finishes
+
+        Returns False without scheduling anything if any of the agents already has a step running.
+        """
+        with self._lock:
+            if any(agent_id in self._in_flight for agent_id in agent_ids):
+                return False
+            future = self._executor.submit(fn, *args, **kwargs)
+            for agent_id in agent_ids:
+                self._in_flight[agent_id] = future
+        for agent_id in agent_ids:
+            future.add_done_callback(lambda f, agent_id=agent_id: self._finish(agent_id, f))
+        return True
+
+    def _finish(self, agent_id: str, future: Future) -> None:
+        with self._lock:
+            if self._in_flight.get(agent_id) is future:
+                del self._in_flight[agent_id]
+        if not future.cancelled() and future.exception():
+            logging.error(f"Agent step failed for {agent_id}", exc_info=future.exception())
+
+    def is_busy(self, agent_id: str) -> bool:
+        """Check whether an agent has a step queued or running"""
+        with self._lock:
+            return agent_id in self._in_flight
+
+    def in_flight_count(self) -> int:
+        """Number of agent steps queued or running"""
+        with self._lock:
+            return len(self._in_flight)
+
+    def resize(self, max_workers: int) -> None:
+        """Change the concurrency limit; running steps finish on the old pool"""
+        max_workers = max(1, int(max_workers))
+        if max_workers == self.max_workers:
+            return
+        with self._lock:
+            old_executor = self._executor
+            self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="agent-step")
+            self.max_workers = max_workers
+        old_executor.shutdown(wait=False)
+        logging.info(f"Agent scheduler resized to {max_workers} workers")
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Block until all in-flight steps finish; returns False on timeout"""
+        with self._lock:
+            futures = list(self._in_flight.values())
+        _, not_done = wait(futures, timeout=timeout)
+        return not not_done
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stop accepting work and release the worker threads"""
+        self._executor.shutdown(wait=wait)
@@ -1,174 +1,135 @@
 // Global variables and state management
-const lastOutputLengths = {};
+const outputEnds = {};
+let stateVersion = null;
 let updateInterval;
+const FALLBACK_POLL_INTERVAL = 5000;
+const EVENTS_POLL_INTERVAL = 30000;
 
-// Helper function to get output length from debug info
-function getOutputLength(debugElement) {
-    const lengthElement = debugElement.querySelector('.label');
-    if (lengthElement && lengthElement.textContent.includes('Output Length')) {
-        const lengthText = lengthElement.parentElement.textContent;
-        return parseInt(lengthText.split(':')[1].trim());
+// Build the query for a delta poll: changed agents since our version, output past our offsets
+function buildUpdateUrl() {
+    const params = new URLSearchParams();
+    if (stateVersion !== null) {
+        params.set('since', stateVersion);
     }
-    return 0;
+    const offsets = Object.entries(outputEnds).map(([agentId, end]) => `${agentId}:${end}`);
+    if (offsets.length) {
+        params.set('offsets', offsets.join(','));
+    }
+    const query = params.toString();
+    return query ? `/tasks/tasks.json?${query}` : '/tasks/tasks.json';
 }
 
-// Function to fetch updates via AJAX
-async function fetchUpdates() {
-    try {
-        const response = await fetch('/tasks/tasks.json');
-        const responseClone = response.clone(); // Clone the response
-        const tasksData = await response.json();
-        // Update each agent's output
-        for (const [agentId, agentData] of Object.entries(tasksData.agents)) {
-            const agentCard = document.getElementById(`agent-${agentId}`);
-            if (!agentCard) continue;
+// Flash the output box to indicate new content
+function flashOutput(outputElement) {
+    outputElement.style.transition = 'background-color 0.5s';
+    outputElement.style.backgroundColor = '#2e4052';
+    setTimeout(() => {
+        outputElement.style.backgroundColor = '#1e1e1e';
+    }, 500);
+}
 
-            // Find agent state container
-            const agentState = agentCard.querySelector('.agent-state');
-            if (agentState) {
-                // Update all fields using data attributes
-                const fields = {
-                    'thought': agentData.thought || '',
-                    'progress': agentData.progress || '',
-                    'future': agentData.future || '',
-                    'action': agentData.last_action || ''
-                };
+// Apply full or appended output for an agent
+function updateOutput(agentId, agentData, outputElement) {
+    const hasAppend = 'aider_output_append' in agentData;
+    const html = hasAppend ? agentData.aider_output_append : agentData.aider_output;
+    if (!html) {
+        return;
+    }
+    let container = outputElement.querySelector('.output-container');
+    if (!container) {
+        outputElement.querySelectorAll('.text-muted').forEach(el => el.remove());
+        container = document.createElement('div');
+        container.className = 'output-container';
+        outputElement.appendChild(container);
+    }
+    if (hasAppend) {
+        container.insertAdjacentHTML('beforeend', html);
+    } else {
+        container.innerHTML = html;
+    }
+    outputEnds[agentId] = agentData.output_end;
+    outputElement.scrollTop = outputElement.scrollHeight;
+    flashOutput(outputElement);
+}
 
-                // Update each field
-                Object.entries(fields).forEach(([field, value]) => {
-                    // Update all elements with this data-field, both in agent state and footer
-                    const elements = agentCard.querySelectorAll(`[data-field="${field}"]`);
-                    elements.forEach(element => {
-                        element.innerHTML = value || (field === 'thought' ? 'Thinking...' : 'Planning...');
-                    });
-                
-                    // Also update header progress if this is the progress field
-                    if (field === 'task') {
-                        const headerProgress = agentCard.querySelector('[data-field="header-task"]');
-                        if (headerProgress) {
-                            headerProgress.innerHTML = value;
-                        }
-                    }
-                });
+// Apply an agent's changed fields to its card
+function applyAgentUpdate(agentId, agentData, agentCard) {
+    // Find agent state container
+    const agentState = agentCard.querySelector('.agent-state');
+    if (agentState && 'thought' in agentData) {
+        // Update all fields using data attributes
+        const fields = {
+            'thought': agentData.thought || '',
+            'progress': agentData.progress || '',
+            'future': agentData.future || '',
+            'action': agentData.last_action || ''
+        };
 
-                // Toggle visibility based on thought
-                agentState.style.display = agentData.thought ? 'block' : 'none';
-            }
+        // Update each field
+        Object.entries(fields).forEach(([field, value]) => {
+            // Update all elements with this data-field, both in agent state and footer
+            const elements = agentCard.querySelectorAll(`[data-field="${field}"]`);
+            elements.forEach(element => {
+                element.innerHTML = value || (field === 'thought' ? 'Thinking...' : 'Planning...');
+            });
+        });
 
-            // Update CLI output if it has changed
-            const outputElement = agentCard.querySelector('.cli-output');
+        // Toggle visibility based on thought
+        agentState.style.display = agentData.thought ? 'block' : 'none';
+    }
 
-            if (outputElement && agentData.aider_output) {
-                const currentText = outputElement.textContent || '';
-                
-                // Only update if output has changed
-                if (agentData.aider_output !== currentText) {
-                    outputElement.innerHTML = agentData.aider_output;
-                    outputElement.scrollTop = outputElement.scrollHeight;
-                    
-                    // Flash effect for new content
-                    outputElement.style.transition = 'background-color 0.5s';
-                    outputElement.style.backgroundColor = '#2e4052';
-                    setTimeout(() => {
-                        outputElement.style.backgroundColor = '#1e1e1e';
-                    }, 500);
-                }
-            }
+    // Update CLI output with the delta
+    const outputElement = agentCard.querySelector('.cli-output');
+    if (outputElement) {
+        updateOutput(agentId, agentData, outputElement);
+    }
 
-            // Update status and timestamps
-            const statusBadge = agentCard.querySelector('.badge');
-            if (statusBadge && agentData.status) {
-                statusBadge.textContent = agentData.status;
-                statusBadge.className = `badge ${agentData.status === 'in_progress' ? 'bg-primary' : 
-                                    agentData.status === 'pending' ? 'bg-warning' : 'bg-success'}`;
-            }
+    // Update status and timestamps
+    const statusBadge = agentCard.querySelector('.badge');
+    if (statusBadge && agentData.status) {
+        statusBadge.textContent = agentData.status;
+        statusBadge.className = `badge ${agentData.status === 'in_progress' ? 'bg-primary' : 
+                            agentData.status === 'pending' ? 'bg-warning' : 'bg-success'}`;
+    }
 
-            // Update PR info if it exists
-            const prInfoSection = agentCard.querySelector('#pr-info-' + agentId);
-            if (prInfoSection && agentData.pr_url) {
-                prInfoSection.style.display = 'block';
-                const prLink = prInfoSection.querySelector('a.alert-link');
-                if (prLink) {
-                    prLink.href = agentData.pr_url;
-                    prLink.textContent = 'View on GitHub';
-                }
-            }
+    // Update PR info if it exists
+    const prInfoSection = agentCard.querySelector('#pr-info-' + agentId);
+    if (prInfoSection && agentData.pr_url) {
+        prInfoSection.style.display = 'block';
+        const prLink = prInfoSection.querySelector('a.alert-link');
+        if (prLink) {
+            prLink.href = agentData.pr_url;
+            prLink.textContent = 'View on GitHub';
+        }
+    }
+}
 
+// Function to fetch updates via AJAX
+async function fetchUpdates() {
+    try {
+        const headers = stateVersion !== null ? {'If-None-Match': `"${stateVersion}"`} : {};
+        const response = await fetch(buildUpdateUrl(), {headers});
+        if (response.status === 304) {
+            return;
         }
-        
-        // Create temporary div to parse HTML
-        const tempDiv = document.createElement('div');
-        tempDiv.innerHTML = await responseClone.text(); // Use cloned response
-        
-        // Update each agent's output
-        const agents = document.querySelectorAll('.agent-card');
-        for (let i = 0; i < agents.length; i++) {
-            const agent = agents[i];
-            const agentId = agent.id.replace('agent-', '');
-            if (agentId === "{{ agent_id }}")
-                continue;
-            const newAgentCard = tempDiv.querySelector(`#agent-${agentId}`);
-            
-            if (newAgentCard) {
-                // Update CLI output if it has changed
-                const currentOutput = agent.querySelector('.cli-output');
-                const newOutput = newAgentCard.querySelector('.cli-output');
-                
-                if (currentOutput && newOutput) {
-                    const currentText = currentOutput.textContent || '';
-                    const newText = newOutput.textContent || '';
-                    
-                    // Initialize last output length if not exists
-                    if (!(agentId in lastOutputLengths)) {
-                        lastOutputLengths[agentId] = currentText.length;
-                    }
-                    
-                    // Check if output has changed
-                    if (newText.length > lastOutputLengths[agentId]) {
-                        // Update the output
-                        currentOutput.innerHTML = newOutput.innerHTML;
-                        lastOutputLengths[agentId] = newText.length;
-                        
-                        // Auto-scroll to bottom of output
-                        currentOutput.scrollTop = currentOutput.scrollHeight;
-                        
-                        // Flash the output box to indicate new content
-                        currentOutput.style.transition = 'background-color 0.5s';
-                        currentOutput.style.backgroundColor = '#2e4052';
-                        setTimeout(() => {
-                            currentOutput.style.backgroundColor = '#1e1e1e';
-                        }, 500);
-                    }
-                }
-                
-                // Update status badge
-                const currentStatus = agent.querySelector('.badge');
-                const newStatus = newAgentCard.querySelector('.badge');
-                if (currentStatus && newStatus) {
-                    currentStatus.className = newStatus.className;
-                    currentStatus.textContent = newStatus.textContent;
-                }
-                
-                // Update debug info
-                const currentDebug = agent.querySelector('.debug-info');
-                const newDebug = newAgentCard.querySelector('.debug-info');
-                if (currentDebug && newDebug) {
-                    const currentLength = getOutputLength(currentDebug);
-                    const newLength = getOutputLength(newDebug);
-                    
-                    if (currentLength !== newLength) {
-                        currentDebug.innerHTML = newDebug.innerHTML;
-                    }
-                }
-                
-                // Update last critique if it exists
-                const currentCritique = agent.querySelector('.progress-section:last-child');
-                const newCritique = newAgentCard.querySelector('.progress-section:last-child');
-                if (currentCritique && newCritique && currentCritique.innerHTML !== newCritique.innerHTML) {
-                    currentCritique.innerHTML = newCritique.innerHTML;
+        const tasksData = await response.json();
+        // Update each changed agent
+        for (const [agentId, agentData] of Object.entries(tasksData.agents)) {
+            const agentCard = document.getElementById(`agent-${agentId}`);
+            if (!agentCard) continue;
+            applyAgentUpdate(agentId, agentData, agentCard);
+        }
+
+        // Forget agents that no longer exist
+        if (tasksData.agent_ids) {
+            const liveIds = new Set(tasksData.agent_ids);
+            Object.keys(outputEnds).forEach(agentId => {
+                if (!liveIds.has(agentId)) {
+                    delete outputEnds[agentId];
                 }
-            }
-        };
+            });
+        }
+        stateVersion = tasksData.version;
     } catch (error) {
         console.error('Error fetching updates:', error);
     }
@@ -179,6 +140,82 @@ function forceUpdate() {
     fetchUpdates();
 }
 
+// Append a live output chunk if it continues what we already have
+function appendOutputChunk(data) {
+    const agentCard = document.getElementById(`agent-${data.agent_id}`);
+    const known = outputEnds[data.agent_id];
+    if (!agentCard || known === undefined || data.end <= known) {
+        return;
+    }
+    if (data.start > known) {
+        // We missed a chunk; the next poll brings the output back in sync
+        fetchUpdates();
+        return;
+    }
+    const outputElement = agentCard.querySelector('.cli-output');
+    if (outputElement) {
+        updateOutput(data.agent_id, {
+            aider_output_append: data.text.slice(known - data.start),
+            output_end: data.end
+        }, outputElement);
+    }
+}
+
+// Subscribe to live events, falling back to fast polling while disconnected
+function connectEvents() {
+    if (!window.EventSource) {
+        return;
+    }
+    const source = new EventSource('/events');
+    source.onopen = () => {
+        setPollInterval(EVENTS_POLL_INTERVAL);
+        fetchUpdates();
+    };
+    source.onerror = () => setPollInterval(FALLBACK_POLL_INTERVAL);
+    source.addEventListener('output', e => appendOutputChunk(JSON.parse(e.data)));
+    ['state', 'pr'].forEach(type => {
+        source.addEventListener(type, e => {
+            const data = JSON.parse(e.data);
+            const agentCard = document.getElementById(`agent-${data.agent_id}`);
+            if (agentCard) {
+                applyAgentUpdate(data.agent_id, data, agentCard);
+            }
+        });
+    });
+    source.addEventListener('deleted', e => {
+        const data = JSON.parse(e.data);
+        const agentCard = document.getElementById(`agent-${data.agent_id}`);
+        if (agentCard) {
+            agentCard.remove();
+        }
+        delete outputEnds[data.agent_id];
+    });
+    source.addEventListener('usage', e => addUsage(JSON.parse(e.data)));
+    source.addEventListener('resync', fetchUpdates);
+}
+
+// Add a finished LLM request to an agent's token and cost totals
+function addUsage(data) {
+    const agentCard = document.getElementById(`agent-${data.agent_id}`);
+    const usageElement = agentCard && agentCard.querySelector('.agent-usage');
+    if (!usageElement) {
+        return;
+    }
+    const tokens = parseInt(usageElement.dataset.tokens || '0') + data.prompt_tokens + data.completion_tokens;
+    const cost = parseFloat(usageElement.dataset.cost || '0') + data.cost;
+    const requests = parseInt(usageElement.dataset.requests || '0') + 1;
+    usageElement.dataset.tokens = tokens;
+    usageElement.dataset.cost = cost;
+    usageElement.dataset.requests = requests;
+    usageElement.querySelector('[data-field="usage"]').textContent =
+        `${tokens.toLocaleString()} tokens · $${cost.toFixed(4)} · ${requests} requests`;
+}
+
+function setPollInterval(interval) {
+    clearInterval(updateInterval);
+    updateInterval = setInterval(forceUpdate, interval);
+}
+
 // Update toast show function
 function showToast(message, type = 'success') {
     const toastEl = document.getElementById('deleteToast');
@@ -217,7 +254,7 @@ document.addEventListener('DOMContentLoaded', () => {
     outputs.forEach(output => {
         output.scrollTop = output.scrollHeight;
         
-        // Store initial output lengths
+        // Store initial output end offsets
         const agentCard = output.closest('.agent-card');
         if (!agentCard || !agentCard.id) {
             return;
@@ -228,11 +265,12 @@ document.addEventListener('DOMContentLoaded', () => {
             return;
         }
         
-        lastOutputLengths[agentId] = output.textContent.length;
+        outputEnds[agentId] = parseInt(output.dataset.outputEnd || '0');
     });
 
-    // Set up updates for CLI output with a reasonable interval
-    setInterval(forceUpdate, 5000); // Check for updates every 5 seconds
+    // Poll every 5 seconds until the event stream connects, then only as a safety net
+    setPollInterval(FALLBACK_POLL_INTERVAL);
+    connectEvents();
 
     // Hide loader
     const loader = document.querySelector('.page-loader');
@@ -281,7 +319,7 @@ document.getElementById('agentList').addEventListener('click', async (e) => {
                     // Remove after animation
                     setTimeout(() => {
                         agentCard.remove();
-                        delete lastOutputLengths[agentId];
+                        delete outputEnds[agentId];
                     }, 500);
                 }
                 
@@ -16,6 +16,10 @@ document.addEventListener('DOMContentLoaded', () => {
                 agent_model: document.getElementById('agentModel').value.trim(),
                 aider_prompt_suffix: document.getElementById('aiderPromptSuffix').value.trim() || ''
             };
+            const contextTokenBudget = parseInt(document.getElementById('contextTokenBudget').value, 10);
+            if (contextTokenBudget > 0) {
+                configData.context_token_budget = contextTokenBudget;
+            }
 
 
             const response = await fetch('/config/models', {
@@ -80,6 +84,10 @@ async function loadCurrentConfig() {
                     </div>
                 `).join('')}
             </div>
+            <div class="mt-3">
+                <h6>Context Token Budget</h6>
+                <p>${config.context_token_budget}</p>
+            </div>
             ${config.aider_prompt_suffix ? `
             <div class="mt-3">
                 <h6>Additional Instructions</h6>
@@ -93,6 +101,7 @@ async function loadCurrentConfig() {
             document.getElementById(`${type}Model`).value = config[`${type}_model`];
         });
         document.getElementById('aiderPromptSuffix').value = config.aider_prompt_suffix || '';
+        document.getElementById('contextTokenBudget').value = config.context_token_budget || '';
     } catch (error) {
         currentConfig.innerHTML = `
             <div class="alert alert-danger">
@@ -1,9 +1,31 @@
+// Overview state kept in sync with delta polls
+const overviewAgents = {};
+let overviewVersion = null;
+
 // Function to update overview statistics
 async function updateOverview() {
     try {
-        const response = await fetch('/tasks/tasks.json');
+        // The overview never shows agent output, so leave it out of the payload
+        const query = overviewVersion !== null ? `?output=0&since=${overviewVersion}` : '?output=0';
+        const headers = overviewVersion !== null ? {'If-None-Match': `"${overviewVersion}"`} : {};
+        const response = await fetch(`/tasks/tasks.json${query}`, {headers});
+        if (response.status === 304) {
+            return;
+        }
         const data = await response.json();
-        const agents = data.agents || {};
+        if (data.agent_ids) {
+            const liveIds = new Set(data.agent_ids);
+            Object.keys(overviewAgents).forEach(agentId => {
+                if (!liveIds.has(agentId)) {
+                    delete overviewAgents[agentId];
+                }
+            });
+        } else {
+            Object.keys(overviewAgents).forEach(agentId => delete overviewAgents[agentId]);
+        }
+        Object.assign(overviewAgents, data.agents || {});
+        overviewVersion = data.version;
+        const agents = overviewAgents;
         const agentCount = Object.keys(agents).length;
 
         // Update statistics
@@ -30,7 +52,7 @@ document.getElementById('deleteAllAgents').addEventListener('click', async () =>
     }
 
     try {
-        const response = await fetch('/tasks/tasks.json');
+        const response = await fetch('/tasks/tasks.json?output=0');
         const data = await response.json();
         const agents = Object.keys(data.agents || {});
 
@@ -78,6 +100,24 @@ document.getElementById('deleteAllAgents').addEventListener('click', async () =>
     }
 });
 
+// Poll a provisioning job until every agent is ready or failed
+async function waitForJob(jobId, alertDiv) {
+    while (true) {
+        const response = await fetch(`/jobs/${jobId}`);
+        const data = await response.json();
+        if (!data.success) {
+            throw new Error(data.error);
+        }
+        const job = data.job;
+        const pending = job.agents.length - job.ready - job.failed;
+        alertDiv.textContent = `Provisioning agents: ${job.ready} ready, ${job.failed} failed, ${pending} in progress...`;
+        if (job.done) {
+            return job;
+        }
+        await new Promise(resolve => setTimeout(resolve, 1000));
+    }
+}
+
 // Storage helper functions
 function saveToStorage(key, value, useSession = false) {
     const storage = useSession ? sessionStorage : localStorage;
@@ -329,13 +369,22 @@ document.addEventListener('DOMContentLoaded', async () => {
 
             resultDiv.style.display = 'block';
             if (data.success) {
-                alertDiv.className = 'alert alert-success';
-                alertDiv.textContent = `Success! Agents ${data.agent_ids.join(', ')} created. Redirecting to Agent View...`;
-
-                // Redirect to agents view after a short delay
-                setTimeout(() => {
-                    window.location.href = '/agents';
-                }, 2000);
+                alertDiv.className = 'alert alert-info';
+                alertDiv.textContent = `Provisioning ${data.agent_ids.length} agent(s)...`;
+                const job = await waitForJob(data.job_id, alertDiv);
+                if (job.ready > 0) {
+                    alertDiv.className = job.failed ? 'alert alert-warning' : 'alert alert-success';
+                    alertDiv.textContent = `Created ${job.ready} agent(s)` +
+                        (job.failed ? `, ${job.failed} failed` : '') + '. Redirecting to Agent View...';
+
+                    // Redirect to agents view after a short delay
+                    setTimeout(() => {
+                        window.location.href = '/agents';
+                    }, 2000);
+                } else {
+                    alertDiv.className = 'alert alert-danger';
+                    alertDiv.textContent = 'Error: Failed to create any agents';
+                }
             } else {
                 alertDiv.className = 'alert alert-danger';
                 alertDiv.textContent = `Error: ${data.error}`;
@@ -0,0 +1,70 @@
+import json
+from typing import Dict, List, Optional
+
+class JSONFieldStream:
+    """Incremental parser that yields top-level string fields of a streamed JSON object
+
+    feed() takes the next chunk of a response and returns the string fields
+    that were completed by it, so a caller can act on one field while later
+    fields are still streaming. Text before the opening brace, such as a
+    markdown code fence, is ignored; nested values are skipped.
+    """
+
+    def __init__(self):
+        self.fields: Dict[str, str] = {}
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._raw: List[str] = []
+        self._expect = 'key'
+        self._key: Optional[str] = None
+        self.done = False
+
+    def feed(self, chunk: str) -> Dict[str, str]:
+        completed = {}
+        for ch in chunk or '':
+            if self.done:
+                break
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._end_string(''.join(self._raw), completed)
+                    self._raw = []
+                    continue
+                if self._depth == 1:
+                    self._raw.append(ch)
+                continue
+            if ch == '"':
+                if self._depth > 0:
+                    self._in_string = True
+            elif ch in '{[':
+                self._depth += 1
+                if self._depth == 1:
+                    self._expect = 'key'
+            elif ch in '}]':
+                if self._depth > 0:
+                    self._depth -= 1
+                    self.done = self._depth == 0
+            elif self._depth == 1:
+                if ch == ',':
+                    self._expect = 'key'
+                elif ch == ':':
+                    self._expect = 'value'
+        return completed
+
+    def _end_string(self, raw: str, completed: Dict[str, str]) -> None:
+        try:
+            text = json.loads(f'"{raw}"')
+        except ValueError:
+            text = raw
+        if self._expect == 'key':
+            self._key = text
+        elif self._key is not None:
+            self.fields[self._key] = text
+            completed[self._key] = text
+            self._key = None
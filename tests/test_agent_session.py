@@ -1,7 +1,10 @@
 import pytest
 from unittest.mock import patch, MagicMock, call
+import os
 import subprocess
+import sys
 import threading
+import time
 import io
 from pathlib import Path
 from agent_session import AgentSession, normalize_path
@@ -94,17 +97,81 @@ def test_agent_session_send_message(mock_popen, agent_session, mock_process):
 
 def test_agent_session_is_ready(agent_session):
     """Test checking if agent session is ready."""
-    # Test with empty output
-    agent_session.output_buffer = io.StringIO()
+    # Test with no output yet
     assert agent_session.is_ready() is True
     
-    # Test with stable output
-    agent_session.output_buffer = io.StringIO("Stable output")
+    # Test with recent output
+    agent_session._record_output("Working on it\n")
+    assert agent_session.is_ready() is False
+    
+    # Test with output that has been stable for stability_duration
+    agent_session._last_output_time -= 1
     assert agent_session.is_ready() is True
     
     # Test with error
-    agent_session.get_output = MagicMock(side_effect=Exception())
+    agent_session.seconds_since_output = MagicMock(side_effect=Exception())
+    assert agent_session.is_ready() is False
+
+def test_agent_session_is_ready_on_prompt(agent_session):
+    """Test a prompt line makes the session ready without waiting."""
+    agent_session._record_output("Applied edit to app.py\n")
+    assert agent_session.is_ready() is False
+    agent_session._record_output("> \n")
+    assert agent_session.is_ready() is True
+    
+    # New output after the prompt means aider is busy again
+    agent_session._record_output("Thinking...\n")
+    assert agent_session.is_ready() is False
+
+def test_send_message_resets_readiness(agent_session, mock_process):
+    """Test sending a message marks the session busy."""
+    agent_session.process = mock_process
+    agent_session._record_output("> \n")
+    assert agent_session.is_ready() is True
+    assert agent_session.send_message("/ls") is True
+    assert agent_session.is_ready() is False
+
+def test_prompt_printed_while_sending_is_kept(agent_session, mock_process):
+    """Test a prompt that arrives as soon as the command is written still counts."""
+    agent_session.config.update({'stability_duration': 30, 'prompt_debounce': 0.05})
+    agent_session.process = mock_process
+    mock_process.stdin.flush.side_effect = lambda: agent_session._handle_tail("> ")
+    assert agent_session.send_message("/ls") is True
+    assert agent_session.wait_until_ready(timeout=1) is True
+
+def test_unterminated_prompt_marks_ready_once_settled(agent_session):
+    """Test aider's input("> ") prompt counts, without a newline, once nothing follows it."""
+    agent_session.config.update({'stability_duration': 30, 'prompt_debounce': 0.05})
+    agent_session._record_output("Working\n")
+    agent_session._handle_tail("Working on it")
+    assert agent_session.is_ready() is False
+    agent_session._handle_tail("> ")
+    assert agent_session.is_ready() is False
+    assert agent_session.wait_until_ready(timeout=1) is True
+    assert "> " not in agent_session.get_output()
+
+def test_streamed_quote_is_not_taken_for_prompt(agent_session):
+    """Test a "> " that more text follows on the same line does not mark the session ready."""
+    agent_session.config.update({'stability_duration': 30, 'prompt_debounce': 0.1})
+    agent_session._handle_tail("> ")
+    time.sleep(0.02)
+    agent_session._handle_tail("> Note: the quoted reply continues")
+    time.sleep(0.15)
     assert agent_session.is_ready() is False
+    agent_session._handle_line("> Note: the quoted reply continues\n")
+    time.sleep(0.15)
+    assert agent_session.is_ready() is False
+
+def test_wait_until_ready(agent_session):
+    """Test waiting for readiness returns when the prompt appears."""
+    agent_session.config['stability_duration'] = 30
+    agent_session._record_output("Working\n")
+    assert agent_session.wait_until_ready(timeout=0.05) is False
+    
+    timer = threading.Timer(0.05, agent_session._record_output, args=("> \n",))
+    timer.start()
+    assert agent_session.wait_until_ready(timeout=5) is True
+    timer.join()
 
 def test_format_output_line(agent_session):
     """Test output line formatting."""
@@ -176,6 +243,24 @@ def test_read_output(mock_popen, agent_session, mock_process):
     assert "> Agent response" in output
     assert "Can't initialize prompt toolkit" not in output
 
+@pytest.mark.skipif(sys.platform == 'win32', reason="pipes are read by threads on Windows")
+@patch('database.get_model_config', return_value={'aider_model': 'test-model'})
+def test_pipes_served_by_shared_reader(mock_get_config, tmp_path):
+    """Test a started session's output is read without per-session reader threads."""
+    script = tmp_path / 'fake_aider.py'
+    script.write_text("import sys\nprint('Aider v0.1')\nprint('ready')\nsys.stdout.write('> ')\nsys.stdout.flush()\nsys.stdin.readline()\n")
+    session = AgentSession(str(tmp_path), "Test task", config={'startup_timeout': 5})
+    with patch.dict(os.environ, {'AIDER_EXECUTABLE': f'"{sys.executable}" "{script}"'}):
+        assert session.start()
+    try:
+        assert not [t for t in threading.enumerate() if t.name.startswith(f"stdout-{session.session_id}")]
+        # Well within stability_duration, so readiness came from the prompt
+        assert session.wait_until_ready(timeout=5)
+        assert 'ready' in session.get_output()
+        assert 'Aider v' not in session.get_output()
+    finally:
+        session.cleanup()
+
 def test_echo_message(agent_session):
     """Test echoing messages to output buffer."""
     test_message = "Test echo message"
@@ -188,4 +273,17 @@ def test_echo_message(agent_session):
     
     # Test with error
     agent_session.output_buffer = None
-    agent_session._echo_message(test_message)  # Should not raise exception
\ No newline at end of file
+    agent_session._echo_message(test_message)  # Should not raise exception
+
+@patch('agent_session.publish')
+def test_output_is_published_with_agent_id(mock_publish):
+    """Test output chunks are pushed to live listeners when the session knows its agent."""
+    session = AgentSession('/test/workspace', 'Test task', agent_id='agent1')
+    session.output_buffer.write("hello\n")
+    mock_publish.assert_called_once_with('output', {'agent_id': 'agent1', 'text': "hello\n", 'start': 0, 'end': 6})
+
+@patch('agent_session.publish')
+def test_output_not_published_without_agent_id(mock_publish, agent_session):
+    """Test sessions without an agent ID do not publish output."""
+    agent_session.output_buffer.write("hello\n")
+    mock_publish.assert_not_called()
@@ -1,6 +1,7 @@
 import pytest
 import json
 from unittest.mock import patch, MagicMock
+import app as app_module
 from app import app
 import sqlite3
 from pathlib import Path
@@ -44,8 +45,9 @@ def test_index(client):
     response = client.get('/')
     assert response.status_code == 200
 
+@patch('app.get_state_version', return_value=3)
 @patch('app.load_tasks')
-def test_serve_tasks_json(mock_load_tasks, client):
+def test_serve_tasks_json(mock_load_tasks, mock_get_state_version, client):
     """Test serving tasks JSON."""
     mock_data = {
         'tasks': [],
@@ -56,7 +58,65 @@ def test_serve_tasks_json(mock_load_tasks, client):
     
     response = client.get('/tasks/tasks.json')
     assert response.status_code == 200
-    assert response.json == mock_data
+    assert response.json == {'tasks': [], 'agents': {}, 'repository_url': '', 'version': 3}
+    assert response.headers['ETag'] == '"3"'
+
+@patch('app.get_state_version', return_value=3)
+@patch('app.load_tasks')
+def test_serve_tasks_json_not_modified(mock_load_tasks, mock_get_state_version, client):
+    """Test an unchanged state version returns 304 without loading tasks."""
+    response = client.get('/tasks/tasks.json', headers={'If-None-Match': '"3"'})
+    assert response.status_code == 304
+    mock_load_tasks.assert_not_called()
+
+@patch('app.get_state_version', return_value=5)
+@patch('app.load_tasks_since')
+def test_serve_tasks_json_since(mock_load_tasks_since, mock_get_state_version, client):
+    """Test ?since returns changed agents with output appended past the client's offset."""
+    mock_load_tasks_since.return_value = {
+        'tasks': [],
+        'agents': {
+            'agent1': {'aider_output': 'hello world', 'output_offset': 10},
+            'agent2': {'aider_output': 'fresh', 'output_offset': 100}
+        },
+        'agent_ids': ['agent1', 'agent2', 'agent3'],
+        'repository_url': ''
+    }
+    response = client.get('/tasks/tasks.json?since=2&offsets=agent1:16,agent2:50')
+    assert response.status_code == 200
+    mock_load_tasks_since.assert_called_once_with(2)
+    agents = response.json['agents']
+    assert agents['agent1']['aider_output_append'] == 'world'
+    assert 'aider_output' not in agents['agent1']
+    assert agents['agent1']['output_end'] == 21
+    # The client's offset fell out of the retained window, so it gets the full output
+    assert agents['agent2']['aider_output'] == 'fresh'
+    assert response.json['agent_ids'] == ['agent1', 'agent2', 'agent3']
+
+@patch('app.get_state_version', return_value=5)
+@patch('app.load_tasks')
+def test_serve_tasks_json_since_ahead(mock_load_tasks, mock_get_state_version, client):
+    """Test a since version newer than the server's falls back to the full payload."""
+    mock_load_tasks.return_value = {'tasks': [], 'agents': {'agent1': {'aider_output': 'x'}}, 'repository_url': ''}
+    response = client.get('/tasks/tasks.json?since=9&output=0')
+    assert response.status_code == 200
+    mock_load_tasks.assert_called_once()
+    assert 'aider_output' not in response.json['agents']['agent1']
+
+def test_events_stream(client):
+    """Test /events streams published events and unsubscribes when closed."""
+    from events import event_bus
+    response = client.get('/events', buffered=False)
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    chunks = iter(response.response)
+    assert next(chunks).startswith(b'retry:')
+    event_bus.publish('state', {'agent_id': 'agent1', 'status': 'in_progress'})
+    chunk = next(chunks).decode()
+    assert 'event: state' in chunk
+    assert '"agent_id": "agent1"' in chunk
+    response.close()
+    assert event_bus.subscriber_count() == 0
 
 @patch('app.load_tasks')
 @patch('app.save_tasks')
@@ -74,19 +134,39 @@ def test_agent_view(mock_save_tasks, mock_load_tasks, client):
     response = client.get('/agents')
     assert response.status_code == 200
 
-@patch('app.initialiseCodingAgent')
-def test_create_agent_success(mock_init_agent, client):
-    """Test successful agent creation."""
+@patch('app.get_history')
+def test_agent_history(mock_get_history, client):
+    """Test paging through agent history."""
+    mock_get_history.return_value = [
+        {'id': 4, 'timestamp': '2024-01-01T00:00:00', 'content': 'step 4'},
+        {'id': 5, 'timestamp': '2024-01-01T00:01:00', 'content': 'step 5'}
+    ]
+    
+    response = client.get('/agents/agent1/history/progress?limit=2&before=6')
+    assert response.status_code == 200
+    assert response.json['next_before'] == 4
+    assert len(response.json['entries']) == 2
+    mock_get_history.assert_called_once_with('agent1', 'progress', limit=2, before_id=6)
+
+def test_agent_history_invalid_kind(client):
+    """Test requesting an unknown history kind."""
+    response = client.get('/agents/agent1/history/unknown')
+    assert response.status_code == 400
+
+@patch('app.check_and_start_main_loop')
+@patch('app.provision_agent')
+def test_create_agent_success(mock_provision_agent, mock_start_loop, client):
+    """Test agent creation returns a job at once and provisions agents in the background."""
     # Setup mocks
     mock_token_manager = MagicMock()
     mock_token_manager.return_value.set_token.return_value = True
-    mock_init_agent.return_value = ['test_agent_id']
+    mock_provision_agent.side_effect = lambda agent_id, **kwargs: agent_id
     
     # Test data
     test_data = {
         'repo_url': 'https://github.com/test/repo',
         'tasks': [{'title': 'Test Task', 'description': 'Test Description'}],
-        'num_agents': 1
+        'num_agents': 2
     }
     
     # Make request
@@ -95,12 +175,22 @@ def test_create_agent_success(mock_init_agent, client):
                              headers={'X-GitHub-Token': 'test_token'},
                              json=test_data)
         
-        assert response.status_code == 200
+        assert response.status_code == 202
         assert response.json['success'] is True
-        assert 'test_agent_id' in response.json['agent_ids']
+        assert len(response.json['agent_ids']) == 2
+        job_id = response.json['job_id']
+
+    assert app_module.provisioning_pool.wait(job_id, 5)
+    response = client.get(f'/jobs/{job_id}')
+    assert response.status_code == 200
+    job = response.json['job']
+    assert job['done'] is True
+    assert job['ready'] == 2
+    assert {agent['status'] for agent in job['agents']} == {'ready'}
+    assert mock_provision_agent.call_args.kwargs['task_description'] == 'Test Task\n\nTest Description'
 
-@patch('app.initialiseCodingAgent')
-def test_create_agent_missing_token(mock_init_agent, client):
+@patch('app.provision_agent')
+def test_create_agent_missing_token(mock_provision_agent, client):
     """Test agent creation without GitHub token."""
     test_data = {
         'repo_url': 'https://github.com/test/repo',
@@ -164,12 +254,13 @@ def test_delete_agent_not_found(mock_load_tasks, mock_delete_agent, client):
     assert response.json['success'] is False
 
 # Add error case tests
-@patch('app.initialiseCodingAgent')
-def test_create_agent_failure(mock_init_agent, client):
-    """Test agent creation failure."""
+@patch('app.check_and_start_main_loop')
+@patch('app.provision_agent')
+def test_create_agent_failure(mock_provision_agent, mock_start_loop, client):
+    """Test failed provisioning is reported per agent on the job."""
     mock_token_manager = MagicMock()
     mock_token_manager.return_value.set_token.return_value = True
-    mock_init_agent.return_value = None
+    mock_provision_agent.return_value = None
     
     test_data = {
         'repo_url': 'https://github.com/test/repo',
@@ -182,8 +273,19 @@ def test_create_agent_failure(mock_init_agent, client):
                              headers={'X-GitHub-Token': 'test_token'},
                              json=test_data)
         
-        assert response.status_code == 500
-        assert response.json['success'] is False
+        assert response.status_code == 202
+        job_id = response.json['job_id']
+
+    assert app_module.provisioning_pool.wait(job_id, 5)
+    job = client.get(f'/jobs/{job_id}').json['job']
+    assert job['failed'] == 1
+    assert job['agents'][0]['status'] == 'failed'
+
+def test_provisioning_job_not_found(client):
+    """Test unknown job IDs return 404."""
+    response = client.get('/jobs/missing')
+    assert response.status_code == 404
+    assert response.json['success'] is False
 
 @patch('app.load_tasks')
 def test_agent_view_with_missing_fields(mock_load_tasks, client):
@@ -196,4 +298,50 @@ def test_agent_view_with_missing_fields(mock_load_tasks, client):
     mock_load_tasks.return_value = mock_data
     
     response = client.get('/agents')
-    assert response.status_code == 200
\ No newline at end of file
+    assert response.status_code == 200
+
+@patch('app.get_usage_summary')
+def test_usage_summary(mock_get_usage_summary, client):
+    """Test usage totals are served per agent, task and model."""
+    mock_get_usage_summary.side_effect = lambda group, agent_id=None: [{'name': f'{group}-1', 'cost': 0.5}]
+    response = client.get('/usage')
+    assert response.status_code == 200
+    assert set(response.json['usage']) == {'agent', 'task', 'model'}
+    assert response.json['usage']['model'] == [{'name': 'model-1', 'cost': 0.5}]
+
+    response = client.get('/usage?group_by=model&agent_id=agent1')
+    assert list(response.json['usage']) == ['model']
+    mock_get_usage_summary.assert_called_with('model', agent_id='agent1')
+
+def test_usage_summary_unknown_grouping(client):
+    """Test an unknown grouping is rejected."""
+    response = client.get('/usage?group_by=color')
+    assert response.status_code == 400
+
+def test_metrics_endpoint(client):
+    """Test the metrics endpoint serves the hot-path metrics in Prometheus text format."""
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain; version=0.0.4')
+    text = response.get_data(as_text=True)
+    for name in ('orchestrator_sweep_duration_seconds', 'agent_ready_wait_seconds', 'llm_request_duration_seconds',
+                 'llm_errors', 'db_query_duration_seconds', 'pr_create_duration_seconds',
+                 'agent_output_buffer_chars', 'aider_processes_active'):
+        assert f'# TYPE {name} ' in text
+
+def test_traces_endpoint(client):
+    """Test traces are exported as OTLP/JSON by default and in Chrome format on request."""
+    from tracing import tracer
+    tracer.clear()
+    with tracer.trace('agent_step', agent_id='agent1'):
+        with tracer.span('chat_completion', model='m'):
+            pass
+    response = client.get('/traces?agent_id=agent1')
+    assert response.status_code == 200
+    spans = response.json['resourceSpans'][0]['scopeSpans'][0]['spans']
+    assert [s['name'] for s in spans] == ['agent_step', 'chat_completion']
+    assert spans[1]['parentSpanId'] == spans[0]['spanId']
+
+    response = client.get('/traces?format=chrome')
+    assert [e['ph'] for e in response.json['traceEvents']] == ['X', 'X']
+    assert client.get('/traces?format=xml').status_code == 400
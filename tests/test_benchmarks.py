@@ -0,0 +1,52 @@
+import json
+import subprocess
+import sys
+from pathlib import Path
+import pytest
+
+BENCHMARKS = Path(__file__).parent.parent / 'benchmarks'
+sys.path.insert(0, str(BENCHMARKS))
+
+def run_benchmark(*args):
+    """Run the orchestrator benchmark in its own process and return its JSON report."""
+    result = subprocess.run(
+        [sys.executable, str(BENCHMARKS / 'bench_orchestrator.py'), '--json', *args],
+        capture_output=True, text=True, timeout=60
+    )
+    # Database set-up messages come before the report
+    return json.loads(result.stdout[result.stdout.index('{'):])
+
+@pytest.mark.skipif(sys.platform == 'win32', reason="fake aider sessions need selectable pipes")
+def test_step_latency_covers_the_llm_call():
+    """Test only steps that made a decision are sampled, so p50 includes the mock LLM latency."""
+    report = run_benchmark('--agents', '2', '--duration', '3', '--llm-latency', '0.2', '--aider-delay', '0.3')
+    assert report['steps'] > 0
+    assert report['step_p50_ms'] >= 200
+
+def test_replay_answers_each_request_with_its_own_kind(tmp_path):
+    """Test a skipped summary call does not shift later decisions onto summary responses."""
+    from prompts import PROMPT_AIDER, PROMPT_SUMMARY
+    from recorder import SessionRecorder
+    from replay import ReplayLLMProvider, load_traces
+    path = tmp_path / 'session.jsonl'
+    recorder = SessionRecorder(str(path))
+    summary = json.dumps({'summary': 'earlier work'})
+    decisions = [json.dumps({'progress': f'p{i}', 'thought': 't', 'action': '/ls', 'future': 'f'}) for i in range(2)]
+    recorder.record('start', 'agent1', task='task')
+    recorder.record_llm('agent1', 'orchestrator', 'm', PROMPT_SUMMARY(), 'old output', summary, 100)
+    for decision in decisions:
+        recorder.record_llm('agent1', 'agent', 'm', PROMPT_AIDER('task'), 'logs', decision, 100)
+    recorder.close()
+    _, responses = load_traces(str(path))
+    provider = ReplayLLMProvider(responses, speed=1000)
+
+    def ask(system):
+        return provider._next([{'role': 'system', 'content': system}, {'role': 'user', 'content': 'logs'}],
+                              {'agent_id': 'agent1'})[0]
+
+    # The orchestrator under test decides twice without summarizing first
+    assert [ask(PROMPT_AIDER('task')) for _ in decisions] == decisions
+    assert ask(PROMPT_SUMMARY()) == summary
+    assert provider.replayed == 3
+    assert 'progress' in json.loads(ask(PROMPT_AIDER('task')))
+    assert provider.generated == 1
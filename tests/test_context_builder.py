@@ -0,0 +1,83 @@
+import pytest
+from context_builder import ContextBuilder, estimate_tokens, CHARS_PER_TOKEN
+
+class FakeSummarizer:
+    """Records calls and returns a short summary."""
+    def __init__(self, result='summary'):
+        self.calls = []
+        self.result = result
+
+    def __call__(self, previous, new_output):
+        self.calls.append((previous, new_output))
+        if isinstance(self.result, Exception):
+            raise self.result
+        return f"{self.result} {len(self.calls)}"
+
+def make_output(lines, width=79):
+    return ''.join(f"{i:06d}".ljust(width, 'x') + '\n' for i in range(lines))
+
+def test_estimate_tokens():
+    """Test token estimates round up and handle empty text."""
+    assert estimate_tokens('') == 0
+    assert estimate_tokens(None) == 0
+    assert estimate_tokens('a' * (CHARS_PER_TOKEN + 1)) == 2
+
+def test_small_output_passes_through():
+    """Test output within the budget is returned unchanged without summarizing."""
+    summarize = FakeSummarizer()
+    builder = ContextBuilder(summarize)
+    assert builder.build('hello\nworld', 0, budget_tokens=100) == 'hello\nworld'
+    assert summarize.calls == []
+
+def test_large_output_is_summarized_within_budget():
+    """Test older output is summarized and recent output kept verbatim."""
+    summarize = FakeSummarizer()
+    builder = ContextBuilder(summarize)
+    output = make_output(500)
+    context = builder.build(output, 0, budget_tokens=2000)
+    assert len(summarize.calls) == 1
+    assert context.startswith('[Summary of earlier output]\nsummary 1')
+    assert context.endswith(output[-1000:])
+    assert estimate_tokens(context) <= 2000 + 20
+    # The recent window starts on a line boundary
+    recent = context.split('[Recent output]\n', 1)[1]
+    assert output.endswith(recent)
+    assert output[-len(recent) - 1] == '\n'
+
+def test_summary_is_updated_incrementally():
+    """Test each piece of output is summarized only once as output grows."""
+    summarize = FakeSummarizer()
+    builder = ContextBuilder(summarize)
+    output = make_output(500)
+    builder.build(output, 0, budget_tokens=2000)
+    first_chunk = summarize.calls[0][1]
+
+    # A little more output is not worth another summary call
+    builder.build(output + make_output(5), 0, budget_tokens=2000)
+    assert len(summarize.calls) == 1
+
+    output += make_output(200)
+    builder.build(output, 0, budget_tokens=2000)
+    assert len(summarize.calls) == 2
+    previous, new_output = summarize.calls[1]
+    assert previous == 'summary 1'
+    assert first_chunk not in new_output
+
+def test_window_start_after_summary_is_gap():
+    """Test output dropped from the buffer before being summarized is marked as a gap."""
+    summarize = FakeSummarizer()
+    builder = ContextBuilder(summarize)
+    output = make_output(500)
+    builder.build(output, 0, budget_tokens=2000)
+    later = make_output(500)
+    builder.build(later, builder.summarized_to + 100000, budget_tokens=2000)
+    assert summarize.calls[-1][1].startswith('[some earlier output was not kept]')
+
+def test_summarizer_failure_falls_back_to_truncation():
+    """Test a failing summarizer still produces a bounded summary."""
+    builder = ContextBuilder(FakeSummarizer(result=Exception('LLM down')))
+    output = make_output(500)
+    context = builder.build(output, 0, budget_tokens=2000)
+    assert builder.summary
+    assert len(builder.summary) <= 500 * CHARS_PER_TOKEN
+    assert context.endswith(output[-1000:])
@@ -6,7 +6,10 @@ import json
 from database import (
     init_db, save_agent, get_agent, get_all_agents,
     delete_agent, save_task, get_all_tasks,
-    get_config, save_config, get_model_config
+    get_config, save_config, get_model_config,
+    get_connection, close_connections, save_agents, AgentRecord,
+    append_history, get_history, get_state_version, get_agents_since,
+    get_agent_ids, invalidate_model_config, record_usage, get_usage_summary
 )
 
 @pytest.fixture
@@ -52,7 +55,7 @@ def test_init_db(test_db_path):
         # Check if all tables exist
         cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
         tables = {row[0] for row in cursor.fetchall()}
-        expected_tables = {'model_config', 'agents', 'tasks', 'config'}
+        expected_tables = {'model_config', 'agents', 'tasks', 'config', 'agent_history'}
         assert expected_tables.issubset(tables)
         
         # Verify default model config was created
@@ -222,4 +225,249 @@ def test_get_model_config_error(initialized_db, monkeypatch):
         raise sqlite3.Error("Mock DB Error")
     
     monkeypatch.setattr(sqlite3, "connect", mock_connect)
-    assert get_model_config() is None
\ No newline at end of file
+    assert get_model_config() is None
+
+def test_model_config_is_cached_until_invalidated(initialized_db):
+    """Test model config reads skip the database until the config is invalidated."""
+    get_model_config()
+    with get_connection() as conn:
+        conn.execute("UPDATE model_config SET agent_model = 'changed'")
+    assert get_model_config()['agent_model'] == 'openrouter/google/gemini-flash-1.5'
+
+    invalidate_model_config()
+    assert get_model_config()['agent_model'] == 'changed'
+
+def test_model_config_cache_returns_copies(initialized_db):
+    """Test callers cannot modify the cached model config."""
+    get_model_config()['agent_model'] = 'mutated'
+    assert get_model_config()['agent_model'] == 'openrouter/google/gemini-flash-1.5'
+
+def test_connection_is_reused_per_thread(initialized_db):
+    """Test each thread keeps one persistent connection."""
+    import threading
+    conn = get_connection()
+    assert get_connection() is conn
+    
+    other = []
+    thread = threading.Thread(target=lambda: other.append(get_connection()))
+    thread.start()
+    thread.join()
+    assert other[0] is not conn
+
+def test_connection_pragmas(initialized_db):
+    """Test pooled connections use WAL and a busy timeout."""
+    conn = get_connection()
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+    assert conn.execute("PRAGMA busy_timeout").fetchone()[0] == 5000
+    assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+
+def test_close_connections(initialized_db):
+    """Test closing connections makes the next call reconnect."""
+    conn = get_connection()
+    close_connections()
+    new_conn = get_connection()
+    assert new_conn is not conn
+    assert get_config('missing') is None
+
+def test_agent_record_dirty_fields():
+    """Test records only report columns changed since load."""
+    record = AgentRecord({'id': 'a1', 'status': 'pending', 'progress_history': []})
+    assert record.dirty_fields() == {}
+    
+    record['status'] = 'running'
+    record['progress_history'].append({'content': 'step'})
+    record['not_a_column'] = 'ignored'
+    assert record.dirty_fields() == {'status': 'running'}
+    assert record.new_history_entries() == {'progress_history': [{'content': 'step'}]}
+    
+    record.mark_clean()
+    assert record.dirty_fields() == {}
+    assert record.new_history_entries() == {}
+
+def test_save_agents_new_and_changed(initialized_db, sample_agent_data):
+    """Test save_agents inserts new agents and updates changed ones."""
+    assert save_agents({'agent_1': sample_agent_data}) is True
+    record = get_agent('agent_1')
+    assert isinstance(record, AgentRecord)
+    
+    record['status'] = 'completed'
+    record['thought_history'].append('Second thought')
+    assert save_agents({'agent_1': record}) is True
+    assert record.dirty_fields() == {}
+    
+    agent = get_agent('agent_1')
+    assert agent['status'] == 'completed'
+    assert agent['thought_history'] == ['Initial thought', 'Second thought']
+    assert agent['task'] == sample_agent_data['task']
+
+def test_save_agents_only_writes_changed_columns(initialized_db, sample_agent_data):
+    """Test two stale copies of an agent can each save their own changes."""
+    save_agent('agent_1', sample_agent_data)
+    first = get_all_agents()['agent_1']
+    second = get_all_agents()['agent_1']
+    
+    first['progress'] = 'Halfway there'
+    second['aider_output'] = 'new output'
+    assert save_agents({'agent_1': first}) is True
+    assert save_agents({'agent_1': second}) is True
+    
+    agent = get_agent('agent_1')
+    assert agent['progress'] == 'Halfway there'
+    assert agent['aider_output'] == 'new output'
+
+def test_save_agents_skips_clean_records(initialized_db, sample_agent_data):
+    """Test unchanged records issue no writes."""
+    save_agent('agent_1', sample_agent_data)
+    records = get_all_agents()
+    conn = get_connection()
+    before = conn.total_changes
+    assert save_agents(records) is True
+    assert conn.total_changes == before
+
+def test_save_agents_error(initialized_db, sample_agent_data, monkeypatch):
+    """Test save_agents with database error."""
+    def mock_connect(*args, **kwargs):
+        raise sqlite3.Error("Mock DB Error")
+    
+    monkeypatch.setattr(sqlite3, "connect", mock_connect)
+    assert save_agents({'agent_1': sample_agent_data}) is False
+
+def test_get_all_agents_without_history(initialized_db, sample_agent_data):
+    """Test get_all_agents leaves history out unless asked."""
+    save_agent('agent_1', sample_agent_data)
+    assert 'progress_history' not in get_all_agents()['agent_1']
+    agent = get_all_agents(include_history=True)['agent_1']
+    assert agent['progress_history'] == sample_agent_data['progress_history']
+
+def test_appended_history_is_saved(initialized_db, sample_agent_data):
+    """Test entries appended to a record without loaded history are inserted."""
+    save_agent('agent_1', sample_agent_data)
+    record = get_all_agents()['agent_1']
+    record.setdefault('progress_history', []).append({
+        'timestamp': '2024-01-01T00:00:00',
+        'content': 'Made progress'
+    })
+    assert save_agents({'agent_1': record}) is True
+    assert get_agent('agent_1')['progress_history'] == [
+        'Started task',
+        {'timestamp': '2024-01-01T00:00:00', 'content': 'Made progress'}
+    ]
+
+def test_history_pagination(initialized_db):
+    """Test paging through history newest page first."""
+    for i in range(5):
+        assert append_history('agent_1', 'thought', f'thought {i}') is True
+    append_history('agent_1', 'progress', 'unrelated')
+    
+    page = get_history('agent_1', 'thought', limit=2)
+    assert [entry['content'] for entry in page] == ['thought 3', 'thought 4']
+    page = get_history('agent_1', 'thought', limit=2, before_id=page[0]['id'])
+    assert [entry['content'] for entry in page] == ['thought 1', 'thought 2']
+    assert len(get_history('agent_1', 'thought', limit=10)) == 5
+
+def test_delete_agent_removes_history(initialized_db, sample_agent_data):
+    """Test deleting an agent deletes its history."""
+    save_agent('agent_1', sample_agent_data)
+    delete_agent('agent_1')
+    assert get_history('agent_1', 'progress') == []
+
+def test_json_history_migration(initialized_db):
+    """Test init_db moves JSON history columns into agent_history."""
+    with sqlite3.connect(initialized_db) as conn:
+        conn.execute("""
+            INSERT INTO agents (id, workspace, task, status, created_at, last_updated,
+                                progress_history, thought_history)
+            VALUES ('legacy', '/ws', 'task', 'pending', 'now', 'now', ?, ?)
+        """, (
+            json.dumps([{'timestamp': 't1', 'content': 'p1'}]),
+            json.dumps([{'timestamp': 't2', 'content': 'th1'}, 'bare entry'])
+        ))
+    init_db()
+    
+    agent = get_agent('legacy')
+    assert agent['progress_history'] == [{'timestamp': 't1', 'content': 'p1'}]
+    assert agent['thought_history'] == [{'timestamp': 't2', 'content': 'th1'}, 'bare entry']
+    with sqlite3.connect(initialized_db) as conn:
+        row = conn.execute("SELECT progress_history, thought_history FROM agents WHERE id = 'legacy'").fetchone()
+    assert row == ('[]', '[]')
+    
+    # Running init again must not duplicate entries
+    init_db()
+    assert len(get_agent('legacy')['thought_history']) == 2
+
+def test_state_version_tracks_changes(initialized_db, sample_agent_data):
+    """Test agent, task and config writes each bump the state version."""
+    version = get_state_version()
+    save_agent('agent1', sample_agent_data)
+    assert get_state_version() == version + 1
+    save_task({'title': 'Task', 'description': 'Description'})
+    assert get_state_version() == version + 2
+    save_config('repository_url', 'https://github.com/test/repo')
+    assert get_state_version() == version + 3
+    # Saving an unchanged config value is not a change
+    save_config('repository_url', 'https://github.com/test/repo')
+    assert get_state_version() == version + 3
+    delete_agent('agent1')
+    assert get_state_version() == version + 4
+
+def test_get_agents_since(initialized_db, sample_agent_data):
+    """Test only agents changed after a version are returned."""
+    save_agent('agent1', sample_agent_data)
+    save_agent('agent2', sample_agent_data)
+    version = get_state_version()
+    agent = get_agent('agent1')
+    agent['status'] = 'completed'
+    save_agents({'agent1': agent})
+    changed = get_agents_since(version)
+    assert list(changed) == ['agent1']
+    assert changed['agent1']['status'] == 'completed'
+    assert changed['agent1']['version'] == get_state_version()
+    assert 'progress_history' not in changed['agent1']
+    assert get_agents_since(get_state_version()) == {}
+    assert sorted(get_agent_ids()) == ['agent1', 'agent2']
+
+def test_version_columns_migration(test_db_path):
+    """Test version and output_offset are added to an existing agents table."""
+    with sqlite3.connect(test_db_path) as conn:
+        conn.execute("CREATE TABLE agents (id TEXT PRIMARY KEY, workspace TEXT NOT NULL, repo_path TEXT, task TEXT NOT NULL, status TEXT NOT NULL, created_at TEXT NOT NULL, last_updated TEXT NOT NULL, aider_output TEXT, last_critique TEXT, progress TEXT, thought TEXT, progress_history TEXT, thought_history TEXT, future TEXT, last_action TEXT, pr_url TEXT, error TEXT, completed BOOLEAN DEFAULT 0, agent_type TEXT DEFAULT 'default')")
+    init_db()
+    with sqlite3.connect(test_db_path) as conn:
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(agents)")}
+    assert {'version', 'output_offset'} <= columns
+
+def test_record_and_summarize_usage(initialized_db, sample_agent_data):
+    """Test usage is aggregated per agent, task and model."""
+    save_agent('agent1', sample_agent_data)
+    record_usage('agent1', 'model-a', 'agent', 100, 20, 0.01, 500)
+    record_usage('agent1', 'model-b', 'orchestrator', 50, 10, 0.02, 300)
+    record_usage('agent2', 'model-a', 'agent', 10, 5, 0, 100)
+
+    by_agent = {row['name']: row for row in get_usage_summary('agent')}
+    assert by_agent['agent1']['requests'] == 2
+    assert by_agent['agent1']['total_tokens'] == 180
+    assert by_agent['agent1']['cost'] == pytest.approx(0.03)
+
+    by_task = {row['name']: row for row in get_usage_summary('task')}
+    assert by_task['Test task']['prompt_tokens'] == 150
+    assert by_task[None]['requests'] == 1
+
+    by_model = get_usage_summary('model', agent_id='agent1')
+    assert [row['name'] for row in by_model] == ['model-b', 'model-a']
+
+    with pytest.raises(ValueError):
+        get_usage_summary('color')
+
+def test_usage_without_agent_is_unattributed(initialized_db):
+    """Test requests made for no agent are stored as NULL and reported as unattributed."""
+    record_usage(None, 'model-a', 'orchestrator', 10, 5, 0.01, 100)
+    with get_connection() as conn:
+        conn.execute(
+            "INSERT INTO llm_usage (agent_id, model, prompt_tokens, created_at) VALUES ('None', 'model-a', 1, 'now')"
+        )
+    init_db()
+
+    with get_connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM llm_usage WHERE agent_id IS NULL").fetchone()[0] == 2
+    [row] = get_usage_summary('agent')
+    assert row['name'] == 'unattributed'
+    assert row['requests'] == 2
@@ -0,0 +1,45 @@
+import json
+from events import EventBus, format_sse
+
+def test_publish_reaches_subscribers():
+    """Test every subscriber receives published events in order."""
+    bus = EventBus()
+    first = bus.subscribe()
+    second = bus.subscribe()
+    bus.publish('state', {'agent_id': 'agent1'})
+    bus.publish('pr', {'agent_id': 'agent1'})
+    for subscription in (first, second):
+        assert subscription.get(0)['type'] == 'state'
+        assert subscription.get(0)['type'] == 'pr'
+        assert subscription.get(0) is None
+
+def test_publish_without_subscribers():
+    """Test publishing with nobody listening is a no-op."""
+    bus = EventBus()
+    bus.publish('state', {})
+    assert bus.subscriber_count() == 0
+
+def test_unsubscribe():
+    """Test an unsubscribed listener stops receiving events."""
+    bus = EventBus()
+    subscription = bus.subscribe()
+    bus.unsubscribe(subscription)
+    bus.publish('state', {})
+    assert subscription.get(0) is None
+    assert bus.subscriber_count() == 0
+
+def test_slow_subscriber_gets_resync():
+    """Test a subscriber that falls behind is told to resync instead of blocking publishers."""
+    bus = EventBus(max_queue=2)
+    subscription = bus.subscribe()
+    for i in range(3):
+        bus.publish('output', {'text': str(i)})
+    assert subscription.get(0)['type'] == 'resync'
+    assert subscription.get(0) is None
+
+def test_format_sse():
+    """Test events are encoded in the event-stream format."""
+    text = format_sse({'id': 7, 'type': 'state', 'data': {'agent_id': 'agent1'}})
+    assert text.startswith('id: 7\nevent: state\ndata: ')
+    assert text.endswith('\n\n')
+    assert json.loads(text.split('data: ')[1]) == {'agent_id': 'agent1'}
@@ -0,0 +1,69 @@
+import os
+import subprocess
+import threading
+import pytest
+from git_ops import GitError, run_git, clone, create_branch, commit_all, push_branch
+
+@pytest.fixture
+def repo(tmp_path):
+    """Create a repository with one commit."""
+    path = tmp_path / "repo"
+    path.mkdir()
+    run_git(['init', '--quiet'], cwd=path)
+    (path / "README.md").write_text("hello\n")
+    assert commit_all(path, "init", "test", "test@example.com") is True
+    return path
+
+def current_branch(path):
+    return run_git(['rev-parse', '--abbrev-ref', 'HEAD'], cwd=path).stdout.strip()
+
+def test_run_git_uses_cwd_without_chdir(repo):
+    """Test git runs in the given directory and leaves the process directory alone."""
+    before = os.getcwd()
+    result = run_git(['rev-parse', '--show-toplevel'], cwd=repo)
+    assert os.path.realpath(result.stdout.strip()) == os.path.realpath(repo)
+    assert os.getcwd() == before
+
+def test_run_git_raises_on_failure(tmp_path):
+    """Test a failing command raises GitError with git's message."""
+    with pytest.raises(GitError) as excinfo:
+        run_git(['rev-parse', 'HEAD'], cwd=tmp_path)
+    assert isinstance(excinfo.value, subprocess.CalledProcessError)
+    assert 'status' in str(excinfo.value)
+    assert run_git(['rev-parse', 'HEAD'], cwd=tmp_path, check=False).returncode != 0
+
+def test_commit_all_with_nothing_to_commit(repo):
+    """Test committing a clean tree reports that nothing was committed."""
+    assert commit_all(repo, "empty", "test", "test@example.com") is False
+
+def test_clone_branch_and_push(repo, tmp_path):
+    """Test cloning, branching and pushing a branch back to the origin."""
+    clone(str(repo), 'copy', cwd=tmp_path)
+    copy = tmp_path / 'copy'
+    create_branch(copy, 'feature')
+    assert current_branch(copy) == 'feature'
+    (copy / "new.txt").write_text("change\n")
+    assert commit_all(copy, "change", "test", "test@example.com") is True
+    push_branch(copy, str(repo), 'feature')
+    branches = run_git(['branch', '--list', 'feature'], cwd=repo).stdout
+    assert 'feature' in branches
+
+def test_parallel_branches(repo, tmp_path):
+    """Test several repositories can be worked on from different threads at once."""
+    errors = []
+
+    def work(i):
+        try:
+            name = f'copy{i}'
+            clone(str(repo), name, cwd=tmp_path)
+            create_branch(tmp_path / name, f'agent-{i}')
+            assert current_branch(tmp_path / name) == f'agent-{i}'
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
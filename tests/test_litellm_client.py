@@ -1,9 +1,12 @@
 import pytest
 import json
 import os
-from unittest.mock import patch, MagicMock
+import asyncio
+import threading
+from unittest.mock import patch, MagicMock, AsyncMock
 from pathlib import Path
 from litellm_client import LiteLLMClient
+from llm_dispatch import LLMDispatcher
 
 @pytest.fixture
 def mock_env_file(tmp_path):
@@ -41,6 +44,31 @@ def test_init_with_env_file(mock_env_file, mock_env_vars):
     client = LiteLLMClient()
     assert client.api_key == "test_key_123"
 
+def test_rate_limit_defaults(mock_env_vars):
+    """Test the dispatcher uses the default rate limit when nothing is configured."""
+    with patch('database.get_config', return_value=None), \
+         patch.dict(os.environ, {'LLM_RATE_PER_SECOND': '', 'LLM_BURST': ''}):
+        client = LiteLLMClient()
+    assert client.dispatcher.rate_per_second == 5.0
+    assert client.dispatcher.burst == 10
+
+def test_rate_limit_from_config_and_env(mock_env_vars):
+    """Test config overrides the environment, which overrides the defaults."""
+    config = {'llm_rate_per_second': '50'}
+    with patch('database.get_config', side_effect=config.get), \
+         patch.dict(os.environ, {'LLM_RATE_PER_SECOND': '20', 'LLM_BURST': '40'}):
+        client = LiteLLMClient()
+    assert client.dispatcher.rate_per_second == 50.0
+    assert client.dispatcher.burst == 40.0
+
+def test_invalid_rate_limit_ignored(mock_env_vars):
+    """Test unusable rate limit settings fall back to the defaults."""
+    config = {'llm_rate_per_second': 'fast', 'llm_burst': '0'}
+    with patch('database.get_config', side_effect=config.get):
+        client = LiteLLMClient()
+    assert client.dispatcher.rate_per_second == 5.0
+    assert client.dispatcher.burst == 10
+
 def test_init_without_env_file():
     """Test client initialization without .env file."""
     with patch.dict(os.environ, clear=True):
@@ -162,3 +190,272 @@ def test_chat_completion_with_non_json_response(mock_get_config, mock_completion
         assert "error" in error_response
     except json.JSONDecodeError:
         pytest.fail("Result should be valid JSON")
+
+@patch('litellm_client.completion')
+@patch('database.get_model_config')
+def test_chat_completion_uses_cache(mock_get_config, mock_completion, client, mock_model_config):
+    """Test identical requests from an agent are answered from the cache."""
+    mock_get_config.return_value = mock_model_config
+    mock_response = MagicMock()
+    mock_response.choices = [
+        MagicMock(message=MagicMock(content='{"result": "cached"}'))
+    ]
+    mock_completion.return_value = mock_response
+
+    first = client.chat_completion("system", "same logs", model_type="agent", agent_id="agent1")
+    second = client.chat_completion("system", "same logs", model_type="agent", agent_id="agent1")
+    assert first == second
+    mock_completion.assert_called_once()
+    assert client.cache_stats()['hits'] == 1
+
+    # A different agent with the same logs still gets its own decision
+    client.chat_completion("system", "same logs", model_type="agent", agent_id="agent2")
+    assert mock_completion.call_count == 2
+
+@patch('litellm_client.completion')
+@patch('database.get_model_config')
+def test_chat_completion_errors_not_cached(mock_get_config, mock_completion, client, mock_model_config):
+    """Test failed requests are retried instead of served from the cache."""
+    mock_get_config.return_value = mock_model_config
+    mock_completion.side_effect = Exception("Test error")
+    client.chat_completion("system", "logs")
+    client.chat_completion("system", "logs")
+    assert mock_completion.call_count == 2
+
+
+def make_response(content):
+    response = MagicMock()
+    response.choices = [MagicMock(message=MagicMock(content=content))]
+    return response
+
+@patch('database.get_model_config')
+def test_achat_completion_success(mock_get_config, client, mock_model_config):
+    """Test the async client returns the stripped response content."""
+    mock_get_config.return_value = mock_model_config
+    with patch('litellm_client.acompletion', AsyncMock(return_value=make_response('```json\n{"a": 1}\n```'))) as mock_acompletion:
+        result = asyncio.run(client.achat_completion("system", "user", model_type="agent", agent_id="agent1"))
+    assert json.loads(result) == {"a": 1}
+    assert mock_acompletion.call_args[1]['timeout'] == client.request_timeout
+
+@patch('database.get_model_config')
+def test_achat_completion_limits_concurrency_per_model(mock_get_config, mock_env_vars, mock_model_config):
+    """Test no more than the per-model limit of requests are in flight at once."""
+    mock_get_config.return_value = mock_model_config
+    client = LiteLLMClient(max_concurrency_per_model=2)
+    in_flight = 0
+    peak = 0
+
+    async def fake_acompletion(**kwargs):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return make_response('{"ok": true}')
+
+    async def run_all():
+        return await asyncio.gather(*[
+            client.achat_completion("system", f"user {i}", agent_id=i) for i in range(6)
+        ])
+
+    with patch('litellm_client.acompletion', fake_acompletion):
+        results = asyncio.run(run_all())
+    assert len(results) == 6
+    assert peak == 2
+
+@patch('database.get_model_config')
+def test_sync_and_async_requests_share_model_limit(mock_get_config, mock_env_vars, mock_model_config):
+    """Test a thread's request and an async request to one model count against the same limit."""
+    mock_get_config.return_value = mock_model_config
+    client = LiteLLMClient(max_concurrency_per_model=1)
+    entered = threading.Event()
+    release = threading.Event()
+    async_started = threading.Event()
+
+    def fake_completion(**kwargs):
+        entered.set()
+        release.wait(2)
+        return make_response('{"sync": true}')
+
+    async def fake_acompletion(**kwargs):
+        async_started.set()
+        return make_response('{"async": true}')
+
+    with patch('litellm_client.completion', fake_completion), \
+            patch('litellm_client.acompletion', fake_acompletion):
+        sync_call = threading.Thread(target=client.chat_completion, args=("system", "sync"))
+        sync_call.start()
+        assert entered.wait(2)
+        future = client.submit_chat_completion("system", "async")
+        assert not async_started.wait(0.2)
+        release.set()
+        assert json.loads(future.result(2)) == {'async': True}
+        sync_call.join(2)
+
+@patch('database.get_model_config')
+def test_async_request_keeps_database_calls_off_the_loop(mock_get_config, mock_env_vars, mock_model_config):
+    """Test config, cache and usage lookups of async requests do not run on the event loop thread."""
+    threads = []
+
+    def on_thread(result):
+        def call(*args, **kwargs):
+            threads.append(threading.current_thread().name)
+            return result
+        return call
+
+    mock_get_config.side_effect = on_thread(mock_model_config)
+    client = LiteLLMClient()
+    client.response_cache.get = on_thread(None)
+    client.response_cache.put = on_thread(None)
+
+    async def fake_acompletion(**kwargs):
+        return make_response('{"ok": true}')
+
+    with patch('litellm_client.acompletion', fake_acompletion), patch('database.record_usage', on_thread(True)):
+        assert json.loads(client.submit_chat_completion("system", "user").result(2)) == {'ok': True}
+    assert len(threads) == 4
+    assert 'llm-client-loop' not in threads
+
+@patch('database.get_model_config')
+def test_achat_completion_timeout(mock_get_config, mock_env_vars, mock_model_config):
+    """Test a request that outlives the timeout returns an error response."""
+    mock_get_config.return_value = mock_model_config
+    client = LiteLLMClient(request_timeout=0.05, dispatcher=LLMDispatcher(max_retries=0))
+
+    async def slow_acompletion(**kwargs):
+        await asyncio.sleep(5)
+
+    with patch('litellm_client.acompletion', slow_acompletion):
+        result = client.submit_chat_completion("system", "user").result(timeout=2)
+    assert json.loads(result)['error'] == 'TimeoutError'
+
+@patch('database.get_model_config')
+def test_achat_completion_cancellation(mock_get_config, client, mock_model_config):
+    """Test cancelling a submitted request cancels the underlying call."""
+    mock_get_config.return_value = mock_model_config
+    started = threading.Event()
+    cancelled = threading.Event()
+
+    async def hanging_acompletion(**kwargs):
+        started.set()
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    with patch('litellm_client.acompletion', hanging_acompletion):
+        future = client.submit_chat_completion("system", "user")
+        assert started.wait(2)
+        future.cancel()
+        assert cancelled.wait(2)
+
+@patch('litellm_client.completion')
+@patch('database.get_model_config')
+def test_static_prompt_prefix_marked_for_caching(mock_get_config, mock_completion, client):
+    """Test models that need it get the static system prompt prefix as a cacheable block."""
+    from prompts import AIDER_STATIC_PROMPT
+    mock_completion.return_value = make_response('{"ok": true}')
+    system_message = AIDER_STATIC_PROMPT + "The overall goal is: test"
+
+    mock_get_config.return_value = {'agent_model': 'openrouter/anthropic/claude-3.5-sonnet'}
+    client.chat_completion(system_message, "logs", model_type="agent")
+    content = mock_completion.call_args[1]['messages'][0]['content']
+    assert content[0] == {"type": "text", "text": AIDER_STATIC_PROMPT, "cache_control": {"type": "ephemeral"}}
+    assert content[1]['text'] == "The overall goal is: test"
+
+    mock_get_config.return_value = {'agent_model': 'openrouter/google/gemini-flash-1.5'}
+    client.chat_completion(system_message, "other logs", model_type="agent")
+    assert mock_completion.call_args[1]['messages'][0]['content'] == system_message
+
+def make_stream(content, size=5):
+    for i in range(0, len(content), size):
+        yield MagicMock(choices=[MagicMock(delta=MagicMock(content=content[i:i + size]))])
+
+@patch('litellm_client.completion')
+@patch('database.get_model_config')
+def test_stream_chat_completion_reports_fields_early(mock_get_config, mock_completion, client, mock_model_config):
+    """Test fields are delivered while streaming and the full content is returned and cached."""
+    mock_get_config.return_value = mock_model_config
+    content = '{"thought": "t", "action": "/ls", "future": "f"}'
+
+    def stream(**kwargs):
+        assert kwargs['stream'] is True
+        yield from make_stream(content)
+
+    mock_completion.side_effect = stream
+    fields = []
+    result = client.stream_chat_completion("system", "logs", on_field=lambda name, value: fields.append((name, value)))
+    assert result == content
+    assert fields == [('thought', 't'), ('action', '/ls'), ('future', 'f')]
+
+    # Cached responses report their fields too
+    fields.clear()
+    assert client.stream_chat_completion("system", "logs", on_field=lambda name, value: fields.append(name)) == content
+    mock_completion.assert_called_once()
+    assert fields == ['thought', 'action', 'future']
+
+@patch('litellm_client.completion')
+@patch('database.get_model_config')
+def test_stream_not_retried_after_fields_delivered(mock_get_config, mock_completion, client, mock_model_config):
+    """Test a stream that fails after delivering a field returns an error instead of retrying."""
+    mock_get_config.return_value = mock_model_config
+
+    def broken_stream(**kwargs):
+        yield from make_stream('{"action": "/ls", ', size=100)
+        raise TimeoutError()
+
+    mock_completion.side_effect = broken_stream
+    result = client.stream_chat_completion("system", "logs", on_field=lambda name, value: None)
+    assert 'error' in json.loads(result)
+    mock_completion.assert_called_once()
+
+@patch('database.record_usage')
+@patch('litellm_client.completion')
+@patch('database.get_model_config')
+def test_usage_recorded(mock_get_config, mock_completion, mock_record_usage, client, mock_model_config):
+    """Test token counts and cost reported with a response are recorded for the agent."""
+    mock_get_config.return_value = mock_model_config
+    response = make_response('{"ok": true}')
+    response.usage = MagicMock(prompt_tokens=120, completion_tokens=30)
+    response._hidden_params = {'response_cost': 0.002}
+    mock_completion.return_value = response
+    client.chat_completion("system", "logs", model_type="agent", agent_id="agent1")
+
+    args = mock_record_usage.call_args[0]
+    assert args[:6] == ('agent1', 'openrouter/google/gemini-flash-1.5', 'agent', 120, 30, 0.002)
+
+    # Cache hits cost nothing and are not recorded again
+    client.chat_completion("system", "logs", model_type="agent", agent_id="agent1")
+    mock_record_usage.assert_called_once()
+
+@patch('database.record_usage')
+@patch('litellm_client.completion')
+@patch('database.get_model_config')
+def test_usage_without_agent_recorded_as_null(mock_get_config, mock_completion, mock_record_usage, client,
+                                              mock_model_config):
+    """Test a request made for no agent is not recorded under the agent ID "None"."""
+    mock_get_config.return_value = mock_model_config
+    mock_completion.return_value = make_response('{"ok": true}')
+    client.chat_completion("system", "logs", agent_id=None)
+    assert mock_record_usage.call_args[0][0] is None
+
+@patch('database.record_usage')
+@patch('litellm_client.completion')
+@patch('database.get_model_config')
+def test_batched_usage_split_across_agents(mock_get_config, mock_completion, mock_record_usage, client,
+                                           mock_model_config):
+    """Test a request made for several agents charges each of them a share."""
+    mock_get_config.return_value = mock_model_config
+    response = make_response('{"decisions": {}}')
+    response.usage = MagicMock(prompt_tokens=100, completion_tokens=31)
+    response._hidden_params = {'response_cost': 0.003}
+    mock_completion.return_value = response
+    client.chat_completion("system", "logs", model_type="agent", agent_id="batch",
+                           usage_agent_ids=['agent1', 'agent2', 'agent3'])
+
+    calls = [call.args for call in mock_record_usage.call_args_list]
+    assert [args[0] for args in calls] == ['agent1', 'agent2', 'agent3']
+    assert [args[3] for args in calls] == [34, 33, 33]
+    assert [args[4] for args in calls] == [11, 10, 10]
+    assert sum(args[5] for args in calls) == pytest.approx(0.003)
@@ -0,0 +1,58 @@
+import pytest
+from unittest.mock import patch
+from llm_cache import ResponseCache
+
+@pytest.fixture
+def cache():
+    """Create a small in-memory response cache."""
+    return ResponseCache(max_entries=2, ttl_seconds=60)
+
+def test_key_depends_on_every_part():
+    """Test keys differ when any part of the request differs."""
+    key = ResponseCache.make_key('model', 'system', 'user', scope='agent1')
+    assert key == ResponseCache.make_key('model', 'system', 'user', scope='agent1')
+    assert key != ResponseCache.make_key('other', 'system', 'user', scope='agent1')
+    assert key != ResponseCache.make_key('model', 'system', 'user', scope='agent2')
+    assert key != ResponseCache.make_key('model', 'systemuser', '', scope='agent1')
+
+def test_hit_and_miss_counts(cache):
+    """Test lookups are counted as hits or misses."""
+    assert cache.get('key') is None
+    cache.put('key', 'response')
+    assert cache.get('key') == 'response'
+    stats = cache.stats()
+    assert stats['hits'] == 1
+    assert stats['misses'] == 1
+    assert stats['hit_rate'] == 0.5
+
+def test_lru_eviction(cache):
+    """Test the least recently used entry is evicted first."""
+    cache.put('a', '1')
+    cache.put('b', '2')
+    cache.get('a')
+    cache.put('c', '3')
+    assert cache.get('b') is None
+    assert cache.get('a') == '1'
+    assert cache.get('c') == '3'
+
+def test_ttl_expiry(cache):
+    """Test entries expire after the TTL."""
+    with patch('llm_cache.time.monotonic', return_value=100.0):
+        cache.put('key', 'response')
+    with patch('llm_cache.time.monotonic', return_value=161.0):
+        assert cache.get('key') is None
+    assert cache.stats()['entries'] == 0
+
+def test_persisted_entries(tmp_path):
+    """Test persisted entries are found by a fresh cache."""
+    import database
+    original_path = database.DATABASE_PATH
+    database.DATABASE_PATH = tmp_path / "cache.db"
+    try:
+        database.init_db()
+        ResponseCache(persist=True).put('key', 'response')
+        fresh = ResponseCache(persist=True)
+        assert fresh.get('key') == 'response'
+        assert fresh.stats()['hits'] == 1
+    finally:
+        database.DATABASE_PATH = original_path
@@ -0,0 +1,110 @@
+import asyncio
+import pytest
+from unittest.mock import patch, MagicMock
+from llm_dispatch import (
+    LLMDispatcher, TokenBucket, CircuitBreaker, CircuitOpenError, is_retryable, retry_after
+)
+
+class ThrottledError(Exception):
+    """Stand-in for a provider 429 with optional Retry-After header."""
+    def __init__(self, retry_after_header=None):
+        super().__init__('rate limited')
+        self.status_code = 429
+        self.response = MagicMock(headers={'retry-after': retry_after_header} if retry_after_header else {})
+
+@pytest.fixture
+def dispatcher():
+    """Create a dispatcher that retries without real delays."""
+    return LLMDispatcher(max_retries=2, base_delay=0, rate_per_second=1000, burst=1000,
+                         failure_threshold=3, reset_timeout=60)
+
+def test_is_retryable():
+    """Test throttling, timeouts and server errors are retryable but client errors are not."""
+    assert is_retryable(ThrottledError())
+    assert is_retryable(TimeoutError())
+    assert is_retryable(MagicMock(status_code=503, spec=['status_code']))
+    assert not is_retryable(MagicMock(status_code=400, spec=['status_code']))
+    assert not is_retryable(ValueError('bad request'))
+
+def test_retry_after_parsing():
+    """Test Retry-After headers in seconds are read from the error response."""
+    assert retry_after(ThrottledError('3')) == 3.0
+    assert retry_after(ThrottledError()) is None
+
+def test_retries_transient_errors(dispatcher):
+    """Test transient errors are retried until the call succeeds."""
+    fn = MagicMock(side_effect=[ThrottledError(), ThrottledError(), 'ok'])
+    with patch('llm_dispatch.time.sleep'):
+        assert dispatcher.call('model', fn) == 'ok'
+    assert fn.call_count == 3
+
+def test_gives_up_after_max_retries(dispatcher):
+    """Test the last error is raised once retries are exhausted."""
+    fn = MagicMock(side_effect=ThrottledError())
+    with patch('llm_dispatch.time.sleep'):
+        with pytest.raises(ThrottledError):
+            dispatcher.call('model', fn)
+    assert fn.call_count == 3
+
+def test_non_retryable_errors_raise_immediately(dispatcher):
+    """Test errors that retrying cannot fix are not retried."""
+    fn = MagicMock(side_effect=ValueError('bad request'))
+    with pytest.raises(ValueError):
+        dispatcher.call('model', fn)
+    fn.assert_called_once()
+    assert dispatcher.breaker('model').failures == 0
+
+def test_honours_retry_after(dispatcher):
+    """Test the wait before a retry is at least what the server asked for."""
+    fn = MagicMock(side_effect=[ThrottledError('7'), 'ok'])
+    with patch('llm_dispatch.time.sleep') as mock_sleep:
+        dispatcher.call('model', fn)
+    assert max(call.args[0] for call in mock_sleep.call_args_list) >= 7
+
+def test_circuit_opens_after_repeated_failures(dispatcher):
+    """Test calls fail fast once a model's circuit is open."""
+    fn = MagicMock(side_effect=ThrottledError())
+    with patch('llm_dispatch.time.sleep'):
+        with pytest.raises(ThrottledError):
+            dispatcher.call('model', fn)
+        with pytest.raises(CircuitOpenError):
+            dispatcher.call('model', fn)
+    assert fn.call_count == 3
+    # Other models are unaffected
+    assert dispatcher.call('other', lambda: 'ok') == 'ok'
+
+def test_circuit_half_open_trial():
+    """Test one trial call is let through after the cooldown and closes the circuit on success."""
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+    with patch('llm_dispatch.time.monotonic', return_value=100):
+        breaker.record_failure()
+        assert breaker.state == 'open'
+    with patch('llm_dispatch.time.monotonic', return_value=111):
+        assert breaker.state == 'half_open'
+        breaker.before_call('model')
+        with pytest.raises(CircuitOpenError):
+            breaker.before_call('model')
+        breaker.record_success()
+        assert breaker.state == 'closed'
+
+def test_token_bucket_spaces_out_requests():
+    """Test requests beyond the burst are told to wait for a token."""
+    with patch('llm_dispatch.time.monotonic', return_value=0):
+        bucket = TokenBucket(rate=2, capacity=2)
+        assert bucket.reserve() == 0
+        assert bucket.reserve() == 0
+        assert bucket.reserve() == pytest.approx(0.5)
+        assert bucket.reserve() == pytest.approx(1.0)
+
+def test_acall_retries(dispatcher):
+    """Test the async path retries transient errors too."""
+    attempts = []
+
+    async def fn():
+        attempts.append(1)
+        if len(attempts) < 2:
+            raise ThrottledError()
+        return 'ok'
+
+    assert asyncio.run(dispatcher.acall('model', fn)) == 'ok'
+    assert len(attempts) == 2
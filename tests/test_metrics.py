@@ -0,0 +1,66 @@
+import pytest
+from metrics import MetricsRegistry, Counter, Gauge, Histogram
+
+@pytest.fixture
+def registry():
+    """Create a registry separate from the process-wide one."""
+    return MetricsRegistry()
+
+def test_counter_renders_with_labels(registry):
+    """Test labelled counters render one _total sample per label combination."""
+    errors = Counter('llm_errors', 'Failed requests', ('model', 'error'), registry=registry)
+    errors.labels(model='gpt', error='Timeout').inc()
+    errors.labels(model='gpt', error='Timeout').inc(2)
+    text = registry.render()
+    assert '# TYPE llm_errors counter' in text
+    assert 'llm_errors_total{model="gpt",error="Timeout"} 3' in text
+
+def test_unlabelled_metrics_render_before_use(registry):
+    """Test metrics without labels show up at zero before anything is recorded."""
+    Counter('sweeps', 'Sweeps run', registry=registry)
+    assert 'sweeps_total 0' in registry.render()
+
+def test_histogram_buckets_are_cumulative(registry):
+    """Test histogram buckets count every observation at or below their bound."""
+    latency = Histogram('latency_seconds', 'Latency', buckets=(0.1, 1.0), registry=registry)
+    for value in (0.05, 0.5, 0.5, 5):
+        latency.observe(value)
+    text = registry.render()
+    assert 'latency_seconds_bucket{le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{le="1"} 3' in text
+    assert 'latency_seconds_bucket{le="+Inf"} 4' in text
+    assert 'latency_seconds_sum 6.05' in text
+    assert 'latency_seconds_count 4' in text
+
+def test_timed_decorator_labels_by_function(registry):
+    """Test the timed decorator records calls under the function's name."""
+    queries = Histogram('query_seconds', 'Query time', ('function',), registry=registry)
+
+    @queries.timed('function')
+    def get_agent():
+        return 'agent'
+
+    assert get_agent() == 'agent'
+    assert get_agent.__name__ == 'get_agent'
+    assert 'query_seconds_count{function="get_agent"} 1' in registry.render()
+
+def test_callback_gauge_is_read_at_scrape(registry):
+    """Test gauges with collect report the values current at render time."""
+    sizes = {'a1': 10}
+    Gauge('buffer_chars', 'Buffer size', ('agent_id',), registry=registry,
+          collect=lambda: (({'agent_id': k}, v) for k, v in sizes.items()))
+    assert 'buffer_chars{agent_id="a1"} 10' in registry.render()
+    sizes['a1'] = 25
+    assert 'buffer_chars{agent_id="a1"} 25' in registry.render()
+
+def test_label_values_are_escaped(registry):
+    """Test quotes, backslashes and newlines in label values are escaped."""
+    counter = Counter('events', 'Events', ('name',), registry=registry)
+    counter.labels(name='a"b\\c\nd').inc()
+    assert 'events_total{name="a\\"b\\\\c\\nd"} 1' in registry.render()
+
+def test_duplicate_names_rejected(registry):
+    """Test registering two metrics with the same name fails."""
+    Counter('dup', 'First', registry=registry)
+    with pytest.raises(ValueError):
+        Gauge('dup', 'Second', registry=registry)
@@ -0,0 +1,80 @@
+import asyncio
+import json
+import os
+import random
+from pathlib import Path
+from unittest.mock import patch
+import pytest
+from mock_llm import MockLLMProvider, parse_latency, provider_from_env
+from prompts import PROMPT_AIDER, PROMPT_AIDER_BATCH, PROMPT_SUMMARY
+
+def messages(system, user):
+    return [{"role": "system", "content": system}, {"role": "user", "content": user}]
+
+def test_parse_latency():
+    """Test fixed, uniform and lognormal latency specs."""
+    rng = random.Random(0)
+    assert parse_latency('0.25')(rng) == 0.25
+    assert parse_latency(None)(rng) == 0
+    assert 0.1 <= parse_latency('uniform:0.1,0.5')(rng) <= 0.5
+    assert parse_latency('lognormal:0.3,0.5')(rng) > 0
+    with pytest.raises(ValueError):
+        parse_latency('gamma:1,2')
+
+def test_decisions_are_deterministic():
+    """Test the same seed and requests give the same decisions."""
+    request = messages(PROMPT_AIDER('Fix the bug'), 'aider output')
+    first = [MockLLMProvider(seed=1).respond(request, i) for i in range(5)]
+    second = [MockLLMProvider(seed=1).respond(request, i) for i in range(5)]
+    assert first == second
+    decision = json.loads(first[0])
+    assert set(decision) == {'progress', 'thought', 'action', 'future'}
+
+def test_batch_response_has_a_decision_per_session():
+    """Test batched prompts get one decision keyed by each session ID."""
+    user = "### Session a1\nGoal: x\nLatest output:\n...\n\n### Session b2\nGoal: y\nLatest output:\n..."
+    response = json.loads(MockLLMProvider().respond(messages(PROMPT_AIDER_BATCH(), user)))
+    assert set(response['decisions']) == {'a1', 'b2'}
+    assert 'action' in response['decisions']['a1']
+
+def test_summary_response():
+    """Test summary prompts get a summary object."""
+    response = json.loads(MockLLMProvider().respond(messages(PROMPT_SUMMARY(), 'line 1\nline 2')))
+    assert 'summary' in response
+
+def test_script_is_replayed_in_order(tmp_path):
+    """Test scripted responses are used in order and then cycled."""
+    script = tmp_path / 'script.jsonl'
+    script.write_text('{"action": "/ls"}\n{"action": "/map"}\n')
+    with patch.dict(os.environ, {'MOCK_LLM_SCRIPT': str(script)}):
+        provider = MockLLMProvider.from_env()
+    request = messages('system', 'user')
+    contents = [provider.completion(request).choices[0].message.content for _ in range(3)]
+    assert [json.loads(c)['action'] for c in contents] == ['/ls', '/map', '/ls']
+
+def test_streamed_chunks_rebuild_the_response():
+    """Test streaming yields content chunks followed by usage."""
+    provider = MockLLMProvider(chunk_size=5)
+    request = messages(PROMPT_AIDER('Task'), 'output')
+    chunks = list(provider.completion(request, stream=True))
+    text = ''.join(c.choices[0].delta.content for c in chunks if c.choices)
+    assert json.loads(text) == json.loads(MockLLMProvider(chunk_size=5).respond(request, 0))
+    assert chunks[-1].usage.completion_tokens > 0
+
+def test_async_completion():
+    """Test the async completion returns the same shape as the sync one."""
+    response = asyncio.run(MockLLMProvider().acompletion(messages(PROMPT_AIDER('Task'), 'output')))
+    assert 'action' in json.loads(response.choices[0].message.content)
+    assert response.usage.prompt_tokens > 0
+
+def test_client_uses_mock_provider_without_api_key():
+    """Test LLM_PROVIDER=mock needs no API key and makes no network calls."""
+    from litellm_client import LiteLLMClient
+    with patch.dict(os.environ, {'LLM_PROVIDER': 'mock'}, clear=True):
+        with patch('pathlib.Path.home', return_value=Path('/nonexistent')):
+            assert isinstance(provider_from_env(), MockLLMProvider)
+            client = LiteLLMClient()
+    with patch('litellm_client.completion') as mock_completion:
+        response = client.chat_completion(PROMPT_AIDER('Task'), 'aider output', model_type='agent')
+    mock_completion.assert_not_called()
+    assert 'action' in json.loads(response)
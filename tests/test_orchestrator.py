@@ -17,6 +17,12 @@ from orchestrator import (
     cloneRepository,
     get_github_token,
     update_agent_output,
+    get_max_concurrent_agents,
+    run_sweep,
+    load_tasks_since,
+    build_agent_context,
+    process_agent_step,
+    process_agent_batch,
     main_loop
 )
 from pull_request import PullRequestManager
@@ -39,8 +45,9 @@ def test_load_tasks(mock_get_config, mock_get_agents, mock_get_tasks):
         "repository_url": 'https://github.com/test/repo'
     }
 
+@patch('orchestrator.clone_from_mirror', return_value=False)
 @patch('orchestrator.subprocess.run')
-def test_clone_repository_exception(mock_subprocess_run):
+def test_clone_repository_exception(mock_subprocess_run, mock_clone_from_mirror):
     """Test cloneRepository exception handling."""
     mock_subprocess_run.side_effect = subprocess.CalledProcessError(1, 'git clone')
     result = cloneRepository('test_url')
@@ -86,8 +93,8 @@ def test_delete_agent_not_found(mock_load_tasks):
     assert result is False
 
 @patch('orchestrator.save_config')
-@patch('orchestrator.save_agent')
-def test_save_tasks(mock_save_agent, mock_save_config):
+@patch('orchestrator.save_agents')
+def test_save_tasks(mock_save_agents, mock_save_config):
     """Test save_tasks normal operation."""
     tasks_data = {
         'repository_url': 'https://github.com/test/repo',
@@ -97,16 +104,26 @@ def test_save_tasks(mock_save_agent, mock_save_config):
     }
     save_tasks(tasks_data)
     mock_save_config.assert_called_once_with('repository_url', 'https://github.com/test/repo')
-    mock_save_agent.assert_called_once_with('agent1', {'status': 'pending'})
+    mock_save_agents.assert_called_once_with({'agent1': {'status': 'pending'}})
 
+@patch('orchestrator.clone_from_mirror', return_value=False)
 @patch('orchestrator.subprocess.run')
-def test_clone_repository_success(mock_subprocess_run):
+def test_clone_repository_success(mock_subprocess_run, mock_clone_from_mirror):
     """Test successful repository cloning."""
     mock_subprocess_run.return_value = MagicMock(returncode=0)
     result = cloneRepository('https://github.com/test/repo')
     assert result is True
     mock_subprocess_run.assert_called_once()
 
+@patch('orchestrator.clone_from_mirror', return_value=True)
+@patch('orchestrator.subprocess.run')
+def test_clone_repository_uses_mirror(mock_subprocess_run, mock_clone_from_mirror):
+    """Test cloning goes through the local mirror and skips the network clone."""
+    result = cloneRepository('https://github.com/test/repo.git')
+    assert result is True
+    mock_clone_from_mirror.assert_called_once_with('https://github.com/test/repo.git', 'repo', cwd=None)
+    mock_subprocess_run.assert_not_called()
+
 @patch('orchestrator.Github')
 @patch('orchestrator.load_dotenv')
 def test_get_github_token_success(mock_load_dotenv, mock_github):
@@ -121,11 +138,9 @@ def test_get_github_token_success(mock_load_dotenv, mock_github):
 @patch('orchestrator.cloneRepository')
 @patch('orchestrator.os.path.exists')
 @patch('orchestrator.os.path.isdir')
-@patch('orchestrator.subprocess.check_call')
-@patch('orchestrator.os.chdir')  # Add this to mock directory changes
+@patch('orchestrator.create_branch')
 def test_initialiseCodingAgent_success(
-    mock_chdir,
-    mock_check_call,
+    mock_create_branch,
     mock_isdir,
     mock_exists,
     mock_clone,
@@ -139,8 +154,6 @@ def test_initialiseCodingAgent_success(
     mock_agent_session.return_value.start.return_value = True
     mock_exists.return_value = True
     mock_isdir.return_value = True
-    mock_check_call.return_value = 0
-    mock_chdir.return_value = None  # Mock successful directory change
 
     # Mock database operations
     with patch('orchestrator.save_tasks') as mock_save_tasks:
@@ -156,7 +169,8 @@ def test_initialiseCodingAgent_success(
             assert len(result) == 1
             assert isinstance(result[0], str)
             mock_clone.assert_called_once()
-            mock_check_call.assert_called()
+            mock_create_branch.assert_called_once()
+            assert mock_create_branch.call_args[0][1] == f"agent-{result[0][:8]}"
             mock_save_tasks.assert_called()
 
 @patch('orchestrator.load_tasks')
@@ -192,7 +206,7 @@ def test_update_agent_output_success(mock_load_tasks):
     }
     
     with patch.dict('orchestrator.aider_sessions', {
-        'test_agent': MagicMock(get_output=lambda: 'test output')
+        'test_agent': MagicMock(output_window=lambda: ('test output', 0))
     }):
         result = update_agent_output('test_agent')
         assert result is True
@@ -203,3 +217,253 @@ def test_update_agent_output_no_agent(mock_load_tasks):
     mock_load_tasks.return_value = {'agents': {}}
     result = update_agent_output('non_existent_agent')
     assert result is False
+
+@patch('orchestrator.get_config')
+def test_get_max_concurrent_agents(mock_get_config):
+    """Test concurrency limit comes from config with a safe default."""
+    mock_get_config.return_value = '3'
+    assert get_max_concurrent_agents() == 3
+    mock_get_config.return_value = None
+    assert get_max_concurrent_agents() == 8
+    mock_get_config.return_value = 'invalid'
+    assert get_max_concurrent_agents() == 8
+
+@patch('orchestrator.save_agents')
+@patch('orchestrator.load_tasks')
+def test_run_sweep_schedules_idle_agents(mock_load_tasks, mock_save_agents):
+    """Test run_sweep refreshes output and schedules only idle agents."""
+    mock_load_tasks.return_value = {
+        'agents': {
+            'idle_agent': {'aider_output': ''},
+            'busy_agent': {'aider_output': ''},
+            'done_agent': {'pr_url': 'https://github.com/test/repo/pull/1'},
+            'no_session_agent': {}
+        }
+    }
+    scheduler = MagicMock()
+    scheduler.is_busy.side_effect = lambda agent_id: agent_id == 'busy_agent'
+    sessions = {
+        'idle_agent': MagicMock(output_window=lambda: ('new output', 4), output_cursor=lambda: 14),
+        'busy_agent': MagicMock(output_window=lambda: ('new output', 4), output_cursor=lambda: 14),
+        'done_agent': MagicMock()
+    }
+    with patch.dict('orchestrator.aider_sessions', sessions, clear=True), \
+            patch.dict('orchestrator.output_cursors', {}, clear=True):
+        run_sweep(scheduler, MagicMock(), MagicMock())
+
+    scheduler.submit.assert_called_once()
+    assert scheduler.submit.call_args[0][0] == 'idle_agent'
+    mock_save_agents.assert_called_once()
+    saved = mock_save_agents.call_args[0][0]
+    assert list(saved) == ['idle_agent']
+    assert saved['idle_agent']['aider_output'] == 'new output'
+    assert saved['idle_agent']['output_offset'] == 4
+
+@patch('orchestrator.save_agents')
+@patch('orchestrator.load_tasks')
+def test_run_sweep_skips_unchanged_output(mock_load_tasks, mock_save_agents):
+    """Test run_sweep does not save output when the session cursor has not moved."""
+    mock_load_tasks.return_value = {'agents': {'idle_agent': {'aider_output': 'old output'}}}
+    scheduler = MagicMock()
+    scheduler.is_busy.return_value = False
+    session = MagicMock(output_cursor=lambda: 10)
+    with patch.dict('orchestrator.aider_sessions', {'idle_agent': session}, clear=True), \
+            patch.dict('orchestrator.output_cursors', {'idle_agent': 10}, clear=True):
+        run_sweep(scheduler, MagicMock(), MagicMock())
+
+    session.output_window.assert_not_called()
+    mock_save_agents.assert_not_called()
+    scheduler.submit.assert_called_once()
+
+@patch('orchestrator.get_config')
+@patch('orchestrator.get_agent_ids')
+@patch('orchestrator.get_agents_since')
+@patch('orchestrator.get_all_tasks')
+def test_load_tasks_since(mock_get_all_tasks, mock_get_agents_since, mock_get_agent_ids, mock_get_config):
+    """Test loading only agents changed after a state version."""
+    mock_get_all_tasks.return_value = []
+    mock_get_agents_since.return_value = {'agent1': {'status': 'pending'}}
+    mock_get_agent_ids.return_value = ['agent1', 'agent2']
+    mock_get_config.return_value = 'https://github.com/test/repo'
+    tasks_data = load_tasks_since(5)
+    mock_get_agents_since.assert_called_once_with(5)
+    assert tasks_data['agents'] == {'agent1': {'status': 'pending'}}
+    assert tasks_data['agent_ids'] == ['agent1', 'agent2']
+    assert tasks_data['repository_url'] == 'https://github.com/test/repo'
+
+@patch('orchestrator.get_model_config')
+def test_build_agent_context_summarizes_with_orchestrator_model(mock_get_model_config):
+    """Test older output is summarized and the budget comes from the model config."""
+    mock_get_model_config.return_value = {'context_token_budget': 100}
+    session = MagicMock()
+    session.output_window.return_value = ('line\n' * 400, 0)
+    client = MagicMock()
+    client.chat_completion.return_value = json.dumps({'summary': 'earlier work'})
+    with patch.dict('orchestrator.context_builders', {}, clear=True):
+        context = build_agent_context('agent1', session, client)
+
+    assert context.startswith('[Summary of earlier output]\nearlier work')
+    assert len(context) < 100 * 4 + 100
+    assert client.chat_completion.call_args[1]['model_type'] == 'orchestrator'
+
+@patch('orchestrator.publish_agent_state')
+@patch('orchestrator.save_agents')
+@patch('orchestrator.build_agent_context', return_value='logs')
+@patch('orchestrator.PROMPT_AIDER', return_value='system')
+def test_process_agent_step_dispatches_action_while_streaming(mock_prompt, mock_context, mock_save_agents,
+                                                              mock_publish_state):
+    """Test the action is sent as soon as it streams in and is not sent again afterwards."""
+    session = MagicMock(task='task')
+    session.is_ready.return_value = True
+    session.send_message.return_value = True
+    response = {'progress': 'p', 'thought': 't', 'action': '/instruct add tests', 'future': 'f'}
+    sent_before_done = []
+
+    def stream(system, logs, model_type, agent_id, on_field):
+        for name, value in response.items():
+            on_field(name, value)
+            if name == 'action':
+                sent_before_done.append(session.send_message.called)
+        return json.dumps(response)
+
+    client = MagicMock()
+    client.stream_chat_completion.side_effect = stream
+    processor = MagicMock()
+    processor.process_response.return_value = 'add tests'
+    with patch.dict('orchestrator.aider_sessions', {'agent1': session}, clear=True), \
+            patch.dict('orchestrator.prompt_processors', {'agent1': processor}, clear=True):
+        process_agent_step('agent1', {}, client, MagicMock())
+
+    assert sent_before_done == [True]
+    session.send_message.assert_called_once_with('add tests', 'instruct')
+
+@pytest.mark.parametrize('tail', [
+    json.dumps({'error': 'stream interrupted', 'model': 'm', 'model_type': 'agent'}),
+    '{"progress": "p", "thought": "t", "action": "/ls", "fut',
+])
+@patch('orchestrator.publish_agent_state')
+@patch('orchestrator.save_agents')
+@patch('orchestrator.build_agent_context', return_value='logs')
+@patch('orchestrator.PROMPT_AIDER', return_value='system')
+def test_process_agent_step_keeps_early_action_when_response_fails(mock_prompt, mock_context, mock_save_agents,
+                                                                   mock_publish_state, tail):
+    """Test an action sent while streaming is saved, not resent, when the rest of the response fails."""
+    from prompt_processor import PromptProcessor
+    session = MagicMock(task='task')
+    session.is_ready.return_value = True
+    session.send_message.return_value = True
+
+    def stream(system, logs, model_type, agent_id, on_field):
+        on_field('action', '/ls')
+        return tail
+
+    client = MagicMock()
+    client.stream_chat_completion.side_effect = stream
+    processor = PromptProcessor()
+    agent_data = {'last_action': '/add old.py'}
+    with patch.dict('orchestrator.aider_sessions', {'agent1': session}, clear=True), \
+            patch.dict('orchestrator.prompt_processors', {'agent1': processor}, clear=True):
+        process_agent_step('agent1', agent_data, client, MagicMock())
+
+    session.send_message.assert_called_once_with('/ls', 'instruct')
+    assert agent_data['last_action'] == '/ls'
+    assert '/ls' in agent_data['thought_history'][-1]['content']
+    mock_save_agents.assert_called_once_with({'agent1': agent_data})
+    mock_publish_state.assert_called_once()
+    assert processor.get_agent_state('agent1')['last_action'] == '/ls'
+    assert [r.action for r in processor.get_response_history('agent1')] == ['/ls']
+
+@patch('orchestrator.apply_agent_decision')
+@patch('orchestrator.build_agent_context')
+@patch('orchestrator.PROMPT_AIDER', return_value='system')
+def test_process_agent_step_uses_prepared_context(mock_prompt, mock_context, mock_apply):
+    """Test a step given a batch's context neither checks readiness nor rebuilds the context."""
+    session = MagicMock(task='task')
+    client = MagicMock()
+    client.stream_chat_completion.return_value = '{}'
+    with patch.dict('orchestrator.aider_sessions', {'agent1': session}, clear=True):
+        process_agent_step('agent1', {}, client, MagicMock(), session_logs='batch logs')
+
+    session.is_ready.assert_not_called()
+    mock_context.assert_not_called()
+    assert client.stream_chat_completion.call_args[0][1] == 'batch logs'
+    mock_apply.assert_called_once()
+
+@patch('orchestrator.publish_agent_state')
+@patch('orchestrator.save_agents')
+@patch('orchestrator.build_agent_context', return_value='logs')
+@patch('orchestrator.PROMPT_AIDER', return_value='system')
+def test_process_agent_step_records_trace(mock_prompt, mock_context, mock_save_agents, mock_publish_state):
+    """Test each step is traced with its readiness check and decision handling as child spans."""
+    from prompt_processor import PromptProcessor
+    from tracing import tracer
+    session = MagicMock(task='task')
+    session.is_ready.return_value = True
+    client = MagicMock()
+    client.stream_chat_completion.return_value = json.dumps(
+        {'progress': 'p', 'thought': 't', 'action': '/ls', 'future': 'f'})
+    tracer.clear()
+    with patch.dict('orchestrator.aider_sessions', {'agent1': session}, clear=True), \
+            patch.dict('orchestrator.prompt_processors', {'agent1': PromptProcessor()}, clear=True):
+        process_agent_step('agent1', {}, client, MagicMock())
+
+    [trace] = tracer.traces(agent_id='agent1')
+    assert trace.root.name == 'agent_step'
+    names = [span.name for span in trace.spans]
+    assert names[:2] == ['agent_step', 'is_ready']
+    assert 'process_response' in names
+    assert all(span.end_ns >= span.start_ns for span in trace.spans)
+
+@patch('orchestrator.save_agents')
+@patch('orchestrator.load_tasks')
+def test_run_sweep_batches_idle_agents(mock_load_tasks, mock_save_agents):
+    """Test idle agents are grouped into batched steps when batching is on."""
+    mock_load_tasks.return_value = {'agents': {f'agent{i}': {} for i in range(5)}}
+    scheduler = MagicMock()
+    scheduler.is_busy.return_value = False
+    sessions = {f'agent{i}': MagicMock(output_cursor=lambda: 0) for i in range(5)}
+    with patch.dict('orchestrator.aider_sessions', sessions, clear=True), \
+            patch.dict('orchestrator.output_cursors', {f'agent{i}': 0 for i in range(5)}, clear=True):
+        run_sweep(scheduler, MagicMock(), MagicMock(), batch_size=2)
+
+    scheduler.submit.assert_not_called()
+    groups = [call.args[0] for call in scheduler.submit_group.call_args_list]
+    assert groups == [['agent0', 'agent1'], ['agent2', 'agent3'], ['agent4']]
+    assert scheduler.submit_group.call_args_list[0].args[1] is process_agent_batch
+
+@patch('orchestrator.process_agent_step')
+@patch('orchestrator.apply_agent_decision')
+@patch('orchestrator.build_agent_context', side_effect=lambda agent_id, session, client: f'logs of {agent_id}')
+@patch('orchestrator.PROMPT_AIDER_BATCH', return_value='batch system')
+def test_process_agent_batch_demultiplexes_decisions(mock_prompt, mock_context, mock_apply, mock_step):
+    """Test one request decides for several agents and missing decisions fall back to single steps."""
+    sessions = {f'agent{i}': MagicMock(task=f'task {i}') for i in range(3)}
+    decision = {'progress': 'p', 'thought': 't', 'action': '/ls', 'future': 'f'}
+    client = MagicMock()
+    client.chat_completion.return_value = json.dumps({'decisions': {'agent0': decision, 'agent1': decision}})
+    agents = [(agent_id, {}) for agent_id in sessions]
+    with patch.dict('orchestrator.aider_sessions', sessions, clear=True):
+        process_agent_batch(agents, client, MagicMock())
+
+    client.chat_completion.assert_called_once()
+    user_message = client.chat_completion.call_args[0][1]
+    assert 'Session agent2' in user_message and 'logs of agent2' in user_message and 'task 2' in user_message
+    assert [call.args[0] for call in mock_apply.call_args_list] == ['agent0', 'agent1']
+    assert json.loads(mock_apply.call_args_list[0].args[3]) == decision
+    assert client.chat_completion.call_args[1]['usage_agent_ids'] == ['agent0', 'agent1', 'agent2']
+    mock_step.assert_called_once()
+    assert mock_step.call_args[0][0] == 'agent2'
+    assert mock_step.call_args[1]['session_logs'] == 'logs of agent2'
+    assert mock_context.call_count == 3
+
+def test_second_import_keeps_metrics_registered():
+    """Test loading the module again, as running it as a script does, keeps the first gauges."""
+    import importlib.util
+    import orchestrator
+    from metrics import registry
+    gauge = registry.get('agent_output_buffer_chars')
+    spec = importlib.util.spec_from_file_location('orchestrator_as_script', orchestrator.__file__)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    assert registry.get('agent_output_buffer_chars') is gauge
+    assert gauge.collect is orchestrator._output_buffer_sizes
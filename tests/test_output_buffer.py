@@ -0,0 +1,92 @@
+import pytest
+from output_buffer import OutputBuffer
+
+@pytest.fixture
+def buffer():
+    """Create a small output buffer for testing."""
+    return OutputBuffer(max_length=20)
+
+def test_write_and_getvalue(buffer):
+    """Test writing text and reading it back."""
+    assert buffer.write("line one\n") == 9
+    buffer.write("line two\n")
+    assert buffer.getvalue() == "line one\nline two\n"
+    assert buffer.tell() == 18
+
+def test_buffer_is_bounded(buffer):
+    """Test the oldest lines are dropped once max_length is exceeded."""
+    for i in range(10):
+        buffer.write(f"line {i}\n")
+    value = buffer.getvalue()
+    assert len(value) <= 20
+    assert value.endswith("line 9\n")
+    assert "line 0" not in value
+    assert buffer.tell() == 70
+    assert buffer.start == 70 - len(value)
+
+def test_long_line_keeps_tail(buffer):
+    """Test a single line longer than max_length keeps its tail."""
+    buffer.write("x" * 30 + "end\n")
+    value = buffer.getvalue()
+    assert len(value) == 20
+    assert value.endswith("end\n")
+
+def test_read_since(buffer):
+    """Test incremental reads with cursors."""
+    buffer.write("first\n")
+    text, cursor = buffer.read_since(0)
+    assert text == "first\n"
+    
+    buffer.write("second\n")
+    text, cursor = buffer.read_since(cursor)
+    assert text == "second\n"
+    
+    # Nothing new
+    text, cursor = buffer.read_since(cursor)
+    assert text == ""
+    assert cursor == buffer.tell()
+    
+    # Cursor in the middle of a line
+    text, _ = buffer.read_since(3)
+    assert text == "st\nsecond\n"
+
+def test_read_since_dropped_cursor(buffer):
+    """Test a cursor older than the window starts at the oldest retained text."""
+    buffer.write("a" * 15 + "\n")
+    buffer.write("b" * 15 + "\n")
+    text, cursor = buffer.read_since(0)
+    assert text == buffer.getvalue()
+    assert cursor == 32
+
+def test_read_window(buffer):
+    """Test the retained output is returned with the offset it starts at."""
+    for i in range(10):
+        buffer.write(f"line {i}\n")
+    text, start = buffer.read_window()
+    assert text == buffer.getvalue()
+    assert start == buffer.start
+    assert start + len(text) == buffer.tell()
+
+def test_on_write_listener():
+    """Test the write listener sees each chunk with its offsets."""
+    chunks = []
+    buffer = OutputBuffer(max_length=20, on_write=lambda *chunk: chunks.append(chunk))
+    buffer.write("one\n")
+    buffer.write("two\n")
+    assert chunks == [("one\n", 0, 4), ("two\n", 4, 8)]
+
+def test_transcript_keeps_full_history(tmp_path):
+    """Test output dropped from memory is still in the transcript."""
+    transcript = tmp_path / "transcript.log"
+    buffer = OutputBuffer(max_length=10, transcript_path=transcript)
+    for i in range(5):
+        buffer.write(f"line {i}\n")
+    assert "line 0" not in buffer.getvalue()
+    assert buffer.read_transcript() == "".join(f"line {i}\n" for i in range(5))
+    buffer.close()
+    assert transcript.read_text().startswith("line 0")
+
+def test_read_transcript_without_file(buffer):
+    """Test read_transcript falls back to the in-memory window."""
+    buffer.write("only in memory\n")
+    assert buffer.read_transcript() == "only in memory\n"
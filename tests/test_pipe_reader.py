@@ -0,0 +1,135 @@
+import os
+import sys
+import threading
+import time
+import pytest
+from pipe_reader import PipeReader
+
+pytestmark = pytest.mark.skipif(not PipeReader.supported(), reason="pipes cannot be selected on Windows")
+
+class Collector:
+    """Collects lines delivered by the reader."""
+    def __init__(self):
+        self.lines = []
+        self.changed = threading.Event()
+
+    def __call__(self, line):
+        self.lines.append(line)
+        self.changed.set()
+
+    def wait_for(self, count, timeout=2.0):
+        deadline = time.monotonic() + timeout
+        while len(self.lines) < count and time.monotonic() < deadline:
+            self.changed.wait(0.05)
+            self.changed.clear()
+        return self.lines
+
+@pytest.fixture
+def reader():
+    return PipeReader()
+
+@pytest.fixture
+def pipe():
+    read_fd, write_fd = os.pipe()
+    read_end = os.fdopen(read_fd, 'r')
+    yield read_end, write_fd
+    for close in (read_end.close, lambda: os.close(write_fd)):
+        try:
+            close()
+        except OSError:
+            pass
+
+def test_lines_are_split_across_reads(reader, pipe):
+    """Test partial lines and \\r\\n split between writes come out as whole lines."""
+    read_end, write_fd = pipe
+    lines = Collector()
+    assert reader.register(read_end, lines)
+    os.write(write_fd, b'first li')
+    os.write(write_fd, b'ne\r')
+    os.write(write_fd, b'\nsecond\n> \n')
+    assert lines.wait_for(3) == ['first line\n', 'second\n', '> \n']
+
+def test_remaining_output_delivered_at_eof(reader, pipe):
+    """Test output without a final newline is handed on when the pipe closes."""
+    read_end, write_fd = pipe
+    lines = Collector()
+    reader.register(read_end, lines)
+    os.write(write_fd, 'café done'.encode('utf-8'))
+    os.close(write_fd)
+    assert lines.wait_for(1) == ['café done']
+    deadline = time.monotonic() + 2
+    while reader.pipe_count() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert reader.pipe_count() == 0
+
+def test_unfinished_line_passed_to_on_tail(reader, pipe):
+    """Test a prompt without a newline reaches on_tail before its line completes."""
+    read_end, write_fd = pipe
+    lines = Collector()
+    tails = Collector()
+    reader.register(read_end, lines, tails)
+    os.write(write_fd, b'done\n> ')
+    assert lines.wait_for(1) == ['done\n']
+    assert tails.wait_for(1) == ['> ']
+    os.write(write_fd, b'/ls\n')
+    assert lines.wait_for(2) == ['done\n', '> /ls\n']
+
+def test_one_thread_serves_many_pipes(reader):
+    """Test several pipes are read by the same reader thread."""
+    pipes = [os.pipe() for _ in range(5)]
+    collectors = [Collector() for _ in pipes]
+    threads = set()
+    for (read_fd, write_fd), collector in zip(pipes, collectors):
+        def on_line(line, collector=collector):
+            threads.add(threading.current_thread().name)
+            collector(line)
+        reader.register(os.fdopen(read_fd, 'r'), on_line)
+    for i, (_, write_fd) in enumerate(pipes):
+        os.write(write_fd, f'agent {i}\n'.encode())
+    for i, collector in enumerate(collectors):
+        assert collector.wait_for(1) == [f'agent {i}\n']
+    assert threads == {'aider-pipe-reader'}
+    for _, write_fd in pipes:
+        os.close(write_fd)
+
+def test_unregistered_pipe_is_not_read(reader, pipe):
+    """Test no lines are delivered after a pipe is unregistered."""
+    read_end, write_fd = pipe
+    lines = Collector()
+    reader.register(read_end, lines)
+    os.write(write_fd, b'before\n')
+    lines.wait_for(1)
+    reader.unregister(read_end)
+    os.write(write_fd, b'after\n')
+    time.sleep(0.2)
+    assert lines.lines == ['before\n']
+
+def test_stale_entry_for_reused_descriptor_is_not_read(reader, pipe):
+    """Test a pipe reusing an old descriptor does not deliver to the old callback."""
+    read_end, write_fd = pipe
+    old, new = Collector(), Collector()
+    reader.register(read_end, old)
+    os.write(write_fd, b'old\n')
+    old.wait_for(1)
+    stale = reader._entries[read_end.fileno()]
+    reader.unregister(read_end)
+    reader.register(read_end, new)
+    # Park the reader thread in another pipe's callback so only the stale entry reads
+    busy_read, busy_write = os.pipe()
+    entered, release = threading.Event(), threading.Event()
+    reader.register(os.fdopen(busy_read, 'r'), lambda line: (entered.set(), release.wait(2)))
+    os.write(busy_write, b'busy\n')
+    assert entered.wait(2)
+    os.write(write_fd, b'for the new session\n')
+    reader._read(stale)
+    release.set()
+    assert new.wait_for(1) == ['for the new session\n']
+    assert old.lines == ['old\n']
+    os.close(busy_write)
+
+def test_unselectable_pipe_is_refused(reader):
+    """Test objects without a real file descriptor are refused so callers can fall back to threads."""
+    class FakePipe:
+        def fileno(self):
+            raise OSError("no descriptor")
+    assert reader.register(FakePipe(), print) is False
@@ -171,4 +171,13 @@ def test_response_history_limit(processor):
     assert len(history) == 100
     # Should have the last 100 responses (10-109)
     assert history[0].progress == 'Progress 10'
-    assert history[-1].progress == 'Progress 109'
\ No newline at end of file
+    assert history[-1].progress == 'Progress 109'
+
+def test_record_action_without_response(processor):
+    """Test an action sent without a usable response is kept in state and history."""
+    processor.record_action('test_agent', '/ls')
+    state = processor.get_agent_state('test_agent')
+    assert state['last_action'] == '/ls'
+    assert state['progress'] == 'Not started'
+    history = processor.get_response_history('test_agent')
+    assert [r.action for r in history] == ['/ls']
@@ -0,0 +1,50 @@
+import pytest
+from unittest.mock import patch
+from prompts import PROMPT_AIDER, PROMPT_AIDER_BATCH, PROMPT_PR, AIDER_STATIC_PROMPT, prompt_registry, _compile_aider_prompt
+
+@pytest.fixture(autouse=True)
+def clear_prompt_cache():
+    """Start each test with an empty compiled prompt cache."""
+    _compile_aider_prompt.cache_clear()
+    yield
+    _compile_aider_prompt.cache_clear()
+
+@patch('database.get_model_config')
+def test_aider_prompt_contains_goal_and_suffix(mock_get_config):
+    """Test the compiled prompt is the static prefix followed by the goal and suffix."""
+    mock_get_config.return_value = {'aider_prompt_suffix': 'Use tabs.'}
+    prompt = PROMPT_AIDER('Fix the bug')
+    assert prompt.startswith(AIDER_STATIC_PROMPT)
+    assert 'The overall goal is: Fix the bug' in prompt
+    assert '\nUse tabs.\n' in prompt
+
+@patch('database.get_model_config')
+def test_aider_prompt_is_memoized_per_task_and_suffix(mock_get_config):
+    """Test repeated prompts are served from the cache until the task or suffix changes."""
+    mock_get_config.return_value = {'aider_prompt_suffix': ''}
+    first = PROMPT_AIDER('task')
+    assert PROMPT_AIDER('task') is first
+    assert prompt_registry.cache_info()['hits'] == 1
+
+    mock_get_config.return_value = {'aider_prompt_suffix': 'new'}
+    assert PROMPT_AIDER('task') != first
+    assert prompt_registry.cache_info()['misses'] == 2
+
+def test_split_static_prefix():
+    """Test prompts are split into their registered static prefix and the rest."""
+    static, dynamic = prompt_registry.split(AIDER_STATIC_PROMPT + 'The overall goal is: x')
+    assert static == AIDER_STATIC_PROMPT
+    assert dynamic == 'The overall goal is: x'
+    assert prompt_registry.split('unregistered prompt') == ('', 'unregistered prompt')
+
+def test_name_of_longest_matching_prefix():
+    """Test a prompt is named after the longest registered prefix it starts with."""
+    assert prompt_registry.name_of(AIDER_STATIC_PROMPT + 'The overall goal is: x') == 'aider'
+    assert prompt_registry.name_of(PROMPT_AIDER_BATCH()) == 'aider_batch'
+    assert prompt_registry.name_of('unregistered prompt') is None
+
+def test_token_counts():
+    """Test every registered template reports a token estimate."""
+    counts = prompt_registry.token_counts()
+    assert set(counts) >= {'aider', 'pr', 'summary'}
+    assert counts['pr'] == pytest.approx(len(PROMPT_PR()) / 4, abs=1)
@@ -0,0 +1,47 @@
+import threading
+import pytest
+from provisioning import ProvisioningPool
+
+@pytest.fixture
+def pool():
+    """Create a provisioning pool and shut it down after the test."""
+    pool = ProvisioningPool(max_workers=4)
+    yield pool
+    pool.shutdown()
+
+def test_agents_provision_in_parallel(pool):
+    """Test every agent in a job is provisioned concurrently."""
+    barrier = threading.Barrier(3, timeout=2)
+
+    def provision(agent_id, task_description):
+        barrier.wait()
+        return agent_id
+
+    job = pool.submit(provision, [
+        {'agent_id': f'agent{i}', 'task_description': 'task'} for i in range(3)
+    ])
+    assert job['done'] is False
+    assert pool.wait(job['id'], 5) is True
+    job = pool.get(job['id'])
+    assert job['ready'] == 3
+    assert not barrier.broken
+
+def test_failed_and_raising_agents(pool):
+    """Test failures and exceptions are recorded per agent."""
+    def provision(agent_id, task_description):
+        if agent_id == 'boom':
+            raise RuntimeError("clone failed")
+        return agent_id if agent_id == 'ok' else None
+
+    job = pool.submit(provision, [
+        {'agent_id': name, 'task_description': 'task'} for name in ('ok', 'none', 'boom')
+    ])
+    assert pool.wait(job['id'], 5) is True
+    agents = {agent['agent_id']: agent for agent in pool.get(job['id'])['agents']}
+    assert agents['ok']['status'] == 'ready'
+    assert agents['none']['status'] == 'failed'
+    assert agents['boom']['error'] == 'clone failed'
+
+def test_unknown_job(pool):
+    """Test an unknown job has no status."""
+    assert pool.get('missing') is None
@@ -0,0 +1,58 @@
+import os
+from unittest.mock import patch
+import recorder
+from recorder import SessionRecorder, get_recorder, read_recording
+
+def test_round_trip(tmp_path):
+    """Test recorded output, LLM exchanges and actions are read back in order."""
+    path = tmp_path / 'session.jsonl'
+    rec = SessionRecorder(str(path))
+    rec.record_output('a1', 'hello\n')
+    rec.record_llm('a1', 'agent', 'model-x', 'system prompt', 'user message', '{"action": "/ls"}', 120)
+    rec.record_action('a1', '/ls')
+    rec.close()
+    events = list(read_recording(str(path)))
+    assert [e['kind'] for e in events] == ['output', 'llm', 'action']
+    assert events[1]['system'] == 'system prompt'
+    assert events[1]['latency_ms'] == 120
+    assert events[2]['command'] == '/ls'
+
+def test_system_prompt_written_once(tmp_path):
+    """Test a repeated system prompt is stored once and referenced by hash."""
+    path = tmp_path / 'session.jsonl'
+    rec = SessionRecorder(str(path))
+    for agent_id in ('a1', 'a2'):
+        rec.record_llm(agent_id, 'agent', 'model-x', 'long system prompt', 'user', '{}', 10)
+    rec.close()
+    assert path.read_text().count('long system prompt') == 1
+    assert [e['system'] for e in read_recording(str(path))] == ['long system prompt'] * 2
+
+def test_event_without_agent_has_null_agent(tmp_path):
+    """Test events of sessions without an agent ID are stored with a null agent."""
+    path = tmp_path / 'session.jsonl'
+    rec = SessionRecorder(str(path))
+    rec.record_output(None, 'hello\n')
+    rec.close()
+    assert [e['agent'] for e in read_recording(str(path))] == [None]
+
+def test_truncated_line_is_skipped(tmp_path):
+    """Test a half-written last line does not stop the rest being read."""
+    path = tmp_path / 'session.jsonl'
+    rec = SessionRecorder(str(path))
+    rec.record_action('a1', '/ls')
+    rec.close()
+    with open(path, 'a') as f:
+        f.write('{"t": 1, "kind": "outp')
+    assert [e['kind'] for e in read_recording(str(path))] == ['action']
+
+def test_get_recorder_follows_env(tmp_path):
+    """Test recording is off unless ORCHESTRATOR_RECORD names a file."""
+    path = tmp_path / 'session.jsonl'
+    with patch.dict(os.environ, {}, clear=True):
+        assert get_recorder() is None
+    with patch.dict(os.environ, {'ORCHESTRATOR_RECORD': str(path)}):
+        rec = get_recorder()
+        assert rec is get_recorder()
+        assert rec.path == str(path)
+    rec.close()
+    recorder._recorder = None
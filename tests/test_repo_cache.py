@@ -0,0 +1,66 @@
+import shutil
+import subprocess
+import pytest
+import repo_cache
+from repo_cache import mirror_path, ensure_mirror, clone_from_mirror
+
+def git(*args, cwd=None):
+    subprocess.run(['git', *args], cwd=cwd, check=True, capture_output=True)
+
+@pytest.fixture
+def mirror_root(tmp_path, monkeypatch):
+    """Keep mirrors in a temporary directory."""
+    root = tmp_path / "mirrors"
+    monkeypatch.setattr(repo_cache, 'MIRROR_ROOT', root)
+    monkeypatch.setattr(repo_cache, '_last_fetch', {})
+    return root
+
+@pytest.fixture
+def upstream(tmp_path):
+    """Create a local repository to act as the remote."""
+    repo = tmp_path / "upstream"
+    repo.mkdir()
+    git('init', '--quiet', cwd=repo)
+    (repo / "README.md").write_text("hello\n")
+    git('add', 'README.md', cwd=repo)
+    git('-c', 'user.name=test', '-c', 'user.email=test@example.com', 'commit', '--quiet', '-m', 'init', cwd=repo)
+    return repo
+
+def test_mirror_path_is_stable_per_url(mirror_root):
+    """Test each URL maps to its own named mirror directory."""
+    first = mirror_path('https://github.com/test/repo.git')
+    assert first == mirror_path('https://github.com/test/repo.git')
+    assert first.name.startswith('repo-')
+    assert first != mirror_path('https://github.com/other/repo.git')
+
+def test_ensure_mirror_creates_and_reuses(mirror_root, upstream):
+    """Test the mirror is cloned once and reused while fresh."""
+    path = ensure_mirror(str(upstream))
+    assert path and (path / 'HEAD').exists()
+    assert ensure_mirror(str(upstream)) == path
+
+def test_ensure_mirror_failure(mirror_root, tmp_path):
+    """Test a repository that cannot be cloned gives no mirror."""
+    assert ensure_mirror(str(tmp_path / "missing")) is None
+
+def test_clone_from_mirror(mirror_root, upstream, tmp_path):
+    """Test clones come from the mirror but push to the real remote."""
+    workdir = tmp_path / "work"
+    workdir.mkdir()
+    assert clone_from_mirror(str(upstream), 'upstream', cwd=str(workdir)) is True
+    clone = workdir / "upstream"
+    assert (clone / "README.md").read_text() == "hello\n"
+    origin = subprocess.run(['git', 'remote', 'get-url', 'origin'], cwd=clone, capture_output=True, text=True)
+    assert origin.stdout.strip() == str(upstream)
+
+def test_clone_survives_mirror_removal(mirror_root, upstream, tmp_path):
+    """Test a clone keeps its own objects when the mirror is deleted."""
+    workdir = tmp_path / "work"
+    workdir.mkdir()
+    assert clone_from_mirror(str(upstream), 'upstream', cwd=str(workdir)) is True
+    clone = workdir / "upstream"
+    assert not (clone / ".git" / "objects" / "info" / "alternates").exists()
+    shutil.rmtree(mirror_root)
+    log = subprocess.run(['git', 'log', '--oneline'], cwd=clone, capture_output=True, text=True)
+    assert log.returncode == 0
+    assert 'init' in log.stdout
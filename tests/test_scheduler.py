@@ -0,0 +1,68 @@
+import threading
+import time
+import pytest
+from scheduler import AgentScheduler
+
+@pytest.fixture
+def scheduler():
+    """Create a scheduler and shut it down after the test."""
+    scheduler = AgentScheduler(max_workers=4)
+    yield scheduler
+    scheduler.shutdown()
+
+def test_submit_runs_step(scheduler):
+    """Test a submitted step runs and releases the agent."""
+    done = threading.Event()
+    assert scheduler.submit('agent1', done.set) is True
+    assert done.wait(1)
+    assert scheduler.wait(1) is True
+    assert scheduler.is_busy('agent1') is False
+
+def test_submit_skips_busy_agent(scheduler):
+    """Test an agent cannot have two steps in flight."""
+    release = threading.Event()
+    assert scheduler.submit('agent1', release.wait, 1) is True
+    assert scheduler.is_busy('agent1') is True
+    assert scheduler.submit('agent1', release.wait, 1) is False
+    assert scheduler.in_flight_count() == 1
+    release.set()
+    assert scheduler.wait(1) is True
+    assert scheduler.in_flight_count() == 0
+
+def test_steps_run_concurrently(scheduler):
+    """Test steps for different agents overlap instead of running serially."""
+    barrier = threading.Barrier(4, timeout=1)
+    for i in range(4):
+        scheduler.submit(f'agent{i}', barrier.wait)
+    assert scheduler.wait(2) is True
+    assert not barrier.broken
+
+def test_failed_step_releases_agent(scheduler):
+    """Test an exception in a step does not leave the agent busy."""
+    def fail():
+        raise RuntimeError("step failed")
+    scheduler.submit('agent1', fail)
+    assert scheduler.wait(1) is True
+    assert scheduler.is_busy('agent1') is False
+
+def test_resize(scheduler):
+    """Test the concurrency limit can be changed while steps run."""
+    release = threading.Event()
+    scheduler.submit('agent1', release.wait, 1)
+    scheduler.resize(2)
+    assert scheduler.max_workers == 2
+    assert scheduler.submit('agent2', time.sleep, 0) is True
+    release.set()
+    assert scheduler.wait(1) is True
+
+def test_submit_group_marks_every_agent_busy(scheduler):
+    """Test a grouped step keeps all its agents busy until it finishes."""
+    release = threading.Event()
+    assert scheduler.submit_group(['agent1', 'agent2'], release.wait, 1) is True
+    assert scheduler.is_busy('agent1') and scheduler.is_busy('agent2')
+    assert scheduler.submit('agent2', time.sleep, 0) is False
+    assert scheduler.submit_group(['agent2', 'agent3'], time.sleep, 0) is False
+    assert scheduler.is_busy('agent3') is False
+    release.set()
+    assert scheduler.wait(1) is True
+    assert scheduler.in_flight_count() == 0
@@ -0,0 +1,39 @@
+import json
+from stream_parser import JSONFieldStream
+
+RESPONSE = json.dumps({
+    'progress': 'Listed files',
+    'thought': 'Need "context"\nfirst',
+    'action': '/add main.py',
+    'future': 'Edit main.py'
+})
+
+def test_fields_complete_in_order_as_chunks_arrive():
+    """Test each field is reported by the chunk that completes it."""
+    parser = JSONFieldStream()
+    seen = []
+    for ch in RESPONSE:
+        seen.extend(parser.feed(ch).items())
+    assert [name for name, _ in seen] == ['progress', 'thought', 'action', 'future']
+    assert parser.fields == json.loads(RESPONSE)
+    assert parser.done
+
+def test_action_available_before_future():
+    """Test the action is extracted before the rest of the response has arrived."""
+    parser = JSONFieldStream()
+    cut = RESPONSE.index('"future"')
+    assert parser.feed(RESPONSE[:cut]).get('action') == '/add main.py'
+    assert 'future' not in parser.fields
+
+def test_ignores_code_fence_and_nested_values():
+    """Test text before the object and nested values do not produce fields."""
+    parser = JSONFieldStream()
+    completed = parser.feed('```json\n{"meta": {"action": "nested"}, "tags": ["a", "b"], "action": "/ls"}\n```')
+    assert completed == {'action': '/ls'}
+
+def test_escaped_characters_are_decoded():
+    """Test escape sequences split across chunks are decoded."""
+    parser = JSONFieldStream()
+    parser.feed('{"action": "/instruct say \\')
+    completed = parser.feed('"hi\\" \\u00e9"}')
+    assert completed == {'action': '/instruct say "hi" é'}
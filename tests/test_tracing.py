@@ -0,0 +1,92 @@
+import pytest
+from tracing import Tracer, to_chrome, to_otlp
+
+@pytest.fixture
+def tracer():
+    """Create a tracer with a small ring buffer."""
+    return Tracer(max_traces=3)
+
+def test_spans_nest_under_the_current_span(tracer):
+    """Test spans opened inside a trace become children of the innermost open span."""
+    with tracer.trace('agent_step', agent_id='a1') as root:
+        with tracer.span('chat_completion') as llm:
+            with tracer.span('send_message') as send:
+                pass
+        with tracer.span('save_agents') as save:
+            pass
+    [trace] = tracer.traces()
+    assert trace.spans == [root, llm, send, save]
+    assert llm.parent_id == root.span_id
+    assert send.parent_id == llm.span_id
+    assert save.parent_id == root.span_id
+    assert {span.trace_id for span in trace.spans} == {root.trace_id}
+
+def test_spans_outside_a_trace_are_not_recorded(tracer):
+    """Test span() and traced() do nothing when no trace is active."""
+    calls = []
+
+    @tracer.traced()
+    def save_agents():
+        calls.append(1)
+        return True
+
+    with tracer.span('orphan') as span:
+        assert span is None
+    assert save_agents() is True
+    assert calls == [1]
+    assert tracer.traces() == []
+
+def test_traced_decorator_names_span_after_function(tracer):
+    """Test traced() records a span named after the wrapped function."""
+    @tracer.traced()
+    def get_agent():
+        return 'agent'
+
+    with tracer.trace('agent_step'):
+        assert get_agent() == 'agent'
+    assert [span.name for span in tracer.traces()[0].spans] == ['agent_step', 'get_agent']
+
+def test_nested_trace_becomes_a_span(tracer):
+    """Test starting a trace inside another one adds a child span instead."""
+    with tracer.trace('agent_batch', agent_ids=['a1', 'a2']):
+        with tracer.trace('agent_step', agent_id='a1'):
+            pass
+    [trace] = tracer.traces()
+    assert [span.name for span in trace.spans] == ['agent_batch', 'agent_step']
+    assert len(tracer.traces(agent_id='a2')) == 1
+
+def test_errors_are_recorded_and_raised(tracer):
+    """Test an exception marks the span with the error and still propagates."""
+    with pytest.raises(ValueError):
+        with tracer.trace('agent_step'):
+            with tracer.span('chat_completion'):
+                raise ValueError('boom')
+    spans = tracer.traces()[0].spans
+    assert spans[1].error == 'ValueError: boom'
+    assert to_otlp(tracer.traces())['resourceSpans'][0]['scopeSpans'][0]['spans'][1]['status']['code'] == 2
+
+def test_ring_buffer_keeps_latest_traces(tracer):
+    """Test only the most recent traces are kept and can be filtered by agent."""
+    for i in range(5):
+        with tracer.trace('agent_step', agent_id=f'a{i}'):
+            pass
+    assert [t.root.attributes['agent_id'] for t in tracer.traces()] == ['a2', 'a3', 'a4']
+    assert len(tracer.traces(agent_id='a4')) == 1
+    assert len(tracer.traces(limit=1)) == 1
+
+def test_record_span_with_explicit_times(tracer):
+    """Test finished spans can be added with times measured before the trace started."""
+    with tracer.trace('agent_step', start_ns=1000):
+        tracer.record_span('is_ready', 1000, 3000)
+    root, ready = tracer.traces()[0].spans
+    assert root.start_ns == 1000
+    assert (ready.start_ns, ready.end_ns, ready.parent_id) == (1000, 3000, root.span_id)
+
+def test_chrome_export(tracer):
+    """Test Chrome trace events carry microsecond timings and span attributes."""
+    with tracer.trace('agent_step', start_ns=2_000_000, agent_id='a1'):
+        tracer.record_span('is_ready', 2_000_000, 5_000_000)
+    events = to_chrome(tracer.traces())['traceEvents']
+    ready = events[1]
+    assert (ready['name'], ready['ph'], ready['ts'], ready['dur']) == ('is_ready', 'X', 2000, 3000)
+    assert events[0]['args']['agent_id'] == 'a1'
@@ -0,0 +1,196 @@
+import contextvars
+import functools
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+DEFAULT_MAX_TRACES = 200  # Finished traces kept in the ring buffer
+SERVICE_NAME = '100x-orchestrator'
+
+class Span:
+    """One timed operation within a trace"""
+    __slots__ = ('name', 'trace_id', 'span_id', 'parent_id', 'start_ns', 'end_ns', 'attributes', 'thread_id', 'error')
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attributes: Dict,
+                 start_ns: Optional[int] = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.start_ns = start_ns if start_ns is not None else time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes
+        self.thread_id = threading.get_ident()
+        self.error = None
+
+class Trace:
+    """The spans of one agent step, root first"""
+
+    def __init__(self, root: Span):
+        self.root = root
+        self.spans: List[Span] = [root]
+        self._lock = threading.Lock()
+
+    def add(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+class Tracer:
+    """Records span trees for agent steps into a ring buffer of recent traces
+
+    trace() starts a root span; span() and traced() record children of the
+    current span and do nothing outside a trace, so instrumented code that
+    also runs outside agent steps, such as database calls from the web app,
+    costs one context lookup there.
+    """
+
+    def __init__(self, max_traces: int = DEFAULT_MAX_TRACES):
+        self._current = contextvars.ContextVar('current_span', default=None)
+        self._traces = deque(maxlen=max_traces)
+
+    def current_span(self) -> Optional[Span]:
+        current = self._current.get()
+        return current[1] if current else None
+
+    @contextmanager
+    def trace(self, name: str, start_ns: Optional[int] = None, **attributes):
+        """Start a new trace whose root span covers the block; inside a trace this is just a span"""
+        if self._current.get() is not None:
+            with self.span(name, **attributes) as child:
+                yield child
+            return
+        root = Span(name, f"{random.getrandbits(128):032x}", None, attributes, start_ns)
+        trace = Trace(root)
+        token = self._current.set((trace, root))
+        try:
+            yield root
+        except BaseException as e:
+            root.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            root.end_ns = time.time_ns()
+            self._current.reset(token)
+            self._traces.append(trace)
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """Record the block as a child of the current span, if there is one"""
+        current = self._current.get()
+        if current is None:
+            yield None
+            return
+        trace, parent = current
+        span = Span(name, trace.root.trace_id, parent.span_id, attributes)
+        trace.add(span)
+        token = self._current.set((trace, span))
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span.end_ns = time.time_ns()
+            self._current.reset(token)
+
+    def record_span(self, name: str, start_ns: int, end_ns: int, **attributes) -> None:
+        """Add an already finished child span to the current span"""
+        current = self._current.get()
+        if current is None:
+            return
+        trace, parent = current
+        span = Span(name, trace.root.trace_id, parent.span_id, attributes, start_ns)
+        span.end_ns = end_ns
+        trace.add(span)
+
+    def traced(self, name: Optional[str] = None):
+        """Decorator recording each call as a span named after the function"""
+        def decorator(fn):
+            span_name = name or fn.__name__
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if self._current.get() is None:
+                    return fn(*args, **kwargs)
+                with self.span(span_name):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def traces(self, agent_id: Optional[str] = None, limit: Optional[int] = None) -> List[Trace]:
+        """Finished traces, oldest first, optionally only those of one agent"""
+        traces = list(self._traces)
+        if agent_id is not None:
+            traces = [t for t in traces if agent_id in _agent_ids(t.root)]
+        if limit is not None:
+            traces = traces[-limit:] if limit > 0 else []
+        return traces
+
+    def clear(self) -> None:
+        self._traces.clear()
+
+def _agent_ids(span: Span) -> List[str]:
+    if 'agent_id' in span.attributes:
+        return [str(span.attributes['agent_id'])]
+    return [str(a) for a in span.attributes.get('agent_ids', [])]
+
+def _otlp_value(value) -> Dict:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    if isinstance(value, (list, tuple)):
+        return {'arrayValue': {'values': [_otlp_value(v) for v in value]}}
+    return {'stringValue': str(value)}
+
+def _otlp_attributes(attributes: Dict) -> List[Dict]:
+    return [{'key': key, 'value': _otlp_value(value)} for key, value in attributes.items()]
+
+def to_otlp(traces: List[Trace]) -> Dict:
+    """Traces as an OTLP/JSON ExportTraceServiceRequest"""
+    spans = []
+    for trace in traces:
+        for span in list(trace.spans):
+            otlp_span = {
+                'traceId': span.trace_id,
+                'spanId': span.span_id,
+                'name': span.name,
+                'kind': 1,  # SPAN_KIND_INTERNAL
+                'startTimeUnixNano': str(span.start_ns),
+                'endTimeUnixNano': str(span.end_ns or span.start_ns),
+                'attributes': _otlp_attributes({**span.attributes, 'thread.id': span.thread_id}),
+                'status': {'code': 2, 'message': span.error} if span.error else {'code': 1}
+            }
+            if span.parent_id:
+                otlp_span['parentSpanId'] = span.parent_id
+            spans.append(otlp_span)
+    return {'resourceSpans': [{
+        'resource': {'attributes': _otlp_attributes({'service.name': SERVICE_NAME})},
+        'scopeSpans': [{'scope': {'name': 'orchestrator'}, 'spans': spans}]
+    }]}
+
+def to_chrome(traces: List[Trace]) -> Dict:
+    """Traces in the Chrome trace event format, for chrome://tracing or Perfetto"""
+    events = []
+    for trace in traces:
+        for span in list(trace.spans):
+            end_ns = span.end_ns or span.start_ns
+            events.append({
+                'name': span.name,
+                'cat': trace.root.name,
+                'ph': 'X',
+                'ts': span.start_ns / 1000,
+                'dur': (end_ns - span.start_ns) / 1000,
+                'pid': 1,
+                'tid': span.thread_id,
+                'args': {**span.attributes, 'trace_id': span.trace_id, **({'error': span.error} if span.error else {})}
+            })
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+tracer = Tracer()
+span = tracer.span
+traced = tracer.traced